@@ -0,0 +1,140 @@
+import math
+import threading
+import logging
+from typing import Dict, List, Optional
+from config import STAGE_RTF_DEFAULTS, STAGE_RTF_SMOOTHING, API_MAX_ACTIVE_JOBS, API_MAX_CONCURRENT_UPLOADS, MAX_CONCURRENT_JOBS
+
+logger = logging.getLogger(__name__)
+
+# Thứ tự các bước của pipeline, trùng với tên bước JobControl.stage trong main.py
+PIPELINE_STAGES = ("decode", "vad", "denoise", "transcription", "correction", "translation", "embed")
+
+
+class StageRTFEstimator:
+    """
+    Hệ số thời gian thực (giây xử lý / giây audio) của từng bước, khởi tạo từ config.STAGE_RTF_DEFAULTS
+    và cập nhật bằng trung bình trượt mũ sau mỗi job hoàn thành.
+    """
+    def __init__(self, defaults: Dict[str, float] = STAGE_RTF_DEFAULTS, smoothing: float = STAGE_RTF_SMOOTHING):
+        self.rtf = dict(defaults)
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+
+    def observe(self, stage_seconds: Dict[str, float], audio_seconds: float) -> None:
+        if audio_seconds <= 0:
+            return
+        with self._lock:
+            for stage, seconds in stage_seconds.items():
+                if stage not in PIPELINE_STAGES:
+                    continue
+                measured = seconds / audio_seconds
+                previous = self.rtf.get(stage)
+                self.rtf[stage] = measured if previous is None else previous + self.smoothing * (measured - previous)
+            rounded = {stage: round(rtf, 3) for stage, rtf in self.rtf.items()}
+        logger.info(f"Updated stage RTFs: {rounded}")
+
+    @staticmethod
+    def job_stages(job: Dict) -> List[str]:
+        """
+        Các bước job sẽ chạy theo tham số của nó.
+        """
+        stages = ["decode", "vad", "denoise", "transcription"]
+        if job.get("use_correction", True):
+            stages.append("correction")
+        if job.get("origin_language") != job.get("translate_language"):
+            stages.append("translation")
+        if job.get("embed_subtitle") in ("soft", "hard") and (job.get("metadata") or {}).get("is_video"):
+            stages.append("embed")
+        return stages
+
+    def remaining_seconds(self, job: Dict) -> float:
+        """
+        Thời gian xử lý còn lại ước lượng của job: độ dài audio (validate_file) nhân tổng RTF các bước chưa xong.
+        Bước đang chạy được tính là còn nguyên.
+        """
+        duration = float((job.get("metadata") or {}).get("duration") or 0)
+        stages = self.job_stages(job)
+        current = job.get("stage")
+        if job.get("status") == "PROCESSING" and current in stages:
+            stages = stages[stages.index(current):]
+        with self._lock:
+            return duration * sum(self.rtf.get(stage, 0.0) for stage in stages)
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            return dict(self.rtf)
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after: int, detail: str):
+        super().__init__(detail)
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class AdmissionController:
+    """
+    Giới hạn tải của API: tối đa max_active_jobs job đang chờ + đang chạy trong hàng đợi và tối đa
+    max_concurrent_uploads request đang nhận dữ liệu cùng lúc. Khi quá tải, QueueFull mang Retry-After
+    (giây) ước lượng từ công việc còn lại của hàng đợi.
+    """
+    def __init__(self, db, estimator: StageRTFEstimator, max_active_jobs: int = API_MAX_ACTIVE_JOBS, max_concurrent_uploads: int = API_MAX_CONCURRENT_UPLOADS, job_slots: int = MAX_CONCURRENT_JOBS):
+        self.db = db
+        self.estimator = estimator
+        self.max_active_jobs = max_active_jobs
+        self.max_concurrent_uploads = max_concurrent_uploads
+        self.job_slots = max(1, job_slots)
+        self._uploads = 0
+        self._lock = threading.Lock()
+
+    def queue_eta(self, jobs: Optional[List[Dict]] = None) -> Dict:
+        """
+        Ước lượng hàng đợi: tổng thời gian xử lý còn lại, và thời gian tới khi một chỗ trong hàng đợi được giải phóng
+        (job đang chạy sớm xong nhất; chưa có job nào chạy thì chia đều tổng công việc cho các slot).
+        """
+        jobs = self.db.get_active_files() if jobs is None else jobs
+        remaining = [self.estimator.remaining_seconds(job) for job in jobs]
+        processing = [r for job, r in zip(jobs, remaining) if job["status"] == "PROCESSING"]
+        total = sum(remaining)
+        next_slot = min(processing) if processing else total / self.job_slots
+        return {"active_jobs": len(jobs), "remaining_seconds": total, "next_slot_seconds": next_slot}
+
+    def job_eta(self, job_id: int) -> Optional[float]:
+        """
+        Thời gian ước lượng tới khi job xong: phần còn lại của các job đứng trước (đang chờ hoặc đang chạy)
+        chia cho số slot, cộng phần còn lại của chính nó. Job đang chạy không chờ các job khác.
+        """
+        jobs = self.db.get_active_files()
+        for index, job in enumerate(jobs):
+            if job["id"] == job_id:
+                if job["status"] == "PROCESSING":
+                    return self.estimator.remaining_seconds(job)
+                ahead = sum(self.estimator.remaining_seconds(other) for other in jobs[:index] if other["status"] in ("PENDING", "PROCESSING"))
+                return ahead / self.job_slots + self.estimator.remaining_seconds(job)
+        return None
+
+    def check_queue(self) -> None:
+        jobs = self.db.get_active_files()
+        if len(jobs) < self.max_active_jobs:
+            return
+        eta = self.queue_eta(jobs)
+        retry_after = max(1, math.ceil(eta["next_slot_seconds"]))
+        logger.warning(f"Rejecting request: {len(jobs)} active jobs, {eta['remaining_seconds']:.0f}s of queued work, retry after {retry_after}s")
+        raise QueueFull(retry_after, f"Job queue is full ({len(jobs)} active jobs)")
+
+    def acquire_upload(self) -> None:
+        """
+        Giữ một chỗ nhận dữ liệu; phải gọi release_upload khi request kết thúc.
+        """
+        with self._lock:
+            if self._uploads < self.max_concurrent_uploads:
+                self._uploads += 1
+                return
+        eta = self.queue_eta()
+        # Một request tải lên thường xong trước job; gợi ý thử lại sớm, không vượt quá thời gian giải phóng hàng đợi
+        retry_after = max(1, min(30, math.ceil(eta["next_slot_seconds"])))
+        raise QueueFull(retry_after, f"Too many concurrent uploads ({self.max_concurrent_uploads})")
+
+    def release_upload(self) -> None:
+        with self._lock:
+            self._uploads = max(0, self._uploads - 1)
@@ -1,13 +1,21 @@
 import os
 import logging
 import time
+import shutil
+import threading
 from datetime import datetime
 from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request
-from fastapi.responses import FileResponse, JSONResponse, HTMLResponse
+from fastapi.responses import FileResponse, JSONResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from main import AudioTranscriptionService
-from config import OUTPUT_FOLDER, LANGUAGE_MAP
+from job_worker import JobWorker
+from upload_store import UploadStore, UploadOffsetMismatch
+from admission import AdmissionController, QueueFull
+from job_progress import progress_hub, ProgressHub
+from database import TERMINAL_STATUSES
+from denoiser_backends import DENOISE_BACKENDS
+from config import OUTPUT_FOLDER, UPLOAD_FOLDER, LANGUAGE_MAP, DENOISE_BACKEND, PROGRESS_HEARTBEAT_SEC
 import asyncio
 import subprocess
 import magic
@@ -34,8 +42,11 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory='static'), name='static')
 app.mount("/output", StaticFiles(directory=OUTPUT_FOLDER), name='output')
 
-# Khởi tạo service
+# Khởi tạo service; job worker được khởi động cùng ứng dụng
 service = AudioTranscriptionService()
+job_worker = None
+upload_store = UploadStore()
+admission = AdmissionController(service.db, service.rtf_estimator, job_slots=service.max_concurrent_jobs)
 
 def validate_file(file_path: str) -> dict:
     """Kiểm tra định dạng file và metadata bằng ffprobe."""
@@ -82,88 +93,326 @@ async def read_root():
     with open("index.html", "r", encoding='utf-8') as f:
         return f.read()
 
-@app.post("/process")
+def output_name(path: str) -> str:
+    """
+    Đường dẫn tương đối của file kết quả trong OUTPUT_FOLDER (ví dụ "job_12/video_vi_en.vtt"), dùng cho /download và /output.
+    """
+    return os.path.relpath(path, OUTPUT_FOLDER).replace(os.sep, "/")
+
+def job_artifacts(job: dict) -> dict:
+    """
+    Các file kết quả của job đã hoàn thành, dạng đường dẫn trong OUTPUT_FOLDER như giao diện web sử dụng.
+    """
+    result = job.get("result") or {}
+    artifacts = {"message": "Processed successfully", "video_with_subtitle": False}
+    subtitle_paths = [p for p in result.get("subtitle_paths") or [] if p]
+    if subtitle_paths:
+        artifacts["subtitle_path"] = output_name(subtitle_paths[-1])
+    translated_paths = [p for p in result.get("translated_subtitle_paths") or [] if p]
+    if translated_paths:
+        artifacts["translated_subtitle_path"] = output_name(translated_paths[-1])
+
+    video_path = result.get("video_url")
+    if video_path and os.path.exists(video_path) and os.path.getsize(video_path) > 0:
+        artifacts["video_with_subtitle"] = True
+        artifacts["video_url"] = f"/output/{output_name(video_path)}"
+    elif job.get("embed_subtitle") == "none":
+        artifacts["message"] += " (No video with subtitle created because embed_subtitle is set to 'none')"
+    elif video_path:
+        artifacts["message"] += " (Video file created but empty)"
+    return artifacts
+
+def job_response(job: dict) -> dict:
+    response_data = {
+        "job_id": job["id"],
+        "file_name": job["file_name"],
+        "status": job["status"],
+        "stage": job.get("stage"),
+        "error": job.get("error"),
+        "target_language": LANGUAGE_MAP.get(job["translate_language"], job["translate_language"]).capitalize(),
+        "metadata": job.get("metadata"),
+        "created_at": job.get("created_at"),
+        "updated_at": job.get("updated_at"),
+        "status_url": f"/jobs/{job['id']}"
+    }
+    if job["status"] == "COMPLETED":
+        response_data.update(job_artifacts(job))
+    elif job["status"] in ("PENDING", "PROCESSING"):
+        eta = admission.job_eta(job["id"])
+        response_data["eta_seconds"] = round(eta, 1) if eta is not None else None
+    return response_data
+
+def too_many_requests(e: QueueFull) -> HTTPException:
+    return HTTPException(status_code=429, detail=e.detail, headers={"Retry-After": str(e.retry_after)})
+
+@app.on_event("startup")
+def start_job_worker():
+    # Job được xử lý trong worker thường trú của chính tiến trình API, dùng chung service và mô hình
+    global job_worker
+    job_worker = JobWorker(service=service)
+    threading.Thread(target=job_worker.run, name="job-worker", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_job_worker():
+    if job_worker is not None:
+        job_worker.stop()
+    service.shutdown()
+
+def artifacts_available(job: dict) -> bool:
+    """
+    Job đã hoàn thành chỉ được dùng lại cho yêu cầu trùng khi các file kết quả vẫn còn trong OUTPUT_FOLDER.
+    Kết quả của mỗi job nằm trong thư mục riêng (AudioTranscriptionService.job_output_dir) nên job khác
+    cùng tên file không ghi đè được.
+    """
+    result = job.get("result") or {}
+    paths = [p for p in (result.get("subtitle_paths") or []) + (result.get("translated_subtitle_paths") or []) if p]
+    if job.get("embed_subtitle") in ("soft", "hard") and (job.get("metadata") or {}).get("is_video"):
+        paths.append(result.get("video_url"))
+    return bool(paths) and all(p and os.path.exists(p) for p in paths)
+
+def enqueue_job(file_path: str, content_hash: str, origin_language: str, translate_language: str, embed_subtitle: str, denoise_backend: str) -> dict:
+    """
+    Kiểm tra file đã nằm trên đĩa rồi đưa vào hàng đợi; file thuộc về job từ lúc này (worker xóa khi job kết thúc).
+    Nếu đã có job cùng nội dung và tham số đang chạy hoặc đã xong, yêu cầu được gắn vào job đó
+    và file vừa tải lên bị xóa.
+    """
+    metadata = validate_file(file_path)
+    file_name = os.path.basename(file_path)
+    job_id, created = service.db.find_or_add_file(
+        file_name=file_name,
+        origin_language=origin_language,
+        translate_language=translate_language,
+        use_correction=True,  # Luôn sử dụng hiệu chỉnh theo yêu cầu
+        embed_subtitle=embed_subtitle,
+        denoise_backend=denoise_backend,
+        file_path=file_path,
+        metadata=metadata,
+        content_hash=content_hash,
+        is_reusable=artifacts_available
+    )
+    if job_id is None:
+        raise HTTPException(status_code=500, detail="Failed to queue job")
+    if created:
+        logger.info(f"Queued job {job_id} for {file_name} (sha256 {content_hash})")
+    else:
+        shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+        logger.info(f"Coalesced upload of {file_name} (sha256 {content_hash}) into existing job {job_id}")
+    return {**job_response(service.db.get_file(job_id)), "coalesced": not created}
+
+def check_denoise_backend(denoise_backend: str) -> None:
+    if denoise_backend not in DENOISE_BACKENDS:
+        raise HTTPException(status_code=400, detail=f"Unsupported denoise backend: {denoise_backend}")
+
+@app.post("/process", status_code=202)
 async def process_video(
     file: UploadFile = File(...),
     origin_language: str = Query("vi"),
     translate_language: str = Query("en"),
-    embed_subtitle: str = Query("none")
+    embed_subtitle: str = Query("none"),
+    denoise_backend: str = Query(DENOISE_BACKEND)
+):
+    """
+    Nhận file và đưa vào hàng đợi; trả về job_id ngay, tiến độ và kết quả lấy qua GET /jobs/{job_id}.
+    File lớn nên dùng giao thức tải lên theo khối /uploads để có thể tải tiếp khi mất kết nối.
+    """
+    logger.info(f"Queueing file: {file.filename}, origin_language={origin_language}, translate_language={translate_language}, embed_subtitle={embed_subtitle}, denoise_backend={denoise_backend}")
+    check_denoise_backend(denoise_backend)
+    # Từ chối trước khi nhận dữ liệu để file lớn không phải tải lên rồi mới bị từ chối
+    try:
+        admission.check_queue()
+        admission.acquire_upload()
+    except QueueFull as e:
+        raise too_many_requests(e)
+    # Mỗi upload có thư mục riêng để giữ tên file gốc (dùng đặt tên file phụ đề) mà không ghi đè lẫn nhau
+    _, upload_dir = upload_store.new_upload_dir()
+    file_path = os.path.join(upload_dir, os.path.basename(file.filename))
+    queued = False
+    try:
+        size, content_hash = await upload_store.save_upload_file(file, file_path)
+        logger.info(f"Received {size} bytes for {file.filename}")
+        response_data = enqueue_job(file_path, content_hash, origin_language, translate_language, embed_subtitle, denoise_backend)
+        queued = True
+        return response_data
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error queueing video: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        admission.release_upload()
+        if not queued:
+            shutil.rmtree(upload_dir, ignore_errors=True)
+
+@app.post("/uploads", status_code=201)
+async def create_upload(file_name: str = Query(...), size: int = Query(..., gt=0)):
+    """
+    Mở phiên tải lên theo khối: client gửi các khối bằng PUT /uploads/{upload_id}?offset=..., hỏi lại offset
+    bằng GET khi mất kết nối, rồi gọi POST /uploads/{upload_id}/finalize để đưa file vào hàng đợi.
+    Hàng đợi đầy thì trả về 429 khi mở phiên và khi finalize; phiên bị từ chối lúc finalize vẫn được giữ
+    để client gọi lại finalize sau Retry-After mà không phải tải lại.
+    """
+    try:
+        admission.check_queue()
+    except QueueFull as e:
+        raise too_many_requests(e)
+    try:
+        return upload_store.create(file_name, size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    try:
+        return upload_store.status(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+@app.put("/uploads/{upload_id}")
+async def put_upload_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    try:
+        admission.acquire_upload()
+    except QueueFull as e:
+        raise too_many_requests(e)
+    try:
+        return await upload_store.append(upload_id, offset, request.stream())
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadOffsetMismatch as e:
+        return JSONResponse(status_code=409, content={"detail": str(e), "offset": e.offset})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        admission.release_upload()
+
+@app.delete("/uploads/{upload_id}")
+async def delete_upload(upload_id: str):
+    try:
+        upload_store.discard(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return {"upload_id": upload_id, "deleted": True}
+
+@app.post("/uploads/{upload_id}/finalize", status_code=202)
+async def finalize_upload(
+    upload_id: str,
+    origin_language: str = Query("vi"),
+    translate_language: str = Query("en"),
+    embed_subtitle: str = Query("none"),
+    denoise_backend: str = Query(DENOISE_BACKEND)
 ):
-    logger.info(f"Processing file: {file.filename}, origin_language={origin_language}, translate_language={translate_language}, embed_subtitle={embed_subtitle}")
+    check_denoise_backend(denoise_backend)
+    try:
+        # Số phiên mở không bị giới hạn nên hàng đợi chỉ thực sự bị chặn nếu kiểm tra lại khi job được tạo
+        admission.check_queue()
+    except QueueFull as e:
+        raise too_many_requests(e)
+    try:
+        file_path, content_hash = await upload_store.finalize(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadOffsetMismatch as e:
+        return JSONResponse(status_code=409, content={"detail": "Upload incomplete", "offset": e.offset})
+    queued = False
     try:
-        file_path = os.path.join("/tmp", file.filename)
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
-        
-        # Kiểm tra file
-        metadata = validate_file(file_path)
-        
-        # Chạy xử lý với timeout
-        result = await asyncio.wait_for(
-            asyncio.to_thread(
-                service.process_single_file,
-                audio_path=file_path,
-                origin_language=origin_language,
-                translate_language=translate_language,
-                use_correction=True,  # Luôn sử dụng hiệu chỉnh theo yêu cầu
-                embed_subtitle=embed_subtitle,
-                metadata=metadata
-            ),
-            timeout=600
-        )
-
-        if not result:
-            raise HTTPException(status_code=500, detail="Failed to process video")
-
-        if "video_url" in result:
-            max_attempts = 5
-            for attempt in range(max_attempts):
-                if os.path.exists(result["video_url"]) and os.path.getsize(result["video_url"]) > 0:
-                    logger.info(f"Video file ready after {attempt + 1} attempts: {result['video_url']}")
-                    break
-                logger.warning(f"Video file not ready (attempt {attempt + 1}/{max_attempts}): {result['video_url']}")
-                time.sleep(1)
-            else:
-                logger.error(f"Video file not ready after {max_attempts} attempts: {result['video_url']}")
-                raise HTTPException(status_code=500, detail='Video file not ready')
-
-        response_data = {
-            "message": "Processed successfully",
-            "subtitle_path": os.path.basename(result["subtitle_path"]),
-            "target_language": LANGUAGE_MAP.get(translate_language, translate_language).capitalize(),
-            "metadata": metadata
-        }
-        if "translated_subtitle_path" in result and result["translated_subtitle_path"]:
-            response_data["translated_subtitle_path"] = os.path.basename(result["translated_subtitle_path"])
-
-        if "video_url" in result and os.path.exists(result["video_url"]):
-            if os.path.getsize(result["video_url"]) > 0:
-                response_data["video_with_subtitle"] = True
-                response_data["video_url"] = f"/output/{os.path.basename(result['video_url'])}"
-                logger.info(f"Video file found and valid at: {result['video_url']} (Size: {os.path.getsize(result['video_url'])} bytes)")
-            else:
-                logger.warning(f"Video file is empty: {result['video_url']}")
-                response_data["video_with_subtitle"] = False
-                response_data["message"] += " (Video file created but empty)"
-        else:
-            response_data["video_with_subtitle"] = False
-            if embed_subtitle == "none":
-                response_data["message"] += " (No video with subtitle created because embed_subtitle is set to 'none')"
-                logger.info("No video with subtitle created because embed_subtitle is set to 'none'")
-            else:
-                logger.warning("Video with subtitle not created")
-
-        return JSONResponse(content=response_data)
-
-    except asyncio.TimeoutError:
-        logger.error(f"Processing timeout for file: {file.filename}")
-        raise HTTPException(status_code=504, detail="Processing took too long")
+        response_data = enqueue_job(file_path, content_hash, origin_language, translate_language, embed_subtitle, denoise_backend)
+        queued = True
+        return response_data
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error processing video: {str(e)}")
+        logger.error(f"Error queueing upload {upload_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
     finally:
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        if not queued:
+            shutil.rmtree(os.path.dirname(file_path), ignore_errors=True)
+
+@app.get("/queue")
+async def get_queue():
+    """
+    Tình trạng hàng đợi và hệ số thời gian thực hiện tại của từng bước.
+    """
+    eta = admission.queue_eta()
+    return {
+        "active_jobs": eta["active_jobs"],
+        "max_active_jobs": admission.max_active_jobs,
+        "job_slots": admission.job_slots,
+        "remaining_seconds": round(eta["remaining_seconds"], 1),
+        "next_slot_seconds": round(eta["next_slot_seconds"], 1),
+        "stage_rtf": admission.estimator.snapshot()
+    }
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: int):
+    job = service.db.get_file(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(job)
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: int):
+    """
+    Server-Sent Events của job: "stage" khi chuyển bước, "progress" (phần trăm theo số giây audio đã phiên âm),
+    "cue" cho từng cue Whisper vừa tạo, và "status" (giống GET /jobs/{job_id}) lúc đầu và khi job kết thúc.
+    """
+    if service.db.get_file(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def events():
+        # Đăng ký trước khi đọc trạng thái để không lỡ sự kiện xảy ra giữa hai bước
+        subscriber, replay = progress_hub.subscribe(job_id)
+        try:
+            job = service.db.get_file(job_id)
+            yield ProgressHub.format_sse({"event": "status", "data": job_response(job)})
+            if job["status"] in TERMINAL_STATUSES:
+                return
+            for message in replay:
+                yield ProgressHub.format_sse(message)
+            _, queue = subscriber
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=PROGRESS_HEARTBEAT_SEC)
+                except asyncio.TimeoutError:
+                    # Job có thể do worker ở tiến trình khác xử lý hoặc bị hủy khi đang chờ: đọc lại trạng thái
+                    job = service.db.get_file(job_id)
+                    if job is None or job["status"] in TERMINAL_STATUSES:
+                        if job is not None:
+                            yield ProgressHub.format_sse({"event": "status", "data": job_response(job)})
+                        return
+                    yield ": keep-alive\n\n"
+                    continue
+                if message["event"] == "status":
+                    # Trạng thái cuối lấy từ database để có đủ các file kết quả
+                    yield ProgressHub.format_sse({"event": "status", "data": {**job_response(service.db.get_file(job_id)), **message["data"]}})
+                    return
+                yield ProgressHub.format_sse(message)
+        finally:
+            progress_hub.unsubscribe(job_id, subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int):
+    """
+    Hủy job: job đang chờ bị hủy ngay, job đang chạy dừng ở bước kiểm tra kế tiếp của pipeline.
+    Job được gộp từ nhiều yêu cầu chỉ bị hủy khi yêu cầu cuối cùng hủy.
+    """
+    status = service.db.request_cancel(job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if status in ("PENDING", "PROCESSING"):
+        # Job còn phục vụ yêu cầu khác được gộp vào (request_count): chỉ gỡ yêu cầu này, job tiếp tục chạy
+        logger.info(f"Detached one request from shared job {job_id}")
+        return {**job_response(service.db.get_file(job_id)), "detached": True}
+    if status not in ("CANCELLED", "CANCELLING"):
+        raise HTTPException(status_code=409, detail=f"Job already finished with status {status}")
+    logger.info(f"Cancellation requested for job {job_id}: {status}")
+    job = service.db.get_file(job_id)
+    if status == "CANCELLED":
+        # Job chưa chạy nên không có worker nào báo kết thúc hay xóa file tải lên của nó
+        UploadStore.remove_job_file(job.get("file_path"))
+        progress_hub.publish(job_id, "status", {"status": status, "error": None})
+    return job_response(job)
 
 @app.get("/list_processed_videos")
 async def list_processed_videos():
@@ -172,35 +421,37 @@ async def list_processed_videos():
         videos = []
         video_extensions = (".mp4", ".mkv", ".avi", ".mov")
 
-        for fname in os.listdir(OUTPUT_FOLDER):
-            if fname.lower().endswith(video_extensions):
-                file_path = os.path.join(OUTPUT_FOLDER, fname)
-                base_name = os.path.splitext(fname)[0]
-                subtitle_files = [
-                    f for f in os.listdir(OUTPUT_FOLDER)
-                    if f.startswith(base_name) and f.endswith((".vtt", ".srt"))
-                ]
-
-                language = translate_language if translate_language else "unknown"
-                subtitle_path = None
-                if subtitle_files:
-                    subtitle_file = subtitle_files[0]
-                    subtitle_path = subtitle_file
-                    parts = os.path.splitext(subtitle_file)[0].split('_')
-                    if len(parts) >= 3:
-                        origin = parts[-2]
-                        translate = parts[-1]
-                        language = f"origin:{origin},translate:{translate}"
-
-                video_info = {
-                    "filename": fname,
-                    "path": f"/output/{fname}",
-                    "size": os.path.getsize(file_path),
-                    "created_at": time.ctime(os.path.getctime(file_path)),
-                    "language": language,
-                    "subtitle_path": f"/output/{subtitle_path}" if subtitle_path else "none"
-                }
-                videos.append(video_info)
+        # Kết quả cũ nằm thẳng trong OUTPUT_FOLDER, kết quả của job nằm trong thư mục job_<id> riêng
+        for directory, _, fnames in os.walk(OUTPUT_FOLDER):
+            for fname in fnames:
+                if fname.lower().endswith(video_extensions):
+                    file_path = os.path.join(directory, fname)
+                    base_name = os.path.splitext(fname)[0]
+                    subtitle_files = [
+                        f for f in fnames
+                        if f.startswith(base_name) and f.endswith((".vtt", ".srt"))
+                    ]
+
+                    language = translate_language if translate_language else "unknown"
+                    subtitle_path = None
+                    if subtitle_files:
+                        subtitle_file = subtitle_files[0]
+                        subtitle_path = output_name(os.path.join(directory, subtitle_file))
+                        parts = os.path.splitext(subtitle_file)[0].split('_')
+                        if len(parts) >= 3:
+                            origin = parts[-2]
+                            translate = parts[-1]
+                            language = f"origin:{origin},translate:{translate}"
+
+                    video_info = {
+                        "filename": fname,
+                        "path": f"/output/{output_name(file_path)}",
+                        "size": os.path.getsize(file_path),
+                        "created_at": time.ctime(os.path.getctime(file_path)),
+                        "language": language,
+                        "subtitle_path": f"/output/{subtitle_path}" if subtitle_path else "none"
+                    }
+                    videos.append(video_info)
 
         if not videos:
             return {"message": "No processed videos found", "videos": []}
@@ -211,19 +462,23 @@ async def list_processed_videos():
         logger.error(f"Error listing videos: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error listing videos: {str(e)}")
 
-@app.get("/download/{filename}")
+@app.get("/download/{filename:path}")
 async def download_file(filename: str):
     if filename == "undefined":
         raise HTTPException(status_code=400, detail="Invalid filename")
 
-    file_path = os.path.join(OUTPUT_FOLDER, filename)
-    if not os.path.exists(file_path):
+    # filename có thể gồm thư mục của job (job_<id>/...), nhưng không được trỏ ra ngoài OUTPUT_FOLDER
+    output_root = os.path.realpath(OUTPUT_FOLDER)
+    file_path = os.path.realpath(os.path.join(output_root, filename))
+    if os.path.commonpath([output_root, file_path]) != output_root:
+        raise HTTPException(status_code=400, detail="Invalid filename")
+    if not os.path.isfile(file_path):
         raise HTTPException(status_code=404, detail='File not found')
 
     return FileResponse(
         path=file_path,
         media_type='application/octet-stream',
-        filename=filename
+        filename=os.path.basename(file_path)
     )
 
 if __name__ == "__main__":
@@ -0,0 +1,85 @@
+import logging
+import numpy as np
+from typing import Callable, Optional, Union
+from config import SAMPLE_RATE, TRANSCRIPTION_CACHE_ENABLED, ASR_ENGINE, WHISPER_MODEL, WHISPER_MODEL_DIR, CT2_CPU_THREADS
+from audio_decoder import decode_audio
+from transcription_cache import TranscriptionCache
+
+logger = logging.getLogger(__name__)
+
+class BaseTranscriber:
+    """
+    Giao diện chung cho các engine ASR. Lớp con chỉ cần cài đặt `_transcribe`, trả về
+    danh sách {"text", "start", "end", "words"}; giải mã đầu vào và cache được xử lý ở đây.
+    Engine giải mã dần từng segment gọi on_segment ngay khi có segment; engine khác để
+    transcribe_audio gọi on_segment cho mọi segment sau khi xong.
+    """
+    streams_segments = False
+    engine_name = "base"
+
+    def __init__(self):
+        self.cache = TranscriptionCache() if TRANSCRIPTION_CACHE_ENABLED else None
+
+    @property
+    def model_name(self) -> str:
+        raise NotImplementedError
+
+    def _transcribe(self, audio: np.ndarray, language: str, decode_options: dict, on_segment: Optional[Callable[[dict], None]] = None) -> list:
+        raise NotImplementedError
+
+    def transcribe_audio(self, audio: Union[str, np.ndarray], language: str = "vi", clip_timestamps: Optional[list] = None, on_segment: Optional[Callable[[dict], None]] = None) -> list:
+        """
+        clip_timestamps: danh sách phẳng [start1, end1, ...] (giây) các vùng tiếng nói; engine chỉ giải mã
+        trong các vùng này và timestamp trả về vẫn nằm trên trục thời gian gốc của audio.
+        on_segment: gọi với từng segment {"text", "start", "end", "words"} theo thứ tự thời gian, sớm nhất có thể.
+        """
+        try:
+            if isinstance(audio, np.ndarray):
+                # Buffer 16 kHz mono float32 đã giải mã sẵn, engine không cần gọi lại ffmpeg
+                logger.info(f"Transcribing {len(audio) / SAMPLE_RATE:.2f}s audio buffer with {self.engine_name}, language {language}")
+                audio = np.ascontiguousarray(audio, dtype=np.float32)
+            else:
+                logger.info(f"Transcribing audio: {audio} with {self.engine_name}, language {language}")
+                audio = decode_audio(audio, sample_rate=SAMPLE_RATE)
+
+            decode_options = {"word_timestamps": True, "temperature": 0.0}
+            if clip_timestamps:
+                decode_options["clip_timestamps"] = [float(t) for t in clip_timestamps]
+                speech_seconds = sum(clip_timestamps[1::2]) - sum(clip_timestamps[0::2])
+                logger.info(f"Restricting decoding to {len(clip_timestamps) // 2} speech regions ({speech_seconds:.2f}s of {len(audio) / SAMPLE_RATE:.2f}s)")
+            cache_key = None
+            if self.cache is not None:
+                cache_key = TranscriptionCache.make_key(audio, f"{self.engine_name}:{self.model_name}", language, decode_options)
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    logger.info(f"Transcription loaded from cache with {len(cached)} segments")
+                    if on_segment is not None:
+                        for segment in cached:
+                            on_segment(segment)
+                    return cached
+
+            transcribed_text = self._transcribe(audio, language, decode_options, on_segment if self.streams_segments else None)
+            if on_segment is not None and not self.streams_segments:
+                for segment in transcribed_text:
+                    on_segment(segment)
+            logger.info(f"Transcription completed with {len(transcribed_text)} segments")
+            if cache_key is not None:
+                self.cache.put(cache_key, transcribed_text)
+            return transcribed_text
+        except Exception as e:
+            logger.error(f"Error transcribing audio: {str(e)}")
+            raise Exception(f"Error transcribing audio: {str(e)}")
+
+
+def create_transcriber(engine: str = ASR_ENGINE, cpu_threads: int = CT2_CPU_THREADS) -> BaseTranscriber:
+    """
+    Tạo transcriber theo engine cấu hình trong config.ASR_ENGINE ("openai" hoặc "ctranslate2").
+    cpu_threads: số luồng của CTranslate2 (engine openai dùng số luồng torch của tiến trình).
+    """
+    if engine == "openai":
+        from whisper_model_openai import WhisperOpenAITranscriber
+        return WhisperOpenAITranscriber(model_name=WHISPER_MODEL, directory=WHISPER_MODEL_DIR)
+    if engine == "ctranslate2":
+        from whisper_model_ctranslate2 import WhisperCTranslate2Transcriber
+        return WhisperCTranslate2Transcriber(cpu_threads=cpu_threads)
+    raise ValueError(f"Unsupported ASR engine: {engine}")
@@ -0,0 +1,137 @@
+import os
+import subprocess
+import threading
+import logging
+from typing import Iterator
+import numpy as np
+from scipy.io import wavfile
+from config import SAMPLE_RATE
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK_BYTES = 1 << 20
+
+
+def _ffmpeg_decode_cmd(input_path: str, sample_rate: int) -> list:
+    return [
+        "ffmpeg", "-nostdin", "-loglevel", "error", "-threads", "0",
+        "-i", input_path, "-vn",
+        "-f", "f32le", "-acodec", "pcm_f32le", "-ac", "1", "-ar", str(sample_rate),
+        "-"
+    ]
+
+
+class _StderrDrain:
+    """
+    Đọc stderr của ffmpeg trên một luồng riêng để pipe stderr không bao giờ đầy (ffmpeg sẽ bị chặn
+    khi ghi thêm log, trong khi ta đang chờ stdout) với file hỏng sinh nhiều cảnh báo.
+    """
+    def __init__(self, stream):
+        self._stream = stream
+        self._chunks = []
+        self._thread = threading.Thread(target=self._run, name="ffmpeg-stderr", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        for chunk in iter(lambda: self._stream.read(4096), b""):
+            self._chunks.append(chunk)
+
+    def read(self) -> bytes:
+        self._thread.join()
+        return b"".join(self._chunks)
+
+
+def decode_audio(input_path: str, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """
+    Giải mã audio/video một lần duy nhất bằng ffmpeg thành mảng float32 mono.
+
+    Kết quả được dùng chung cho VAD, khử nhiễu và Whisper, không ghi file WAV trung gian.
+    """
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Input file not found: {input_path}")
+
+    cmd = _ffmpeg_decode_cmd(input_path, sample_rate)
+    logger.info(f"Decoding audio to {sample_rate} Hz mono float32: {input_path}")
+    buffer = bytearray()
+    try:
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE) as proc:
+            stderr_drain = _StderrDrain(proc.stderr)
+            # Đọc trực tiếp vào bytearray để mảng numpy trả về có thể ghi mà không cần copy thêm
+            while True:
+                chunk = proc.stdout.read(READ_CHUNK_BYTES)
+                if not chunk:
+                    break
+                buffer.extend(chunk)
+            returncode = proc.wait()
+            stderr = stderr_drain.read()
+    except OSError as e:
+        logger.error(f"Failed to start ffmpeg: {str(e)}")
+        raise RuntimeError(f"Failed to start ffmpeg: {str(e)}")
+
+    if returncode != 0:
+        message = stderr.decode("utf-8", errors="ignore").strip()
+        logger.error(f"ffmpeg failed to decode {input_path}: {message}")
+        raise RuntimeError(f"Failed to decode audio: {message}")
+
+    audio = np.frombuffer(buffer, dtype=np.float32)
+    logger.info(f"Decoded {len(audio) / sample_rate:.2f}s of audio from {input_path}")
+    return audio
+
+
+def iter_decode_audio(input_path: str, sample_rate: int = SAMPLE_RATE, chunk_samples: int = READ_CHUNK_BYTES // 4) -> Iterator[np.ndarray]:
+    """
+    Giải mã dạng streaming: trả về lần lượt các khối float32 mono (tối đa chunk_samples mẫu)
+    ngay khi ffmpeg xuất ra, bộ nhớ không phụ thuộc độ dài file. Dừng vòng lặp sớm sẽ dừng ffmpeg.
+    """
+    if not os.path.exists(input_path):
+        raise FileNotFoundError(f"Input file not found: {input_path}")
+
+    logger.info(f"Streaming audio at {sample_rate} Hz mono float32: {input_path}")
+    try:
+        proc = subprocess.Popen(_ffmpeg_decode_cmd(input_path, sample_rate), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        logger.error(f"Failed to start ffmpeg: {str(e)}")
+        raise RuntimeError(f"Failed to start ffmpeg: {str(e)}")
+
+    stderr_drain = _StderrDrain(proc.stderr)
+    chunk_bytes = chunk_samples * 4
+    pending = b""
+    finished = False
+    try:
+        while True:
+            data = proc.stdout.read(chunk_bytes - len(pending))
+            if not data:
+                break
+            pending += data
+            # Chỉ trả về khi đủ khối hoàn chỉnh (read trên pipe có thể trả về ít byte hơn yêu cầu)
+            if len(pending) == chunk_bytes:
+                yield np.frombuffer(pending, dtype=np.float32).copy()
+                pending = b""
+        usable = len(pending) - len(pending) % 4
+        if usable:
+            yield np.frombuffer(pending[:usable], dtype=np.float32).copy()
+        returncode = proc.wait()
+        stderr = stderr_drain.read()
+        finished = True
+    finally:
+        if not finished:
+            proc.kill()
+            proc.wait()
+            stderr_drain.read()
+        proc.stdout.close()
+        proc.stderr.close()
+
+    if returncode != 0:
+        message = stderr.decode("utf-8", errors="ignore").strip()
+        logger.error(f"ffmpeg failed to decode {input_path}: {message}")
+        raise RuntimeError(f"Failed to decode audio: {message}")
+
+
+def save_wav(output_path: str, audio: np.ndarray, sample_rate: int = SAMPLE_RATE) -> str:
+    """
+    Lưu mảng float32 mono thành file WAV PCM 16-bit.
+    """
+    samples = np.clip(audio, -1.0, 1.0)
+    wavfile.write(output_path, sample_rate, (samples * 32767).astype(np.int16))
+    logger.info(f"Saved audio to: {output_path}")
+    return output_path
@@ -1,11 +1,80 @@
 import numpy as np
 import noisereduce as nr
+from speech_timeline import to_boundaries
+from config import DENOISE_NOISE_PROFILE_SEC, DENOISE_SNR_THRESHOLD_DB, DENOISE_SKIP_SNR_DB, DENOISE_SKIP_NOISE_DBFS
+
+def speech_mask(num_samples, boundaries):
+    """
+    Mặt nạ bool độ dài num_samples, True tại các mẫu nằm trong một đoạn tiếng nói của VAD
+    (boundaries: mảng (n, 2) [start, end] theo mẫu).
+    """
+    boundaries = np.clip(to_boundaries(boundaries), 0, num_samples)
+    marks = np.zeros(num_samples + 1, dtype=np.int32)
+    np.add.at(marks, boundaries[:, 0], 1)
+    np.add.at(marks, boundaries[:, 1], -1)
+    return np.cumsum(marks[:-1]) > 0
+
+
+def noise_stats(waveform, mask, layout, frame_length=512):
+    """
+    Ước lượng SNR (dB) và mức nhiễu nền (dBFS) cho từng đoạn [start, end) trong layout.
+    Năng lượng khung và nhãn tiếng nói/không tiếng nói được tính một lần cho cả buffer, tổng theo
+    đoạn lấy từ cumsum nên chi phí không phụ thuộc số đoạn. Đoạn không có khung không tiếng nói
+    trả về NaN, đoạn không có tiếng nói trả về SNR = -inf.
+    """
+    n_frames = len(waveform) // frame_length
+    frames = waveform[:n_frames * frame_length].reshape(n_frames, frame_length)
+    energy = np.mean(np.square(frames, dtype=np.float64), axis=1)
+    speech = mask[:n_frames * frame_length].reshape(n_frames, frame_length).mean(axis=1) >= 0.5
+
+    def prefix(values):
+        return np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+
+    speech_energy, speech_count = prefix(energy * speech), prefix(speech)
+    noise_energy, noise_count = prefix(energy * ~speech), prefix(~speech)
+    bounds = np.asarray(layout, dtype=np.int64).reshape(-1, 2) // frame_length
+    lo = np.minimum(bounds[:, 0], n_frames)
+    hi = np.clip(bounds[:, 1], lo, n_frames)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speech_power = (speech_energy[hi] - speech_energy[lo]) / (speech_count[hi] - speech_count[lo])
+        noise_power = (noise_energy[hi] - noise_energy[lo]) / (noise_count[hi] - noise_count[lo])
+        noise_dbfs = 10 * np.log10(noise_power)
+        snr_db = 10 * np.log10(speech_power / noise_power)
+    snr_db[np.isnan(speech_power)] = -np.inf
+    return snr_db, noise_dbfs
+
+
+def needs_denoising(snr_db, noise_dbfs, skip_snr_db=DENOISE_SKIP_SNR_DB, noise_floor_dbfs=DENOISE_SKIP_NOISE_DBFS):
+    """
+    Quyết định có cần khử nhiễu không: bỏ qua khi nhiễu nền dưới noise_floor_dbfs hoặc SNR đủ cao.
+    Không ước lượng được (NaN, ví dụ không có vùng im lặng) thì vẫn khử nhiễu cho an toàn.
+    """
+    if np.isnan(noise_dbfs) or np.isnan(snr_db):
+        return True
+    return noise_dbfs >= noise_floor_dbfs and snr_db < skip_snr_db
+
+
+def plan_chunk_skips(waveform, mask, layout):
+    """
+    Mảng bool theo từng đoạn của layout: True nếu đoạn đó không cần khử nhiễu
+    (không có tiếng nói, hoặc đủ sạch theo needs_denoising).
+    """
+    snr_db, noise_dbfs = noise_stats(waveform, mask, layout)
+    return np.array([
+        snr == -np.inf or not needs_denoising(snr, noise)
+        for snr, noise in zip(snr_db, noise_dbfs)
+    ], dtype=bool)
+
 
 class AudioDenoiser:
     """
     AudioDenoiser xử lý khử nhiễu từ một waveform.
+
+    Mặc định noisereduce tự ước lượng nhiễu (non-stationary) cho mỗi lần gọi. Sau khi gọi
+    fit_noise_profile, denoiser chuyển sang chế độ stationary với mẫu nhiễu lấy một lần từ
+    các vùng không có tiếng nói và dùng lại cho mọi đoạn của file.
     """
-    def __init__(self, sample_rate=16000, prop_reduce=1.0, n_fft=2048, win_length=2048, hop_length=512):
+    def __init__(self, sample_rate=16000, prop_reduce=1.0, n_fft=2048, win_length=2048, hop_length=512, noise_profile=None):
         """
         Args:
             sample_rate (int): Tốc độ mẫu của âm thanh.
@@ -13,12 +82,31 @@ class AudioDenoiser:
             n_fft (int): Kích thước biến đổi Fourirer.
             win_length (int): Kích thước khung phân tích.
             hop_length (int): Khoảng dịch khung.
+            noise_profile (np.ndarray): Mẫu nhiễu cho chế độ stationary (None = non-stationary).
         """
         self.sample_rate = sample_rate
         self.prop_reduce = prop_reduce
         self.n_fft = n_fft
         self.win_length = win_length
         self.hop_length = hop_length
+        self.noise_profile = noise_profile
+
+    def fit_noise_profile(self, waveform, mask, snr_db, max_seconds=DENOISE_NOISE_PROFILE_SEC, snr_threshold_db=DENOISE_SNR_THRESHOLD_DB):
+        """
+        Ước lượng nhiễu một lần cho cả file từ các vùng VAD không có tiếng nói và chọn
+        prop_reduce theo SNR trước khi khử nhiễu (thay cho việc khử nhiễu hai lần).
+
+        Args:
+            waveform (np.ndarray): Buffer mono trên trục thời gian gốc của mask.
+            mask (np.ndarray): Mặt nạ tiếng nói theo mẫu (speech_mask).
+            snr_db (float): SNR ước lượng của cả file (noise_stats).
+            max_seconds (float): Độ dài tối đa của mẫu nhiễu giữ lại.
+            snr_threshold_db (float): Dưới ngưỡng này dùng prop_reduce = 1.0.
+        """
+        noise = waveform[~mask][:int(max_seconds * self.sample_rate)]
+        # noisereduce cần ít nhất một khung STFT nhiễu; nếu không đủ thì giữ chế độ non-stationary
+        self.noise_profile = np.ascontiguousarray(noise, dtype=np.float32) if len(noise) >= self.n_fft else None
+        self.prop_reduce = 0.8 if snr_db >= snr_threshold_db else 1.0
 
     def process(self, waveform_np):
         """
@@ -46,6 +134,8 @@ class AudioDenoiser:
         denoised = nr.reduce_noise(
             y=mono,
             sr=self.sample_rate,
+            stationary = self.noise_profile is not None,
+            y_noise = self.noise_profile,
             prop_decrease = self.prop_reduce,
             n_fft = self.n_fft,
             win_length = self.win_length,
@@ -3,19 +3,104 @@ import os
 # Input and output directories
 AUDIO_FOLDER = os.path.join("data", "input")
 OUTPUT_FOLDER = os.path.join("data", "output")
+UPLOAD_FOLDER = os.path.join("data", "uploads")  # uploads received by the API, one directory per job
+UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024  # block size for streaming uploads to disk, and chunk size suggested to clients
+UPLOAD_SESSION_TTL_SEC = 24 * 3600  # unfinished /uploads sessions idle for longer than this are removed
+
+# Audio decoding configuration
+SAMPLE_RATE = 16000
+# Denoise backend: "noisereduce", "rnnoise", "deepfilter" or "speech_denoiser" (see denoiser_backends.py)
+DENOISE_BACKEND = "noisereduce"
+# Streaming overlap-add denoising: chunk length and cross-faded overlap (seconds)
+DENOISE_SEGMENT_SEC = 20.0
+DENOISE_OVERLAP_SEC = 1.0
+# Worker processes for chunk denoising (1 = serial, 0 = all CPU cores); output is identical either way
+DENOISE_WORKERS = 1
+# Noise profile taken once per file from VAD non-speech regions (stationary noisereduce);
+# below this pre-denoise SNR the full reduction strength is used
+DENOISE_NOISE_PROFILE_SEC = 5.0
+DENOISE_SNR_THRESHOLD_DB = 20.0
+# Skip denoising files/chunks whose noise floor or SNR says they are already clean;
+# skipped audio seconds x DENOISE_ESTIMATED_RTF is reported as the estimated saving
+DENOISE_GATE_ENABLED = True
+DENOISE_SKIP_SNR_DB = 30.0
+DENOISE_SKIP_NOISE_DBFS = -60.0
+DENOISE_ESTIMATED_RTF = 0.15
 
 # Whisper model configuration
 WHISPER_MODEL = "large-v3.pt"
 WHISPER_MODEL_DIR = "/data/datn/models"
+# ASR engine: "openai" (reference PyTorch whisper) or "ctranslate2" (faster-whisper, int8 on CPU)
+# Cue trực tiếp (SSE): ctranslate2 phát từng segment ngay khi giải mã; openai phát sau mỗi cửa sổ
+# OPENAI_STREAM_WINDOW_SEC. Với INFERENCE_WORKERS > 0 cue chỉ được phát khi cả segment phiên âm xong.
+ASR_ENGINE = "openai"
+# Engine openai giải mã các vùng tiếng nói (clip_timestamps) theo từng cửa sổ khoảng này (giây) để có cue sớm;
+# văn bản cửa sổ trước làm prompt cho cửa sổ sau. 0 = giải mã cả segment trong một lần gọi
+OPENAI_STREAM_WINDOW_SEC = 60.0
+CT2_WHISPER_MODEL = "/data/datn/models/faster-whisper-large-v3"
+CT2_COMPUTE_TYPE = "int8"
+CT2_CPU_THREADS = 0  # 0 = để CTranslate2 tự chọn; với INFERENCE_WORKERS > 0 là tổng luồng chia đều cho các worker
+# On-disk cache of Whisper segments keyed by decoded PCM hash + model/language/options (LRU, size-capped)
+TRANSCRIPTION_CACHE_ENABLED = True
+TRANSCRIPTION_CACHE_DIR = os.path.join("data", "cache", "transcriptions")
+TRANSCRIPTION_CACHE_MAX_MB = 512
 
 # NLLB model configuration
 NLLB_MODEL = "/data/datn/models/nllb-200-distilled-600M"
 
+# Number of subtitle cues translated per NLLB generate call
+TRANSLATION_BATCH_SIZE = 16
+# Persistent translation memory (SQLite table next to subtitles), LRU-trimmed to this many entries
+TRANSLATION_MEMORY_ENABLED = True
+TRANSLATION_MEMORY_MAX_ENTRIES = 200000
+
 # T5 model configuration
 T5_MODEL = "/data/datn/models/t5-small"  # Sử dụng t5-small
+# Number of segments corrected per T5 generate call, and max memoized (text, language) corrections
+CORRECTION_BATCH_SIZE = 16
+CORRECTION_MEMO_SIZE = 10000
 
 # SileroVAD model configuration
 SILERO_VAD_DIR = "/data/datn/models/silero_vad"
+# VAD backend: "silero" (TorchScript, one window per call), "silero_onnx" (ONNX Runtime, batched lanes)
+# or "funasr" (FunASR fsmn-vad, batched generate over several inputs)
+VAD_BACKEND = "silero"
+VAD_ONNX_THREADS = 1  # intra-op threads of the ONNX Runtime session only
+VAD_ONNX_BATCH_LANES = 16  # contiguous lanes scored together per session.run call
+VAD_ONNX_WARMUP_WINDOWS = 32  # windows each lane runs before its own range to settle the model state
+
+# Model registry: RSS budget (MB) before idle models are evicted, <= 0 disables eviction
+MODEL_MEMORY_BUDGET_MB = 16384
+
+# Inference pool: number of worker processes each holding its own model replica (0 = run in-process),
+# torch threads per worker (0 = cpu_count // INFERENCE_WORKERS), and jobs processed concurrently by the job worker
+# (only with INFERENCE_WORKERS > 0; in-process models run one job at a time)
+INFERENCE_WORKERS = 0
+INFERENCE_THREADS_PER_WORKER = 0
+MAX_CONCURRENT_JOBS = 1
+
+# API admission control: queued + running jobs accepted before answering 429, and requests receiving upload data at once
+API_MAX_ACTIVE_JOBS = 16
+API_MAX_CONCURRENT_UPLOADS = 4
+# Initial real-time factor (processing seconds per audio second) of each pipeline stage, used for Retry-After and ETAs;
+# refined after every completed job with an exponential moving average of the measured values
+STAGE_RTF_DEFAULTS = {
+    "decode": 0.01,
+    "vad": 0.02,
+    "denoise": 0.15,
+    "transcription": 0.5,
+    "correction": 0.05,
+    "translation": 0.05,
+    "embed": 0.3,
+}
+STAGE_RTF_SMOOTHING = 0.3
+# Job progress stream (SSE): seconds between keep-alive comments, when the job status is also re-read from the database
+PROGRESS_HEARTBEAT_SEC = 15.0
+
+# Job worker: local UDP port used to wake the worker on new jobs, and fallback poll interval (seconds)
+JOB_NOTIFY_HOST = "127.0.0.1"
+JOB_NOTIFY_PORT = 47821
+JOB_POLL_INTERVAL = 1.0
 
 # Language code mapping
 LANGUAGE_MAP = {
@@ -1,9 +1,43 @@
 import sqlite3
+import socket
+import time
+import json
 import logging
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional, Tuple
+from config import JOB_NOTIFY_HOST, JOB_NOTIFY_PORT
 
 logger = logging.getLogger(__name__)
 
+def notify_new_job() -> None:
+    """
+    Đánh thức job worker đang chạy (nếu có) bằng một gói UDP cục bộ.
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(b"job", (JOB_NOTIFY_HOST, JOB_NOTIFY_PORT))
+    except OSError as e:
+        logger.debug(f"Could not notify job worker: {str(e)}")
+
+# Các cột được thêm sau phiên bản đầu của bảng subtitles, bổ sung bằng ALTER TABLE khi khởi động
+SUBTITLE_EXTRA_COLUMNS = {
+    "denoise_backend": "TEXT",
+    "file_path": "TEXT",
+    "stage": "TEXT",
+    "result": "TEXT",
+    "error": "TEXT",
+    "metadata": "TEXT",
+    "created_at": "REAL",
+    "updated_at": "REAL",
+    "content_hash": "TEXT",
+    "request_count": "INTEGER",
+}
+
+# Các cột lưu dạng JSON, được giải mã khi đọc bản ghi
+JSON_COLUMNS = ("result", "metadata")
+
+# Trạng thái kết thúc: job không còn thay đổi
+TERMINAL_STATUSES = ("COMPLETED", "FAILED", "CANCELLED")
+
 class DatabaseHandler:
     """
     DatabaseHandler để quản lý cơ sở dữ liệu SQLite về phụ đề.
@@ -32,30 +66,130 @@ class DatabaseHandler:
                     )
                     """
                 )
+                self._ensure_columns(conn, "subtitles", SUBTITLE_EXTRA_COLUMNS)
+                conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS translation_memory (
+                        source_text TEXT,
+                        src_code TEXT,
+                        tgt_code TEXT,
+                        model_id TEXT,
+                        translation TEXT,
+                        hits INTEGER DEFAULT 0,
+                        last_used REAL,
+                        PRIMARY KEY (source_text, src_code, tgt_code, model_id)
+                    )
+                    """
+                )
+                conn.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS idx_translation_memory_last_used ON translation_memory (last_used)
+                    """
+                )
+                conn.execute(
+                    """
+                    CREATE INDEX IF NOT EXISTS idx_subtitles_content_hash ON subtitles (content_hash)
+                    """
+                )
                 conn.commit()
         except Exception as e:
             logger.error(f"Error creating table: {str(e)}")
 
-    def add_file(self, file_name: str, origin_language: str, translate_language: str, use_correction: bool, embed_subtitle: str) -> int:
+    @staticmethod
+    def _ensure_columns(conn: sqlite3.Connection, table: str, columns: Dict[str, str]) -> None:
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for name, column_type in columns.items():
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+                logger.info(f"Added column {table}.{name}")
+
+    @staticmethod
+    def _decode_row(row: sqlite3.Row) -> Dict:
+        record = dict(row)
+        for column in JSON_COLUMNS:
+            if record.get(column):
+                record[column] = json.loads(record[column])
+        return record
+
+    def add_file(self, file_name: str, origin_language: str, translate_language: str, use_correction: bool, embed_subtitle: str, denoise_backend: Optional[str] = None, file_path: Optional[str] = None, metadata: Optional[Dict] = None, content_hash: Optional[str] = None) -> int:
         """
         Thêm một bản ghi phụ đề vào cơ sở dữ liệu.
+        denoise_backend: backend khử nhiễu riêng cho job (None = theo config.DENOISE_BACKEND).
+        file_path: đường dẫn file do API nhận (None = file_name trong AUDIO_FOLDER); file này thuộc về job
+        và được xóa khi job kết thúc. metadata: kết quả validate_file của API. content_hash: sha256 của file tải lên.
         """
         try:
+            now = time.time()
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
                 cursor.execute(
                     """
-                    INSERT INTO subtitles (file_name, origin_language, translate_language, use_correction, embed_subtitle, status)
-                    VALUES (?, ?, ?, ?, ?, 'PENDING')
+                    INSERT INTO subtitles (file_name, origin_language, translate_language, use_correction, embed_subtitle, denoise_backend, file_path, metadata, content_hash, status, stage, created_at, updated_at, request_count)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'PENDING', 'queued', ?, ?, 1)
                     """,
-                    (file_name, origin_language, translate_language, use_correction, embed_subtitle)
+                    (file_name, origin_language, translate_language, use_correction, embed_subtitle, denoise_backend, file_path, json.dumps(metadata) if metadata is not None else None, content_hash, now, now)
                 )
                 conn.commit()
-                return cursor.lastrowid
+                file_id = cursor.lastrowid
+            notify_new_job()
+            return file_id
         except Exception as e:
             logger.error(f"Error adding file {file_name}: {str(e)}")
             return None
 
+    def find_or_add_file(self, file_name: str, origin_language: str, translate_language: str, use_correction: bool, embed_subtitle: str, denoise_backend: Optional[str], file_path: str, metadata: Optional[Dict], content_hash: str, is_reusable: Optional[Callable[[Dict], bool]] = None) -> Tuple[Optional[int], bool]:
+        """
+        Gộp yêu cầu trùng lặp: trong cùng một transaction, tìm job mới nhất có cùng nội dung file và tham số
+        (content_hash, ngôn ngữ nguồn/đích, kiểu nhúng phụ đề, backend khử nhiễu) đang chờ, đang chạy hoặc đã
+        hoàn thành; nếu không có thì thêm job mới. Job đã hoàn thành chỉ được dùng lại khi is_reusable(job)
+        (ví dụ các file kết quả vẫn còn). Gắn vào job chưa xong làm tăng request_count (xem request_cancel).
+        Trả về (id, True nếu vừa thêm mới).
+        """
+        try:
+            with sqlite3.connect(self.db_path, isolation_level=None) as conn:
+                conn.row_factory = sqlite3.Row
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    rows = conn.execute(
+                        """
+                        SELECT * FROM subtitles
+                        WHERE content_hash = ? AND origin_language = ? AND translate_language = ? AND embed_subtitle = ?
+                            AND use_correction = ? AND COALESCE(denoise_backend, '') = COALESCE(?, '')
+                            AND status IN ('PENDING', 'PROCESSING', 'COMPLETED')
+                        ORDER BY id DESC
+                        """,
+                        (content_hash, origin_language, translate_language, embed_subtitle, use_correction, denoise_backend)
+                    ).fetchall()
+                    for row in rows:
+                        job = self._decode_row(row)
+                        if job["status"] != "COMPLETED" or is_reusable is None or is_reusable(job):
+                            if job["status"] != "COMPLETED":
+                                conn.execute(
+                                    """
+                                    UPDATE subtitles SET request_count = COALESCE(request_count, 1) + 1 WHERE id = ?
+                                    """,
+                                    (job["id"],)
+                                )
+                            conn.execute("COMMIT")
+                            return job["id"], False
+                    now = time.time()
+                    cursor = conn.execute(
+                        """
+                        INSERT INTO subtitles (file_name, origin_language, translate_language, use_correction, embed_subtitle, denoise_backend, file_path, metadata, content_hash, status, stage, created_at, updated_at, request_count)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'PENDING', 'queued', ?, ?, 1)
+                        """,
+                        (file_name, origin_language, translate_language, use_correction, embed_subtitle, denoise_backend, file_path, json.dumps(metadata) if metadata is not None else None, content_hash, now, now)
+                    )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            notify_new_job()
+            return cursor.lastrowid, True
+        except Exception as e:
+            logger.error(f"Error queueing file {file_name}: {str(e)}")
+            return None, False
+
     def get_pending_files(self) -> List[Dict]:
         """
         Lấy tất cả các bản ghi chưa xử lý.
@@ -68,22 +202,99 @@ class DatabaseHandler:
                     SELECT * FROM subtitles WHERE status='PENDING'
                     """
                 ).fetchall()
-                return [dict(file) for file in files]
+                return [self._decode_row(file) for file in files]
         except Exception as e:
             logger.error(f"Error retrieving files: {str(e)}")
             return []
 
-    def update_status(self, file_id: int, status: str) -> bool:
+    def get_active_files(self) -> List[Dict]:
+        """
+        Các job còn trong hàng đợi (đang chờ, đang chạy hoặc đang hủy), theo thứ tự được xử lý.
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.row_factory = sqlite3.Row
+                files = conn.execute(
+                    """
+                    SELECT * FROM subtitles WHERE status IN ('PENDING', 'PROCESSING', 'CANCELLING') ORDER BY id
+                    """
+                ).fetchall()
+                return [self._decode_row(file) for file in files]
+        except Exception as e:
+            logger.error(f"Error retrieving active files: {str(e)}")
+            return []
+
+    def claim_next_file(self) -> Optional[Dict]:
+        """
+        Lấy bản ghi PENDING cũ nhất và chuyển sang PROCESSING trong cùng một transaction,
+        để nhiều worker không xử lý trùng một bản ghi.
+        """
+        try:
+            with sqlite3.connect(self.db_path, isolation_level=None) as conn:
+                conn.row_factory = sqlite3.Row
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = conn.execute(
+                        """
+                        SELECT * FROM subtitles WHERE status='PENDING' ORDER BY id LIMIT 1
+                        """
+                    ).fetchone()
+                    if row is not None:
+                        conn.execute(
+                            """
+                            UPDATE subtitles SET status = 'PROCESSING', updated_at = ? WHERE id = ?
+                            """,
+                            (time.time(), row["id"])
+                        )
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                return self._decode_row(row) if row is not None else None
+        except Exception as e:
+            logger.error(f"Error claiming pending file: {str(e)}")
+            return None
+
+    def get_file(self, file_id: int) -> Optional[Dict]:
+        """
+        Lấy một bản ghi theo id (kết quả và metadata đã giải mã JSON), None nếu không tồn tại.
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.row_factory = sqlite3.Row
+                row = conn.execute(
+                    """
+                    SELECT * FROM subtitles WHERE id = ?
+                    """,
+                    (file_id,)
+                ).fetchone()
+                return self._decode_row(row) if row is not None else None
+        except Exception as e:
+            logger.error(f"Error retrieving file {file_id}: {str(e)}")
+            return None
+
+    def get_status(self, file_id: int) -> Optional[str]:
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                row = conn.execute("SELECT status FROM subtitles WHERE id = ?", (file_id,)).fetchone()
+                return row[0] if row is not None else None
+        except Exception as e:
+            logger.error(f"Error retrieving status for id {file_id}: {str(e)}")
+            return None
+
+    def update_status(self, file_id: int, status: str, error: Optional[str] = None) -> bool:
         """
-        Cập nhật trạng thái của bản ghi phụ đề.
+        Cập nhật trạng thái của bản ghi phụ đề (và thông báo lỗi nếu job thất bại).
+        Job đã bị hủy giữ nguyên trạng thái CANCELLED.
         """
         try:
             with sqlite3.connect(self.db_path) as conn:
                 conn.execute(
                     """
-                    UPDATE subtitles SET status = ? WHERE id = ?
+                    UPDATE subtitles SET status = ?, error = COALESCE(?, error), updated_at = ?
+                    WHERE id = ? AND status != 'CANCELLED'
                     """,
-                    (status, file_id)
+                    (status, error, time.time(), file_id)
                 )
                 conn.commit()
                 return True
@@ -108,3 +319,191 @@ class DatabaseHandler:
         except Exception as e:
             logger.error(f"Error updating subtitle path for id {file_id}: {str(e)}")
             return False
+
+    def update_stage(self, file_id: int, stage: str) -> bool:
+        """
+        Ghi lại bước xử lý hiện tại của job (decode, vad, denoise, transcription, ...).
+        """
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute(
+                    """
+                    UPDATE subtitles SET stage = ?, updated_at = ? WHERE id = ?
+                    """,
+                    (stage, time.time(), file_id)
+                )
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Error updating stage for id {file_id}: {str(e)}")
+            return False
+
+    def update_result(self, file_id: int, result: Dict) -> bool:
+        """
+        Lưu kết quả xử lý vào bản ghi: toàn bộ kết quả dạng JSON và đường dẫn phụ đề cuối cùng.
+        """
+        subtitle_paths = result.get("translated_subtitle_paths") or result.get("subtitle_paths") or []
+        subtitle_path = subtitle_paths[-1] if subtitle_paths else result.get("subtitle_path")
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                conn.execute(
+                    """
+                    UPDATE subtitles SET result = ?, subtitle_path = ?, updated_at = ? WHERE id = ?
+                    """,
+                    (json.dumps(result), subtitle_path, time.time(), file_id)
+                )
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Error updating result for id {file_id}: {str(e)}")
+            return False
+
+    def request_cancel(self, file_id: int) -> Optional[str]:
+        """
+        Yêu cầu hủy job: PENDING chuyển thẳng sang CANCELLED, PROCESSING chuyển sang CANCELLING để
+        worker dừng ở lần kiểm tra kế tiếp (xem job_control). Job còn gắn với yêu cầu khác (request_count > 1)
+        không bị hủy mà chỉ giảm request_count, trạng thái giữ nguyên PENDING/PROCESSING.
+        Trả về trạng thái sau khi cập nhật, None nếu không có job.
+        """
+        try:
+            with sqlite3.connect(self.db_path, isolation_level=None) as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = conn.execute("SELECT status, COALESCE(request_count, 1) FROM subtitles WHERE id = ?", (file_id,)).fetchone()
+                    status, request_count = row if row is not None else (None, 0)
+                    new_status = {"PENDING": "CANCELLED", "PROCESSING": "CANCELLING"}.get(status)
+                    if new_status is not None and request_count > 1:
+                        conn.execute(
+                            """
+                            UPDATE subtitles SET request_count = ?, updated_at = ? WHERE id = ?
+                            """,
+                            (request_count - 1, time.time(), file_id)
+                        )
+                    elif new_status is not None:
+                        conn.execute(
+                            """
+                            UPDATE subtitles SET status = ?, request_count = 0, updated_at = ? WHERE id = ?
+                            """,
+                            (new_status, time.time(), file_id)
+                        )
+                        status = new_status
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                return status
+        except Exception as e:
+            logger.error(f"Error cancelling id {file_id}: {str(e)}")
+            return None
+
+    def recover_stale_jobs(self) -> List[Dict]:
+        """
+        Khôi phục các job bị bỏ dở khi worker trước đó dừng đột ngột (crash, khởi động lại API):
+        PROCESSING quay về PENDING để được xử lý lại từ đầu, CANCELLING chuyển thành CANCELLED.
+        Chỉ gọi khi chắc chắn không còn worker nào khác đang chạy. Trả về các bản ghi đã khôi phục (trạng thái mới).
+        """
+        try:
+            with sqlite3.connect(self.db_path, isolation_level=None) as conn:
+                conn.row_factory = sqlite3.Row
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    rows = conn.execute(
+                        """
+                        SELECT id FROM subtitles WHERE status IN ('PROCESSING', 'CANCELLING')
+                        """
+                    ).fetchall()
+                    now = time.time()
+                    conn.execute(
+                        """
+                        UPDATE subtitles SET status = 'PENDING', stage = 'queued', updated_at = ? WHERE status = 'PROCESSING'
+                        """,
+                        (now,)
+                    )
+                    conn.execute(
+                        """
+                        UPDATE subtitles SET status = 'CANCELLED', updated_at = ? WHERE status = 'CANCELLING'
+                        """,
+                        (now,)
+                    )
+                    ids = [row["id"] for row in rows]
+                    recovered = conn.execute(
+                        f"""
+                        SELECT * FROM subtitles WHERE id IN ({",".join("?" * len(ids))})
+                        """,
+                        ids
+                    ).fetchall() if ids else []
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                return [self._decode_row(row) for row in recovered]
+        except Exception as e:
+            logger.error(f"Error recovering stale jobs: {str(e)}")
+            return []
+
+    def get_translations(self, source_texts: List[str], src_code: str, tgt_code: str, model_id: str) -> Dict[str, str]:
+        """
+        Tra cứu bộ nhớ dịch cho nhiều câu nguồn (đã chuẩn hóa); trả về {câu nguồn: bản dịch} cho các câu có sẵn.
+        """
+        if not source_texts:
+            return {}
+        try:
+            found = {}
+            unique_texts = list(dict.fromkeys(source_texts))
+            with sqlite3.connect(self.db_path) as conn:
+                # Giới hạn số tham số mỗi câu lệnh của SQLite
+                for start in range(0, len(unique_texts), 500):
+                    batch = unique_texts[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = conn.execute(
+                        f"""
+                        SELECT source_text, translation FROM translation_memory
+                        WHERE src_code = ? AND tgt_code = ? AND model_id = ? AND source_text IN ({placeholders})
+                        """,
+                        (src_code, tgt_code, model_id, *batch)
+                    ).fetchall()
+                    found.update(rows)
+                if found:
+                    conn.executemany(
+                        """
+                        UPDATE translation_memory SET hits = hits + 1, last_used = ?
+                        WHERE source_text = ? AND src_code = ? AND tgt_code = ? AND model_id = ?
+                        """,
+                        [(time.time(), text, src_code, tgt_code, model_id) for text in found]
+                    )
+                conn.commit()
+            return found
+        except Exception as e:
+            logger.error(f"Error reading translation memory: {str(e)}")
+            return {}
+
+    def put_translations(self, translations: Dict[str, str], src_code: str, tgt_code: str, model_id: str, max_entries: int = 0) -> bool:
+        """
+        Lưu bản dịch mới vào bộ nhớ dịch, sau đó xóa các bản ghi lâu không dùng nếu vượt max_entries.
+        """
+        if not translations:
+            return True
+        try:
+            now = time.time()
+            with sqlite3.connect(self.db_path) as conn:
+                conn.executemany(
+                    """
+                    INSERT OR REPLACE INTO translation_memory (source_text, src_code, tgt_code, model_id, translation, hits, last_used)
+                    VALUES (?, ?, ?, ?, ?, 0, ?)
+                    """,
+                    [(text, src_code, tgt_code, model_id, translation, now) for text, translation in translations.items()]
+                )
+                if max_entries > 0:
+                    conn.execute(
+                        """
+                        DELETE FROM translation_memory WHERE rowid IN (
+                            SELECT rowid FROM translation_memory ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                        )
+                        """,
+                        (max_entries,)
+                    )
+                conn.commit()
+                return True
+        except Exception as e:
+            logger.error(f"Error writing translation memory: {str(e)}")
+            return False
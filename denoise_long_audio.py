@@ -1,66 +1,282 @@
 import os
-import torch
-import torchaudio
 import logging
-from audio_denoiser import AudioDenoiser
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Callable, Iterator, Optional
+import numpy as np
+import soundfile as sf
+import torchaudio
+from denoiser_backends import create_denoiser
+from audio_decoder import decode_audio
+from config import SAMPLE_RATE, DENOISE_SEGMENT_SEC, DENOISE_OVERLAP_SEC, DENOISE_WORKERS, DENOISE_BACKEND
 
 logger = logging.getLogger(__name__)
 
+# Buffer dùng chung của mỗi tiến trình worker khử nhiễu, được gắn trong _init_denoise_worker
+_worker_state = {}
+
+def chunk_layout(total_samples: int, segment_samples: int, overlap_samples: int) -> list:
+    """
+    Chia [0, total_samples) thành các đoạn dài segment_samples, hai đoạn liên tiếp chồng lấn overlap_samples
+    (0 = các đoạn nối tiếp nhau, không cross-fade).
+    """
+    if overlap_samples < 0:
+        raise ValueError("Overlap must not be negative")
+    if segment_samples <= 2 * overlap_samples:
+        raise ValueError("Segment length must be more than twice the overlap")
+    hop = segment_samples - overlap_samples
+    layout = []
+    start = 0
+    while True:
+        end = min(start + segment_samples, total_samples)
+        layout.append((start, end))
+        if end >= total_samples:
+            return layout
+        start += hop
+
+
+def crossfade_weights(overlap_samples: int) -> tuple:
+    # Fade tuyến tính bù nhau: fade_in + fade_out = 1 trên vùng chồng lấn
+    fade_in = ((np.arange(overlap_samples, dtype=np.float32) + 0.5) / overlap_samples).astype(np.float32)
+    return fade_in, (1.0 - fade_in).astype(np.float32)
+
+
+def weight_chunk(chunk: np.ndarray, index: int, n_chunks: int, overlap_samples: int, fade_in: np.ndarray, fade_out: np.ndarray) -> np.ndarray:
+    """
+    Nhân fade-in vào đầu (trừ đoạn đầu tiên) và fade-out vào cuối (trừ đoạn cuối cùng) của một đoạn đã khử nhiễu.
+    """
+    weighted = np.array(chunk, dtype=np.float32, copy=True)
+    if overlap_samples > 0:
+        if index > 0:
+            weighted[:overlap_samples] *= fade_in
+        if index < n_chunks - 1:
+            weighted[-overlap_samples:] *= fade_out
+    return weighted
+
+
+def _fit_length(chunk: np.ndarray, length: int) -> np.ndarray:
+    chunk = np.asarray(chunk, dtype=np.float32).reshape(-1)
+    if len(chunk) >= length:
+        return chunk[:length]
+    return np.pad(chunk, (0, length - len(chunk)))
+
+
+def iter_denoised_blocks(
+    read_chunk: Callable[[int, int], np.ndarray],
+    total_samples: int,
+    process_chunk: Callable[[np.ndarray], np.ndarray],
+    segment_samples: int,
+    overlap_samples: int,
+    skip: Optional[np.ndarray] = None
+) -> Iterator[np.ndarray]:
+    """
+    Khử nhiễu dạng streaming với overlap-add: chỉ giữ một đoạn và phần đuôi chồng lấn trong bộ nhớ,
+    trả về lần lượt các khối đầu ra đã hoàn chỉnh (nối lại đúng bằng total_samples mẫu).
+    skip[i] = True cho đoạn i đi thẳng qua mà không gọi process_chunk.
+    """
+    layout = chunk_layout(total_samples, segment_samples, overlap_samples)
+    fade_in, fade_out = crossfade_weights(overlap_samples)
+    prev_tail = None
+    for index, (start, end) in enumerate(layout):
+        chunk = read_chunk(start, end)
+        denoised = _fit_length(chunk if skip is not None and skip[index] else process_chunk(chunk), end - start)
+        weighted = weight_chunk(denoised, index, len(layout), overlap_samples, fade_in, fade_out)
+        if prev_tail is not None:
+            weighted[:overlap_samples] += prev_tail
+        if index < len(layout) - 1:
+            # Không dùng weighted[:-overlap_samples]: với overlap 0 lát cắt đó rỗng
+            cut = len(weighted) - overlap_samples
+            prev_tail = weighted[cut:] if overlap_samples > 0 else None
+            yield weighted[:cut]
+        else:
+            yield weighted
+
+
+def _init_denoise_worker(input_name: str, output_name: str, total_samples: int, process_chunk: Callable) -> None:
+    input_shm = shared_memory.SharedMemory(name=input_name)
+    output_shm = shared_memory.SharedMemory(name=output_name)
+    _worker_state["shm"] = (input_shm, output_shm)
+    _worker_state["input"] = np.ndarray((total_samples,), dtype=np.float32, buffer=input_shm.buf)
+    _worker_state["output"] = np.ndarray((total_samples,), dtype=np.float32, buffer=output_shm.buf)
+    _worker_state["process_chunk"] = process_chunk
+
+
+def _denoise_shared_chunk(index: int, n_chunks: int, start: int, end: int, overlap_samples: int) -> None:
+    denoised = _fit_length(_worker_state["process_chunk"](_worker_state["input"][start:end]), end - start)
+    fade_in, fade_out = crossfade_weights(overlap_samples)
+    _worker_state["output"][start:end] += weight_chunk(denoised, index, n_chunks, overlap_samples, fade_in, fade_out)
+
+
+def _denoise_parallel(
+    waveform: np.ndarray,
+    process_chunk: Callable[[np.ndarray], np.ndarray],
+    segment_samples: int,
+    overlap_samples: int,
+    n_jobs: int,
+    skip: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Khử nhiễu song song trên pool tiến trình; đầu vào và đầu ra nằm trong shared memory nên
+    chỉ chỉ số đoạn được gửi qua pipe. Các đoạn chẵn chạy trước, đoạn lẻ chạy sau: trong mỗi pha
+    các đoạn không chồng lấn nhau nên worker cộng thẳng vào đầu ra, và kết quả trùng với bản tuần tự.
+    process_chunk phải pickle được (ví dụ BaseDenoiser.process_chunk), không dùng lambda.
+    """
+    total_samples = len(waveform)
+    layout = chunk_layout(total_samples, segment_samples, overlap_samples)
+    if skip is None:
+        skip = np.zeros(len(layout), dtype=bool)
+    fade_in, fade_out = crossfade_weights(overlap_samples)
+    nbytes = total_samples * np.dtype(np.float32).itemsize
+    input_shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    output_shm = shared_memory.SharedMemory(create=True, size=nbytes)
+    shared_input = shared_output = None
+    try:
+        shared_input = np.ndarray((total_samples,), dtype=np.float32, buffer=input_shm.buf)
+        shared_output = np.ndarray((total_samples,), dtype=np.float32, buffer=output_shm.buf)
+        shared_input[:] = waveform
+        shared_output[:] = 0.0
+        logger.info(f"Denoising {len(layout)} chunks on {n_jobs} worker processes")
+        with ProcessPoolExecutor(
+            max_workers=min(n_jobs, len(layout)),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_denoise_worker,
+            initargs=(input_shm.name, output_shm.name, total_samples, process_chunk)
+        ) as executor:
+            for parity in (0, 1):
+                futures = [
+                    executor.submit(_denoise_shared_chunk, index, len(layout), start, end, overlap_samples)
+                    for index, (start, end) in enumerate(layout) if index % 2 == parity and not skip[index]
+                ]
+                # Đoạn bỏ qua khử nhiễu chỉ cần cross-fade, làm ngay ở tiến trình chính
+                for index, (start, end) in enumerate(layout):
+                    if index % 2 == parity and skip[index]:
+                        shared_output[start:end] += weight_chunk(waveform[start:end], index, len(layout), overlap_samples, fade_in, fade_out)
+                for future in futures:
+                    future.result()
+        return shared_output.copy()
+    finally:
+        # Phải bỏ các view numpy trước khi đóng shared memory
+        shared_input = shared_output = None
+        for shm in (input_shm, output_shm):
+            shm.close()
+            shm.unlink()
+
+
+def denoise_waveform(
+    waveform: np.ndarray,
+    process_chunk: Callable[[np.ndarray], np.ndarray],
+    segment_sec: float = DENOISE_SEGMENT_SEC,
+    overlap_sec: float = DENOISE_OVERLAP_SEC,
+    sample_rate: int = SAMPLE_RATE,
+    n_jobs: int = DENOISE_WORKERS,
+    plan_skips: Optional[Callable[[list], np.ndarray]] = None
+) -> np.ndarray:
+    """
+    Khử nhiễu một buffer mono theo từng đoạn chồng lấn, ghi thẳng vào mảng đầu ra cấp phát sẵn.
+    n_jobs > 1 (0 = mọi lõi CPU) chia các đoạn cho pool tiến trình, kết quả giống hệt chạy tuần tự.
+    plan_skips(layout) trả về mảng bool các đoạn không cần khử nhiễu; nếu mọi đoạn đều bỏ qua,
+    buffer đầu vào được trả lại nguyên vẹn (không sao chép).
+    """
+    total_samples = len(waveform)
+    if total_samples == 0:
+        return waveform
+    segment_samples = int(segment_sec * sample_rate)
+    overlap_samples = int(overlap_sec * sample_rate)
+    skip = None
+    if plan_skips is not None:
+        skip = plan_skips(chunk_layout(total_samples, segment_samples, overlap_samples))
+        if skip.all():
+            return waveform
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs > 1 and total_samples > segment_samples:
+        return _denoise_parallel(waveform, process_chunk, segment_samples, overlap_samples, n_jobs, skip)
+
+    output = np.empty(total_samples, dtype=np.float32)
+    position = 0
+    blocks = iter_denoised_blocks(
+        lambda start, end: waveform[start:end],
+        total_samples,
+        process_chunk,
+        segment_samples,
+        overlap_samples,
+        skip
+    )
+    for block in blocks:
+        output[position:position + len(block)] = block
+        position += len(block)
+    return output
+
+
 def denoise_long_audio(
     input_path: str,
     output_path: str,
-    segment_sec: float = 20.0,
-    overlap_sec: float = 1.0
+    segment_sec: float = DENOISE_SEGMENT_SEC,
+    overlap_sec: float = DENOISE_OVERLAP_SEC,
+    n_jobs: int = DENOISE_WORKERS,
+    backend: str = DENOISE_BACKEND
 ):
     """
-    Khử nhiễu âm thanh WAV dài bằng cách chia thành các đoạn, dùng AudioDenoiser.
+    Khử nhiễu âm thanh WAV dài dạng streaming: đọc từng đoạn bằng frame_offset/num_frames,
+    cross-fade vùng chồng lấn và ghi dần ra file, bộ nhớ không phụ thuộc độ dài đầu vào.
+    Với n_jobs > 1 (0 = mọi lõi), file được giải mã một lần vào shared memory và khử nhiễu song song;
+    chế độ này đổi bộ nhớ cố định lấy tốc độ (khoảng 2 lần kích thước buffer 16 kHz float32).
 
     Args:
         input_path: Đường dẫn file WAV đầu vào
-        output_path: Đường dẫn file WAV đầu ra
+        output_path: Đường dẫn file WAV đầu ra (16 kHz mono)
         segment_sec: Độ dài mỗi đoạn (giây)
         overlap_sec: Độ chồng lấn giữa các đoạn (giây)
+        n_jobs: Số tiến trình khử nhiễu
+        backend: Backend khử nhiễu (xem denoiser_backends.DENOISE_BACKENDS)
     """
     try:
         logger.info(f"Denoising audio: {input_path} -> {output_path}")
+        if not os.path.exists(input_path):
+            raise FileNotFoundError(f"Input file not found: {input_path}")
 
-        # Khởi động AudioDenoiser với apply_noise_reduction = True
-        denoiser = AudioDenoiser(sample_rate=16000)
-
-        # Đọc audio
-        waveform, sample_rate = torchaudio.load(input_path)
-        if sample_rate != 16000:
-            resampler = torchaudio.transforms.Resample(sample_rate, 16000)
-            waveform = resampler(waveform)
-            sample_rate = 16000
-
-        # Chuyển sang mono nếu cần
-        if waveform.shape[0] > 1:
-            waveform = waveform.mean(dim=0, keepdim=True)
-
-        segment_samples = int(segment_sec * sample_rate)
-        overlap_samples = int(overlap_sec * sample_rate)
-        total_samples = waveform.shape[1]
-        denoised_segments = []
-
-        # Chia và khử nhiễu từng đoạn
-        for start in range(0, total_samples, segment_samples - overlap_samples):
-            end = min(start + segment_samples, total_samples)
-            segment = waveform[:, start:end]
-            if segment.shape[1] == 0:
-                continue
-            denoised_segment = denoiser.process(segment.numpy())  # Numpy -> xử lý
-            denoised_segments.append(torch.tensor(denoised_segment))
-
-        # Ghép lại
-        if not denoised_segments:
-            raise Exception("No valid segments after denoising")
-        denoised_waveform = torch.cat(denoised_segments, dim=1)
-        if denoised_waveform.shape[1] > total_samples:
-            denoised_waveform = denoised_waveform[:, :total_samples]
+        denoiser = create_denoiser(backend)
+
+        if (n_jobs or os.cpu_count() or 1) > 1:
+            audio = decode_audio(input_path, sample_rate=SAMPLE_RATE)
+            denoised = denoise_waveform(audio, denoiser.process_chunk, segment_sec, overlap_sec, n_jobs=n_jobs)
+            if denoised.size == 0:
+                raise Exception("No valid segments after denoising")
+            sf.write(output_path, np.clip(denoised, -1.0, 1.0), SAMPLE_RATE, subtype="PCM_16")
+            logger.info(f"Denoised audio saved to: {output_path}")
+            return
 
-        # Lưu file
-        torchaudio.save(output_path, denoised_waveform, sample_rate)
+        info = torchaudio.info(input_path)
+        source_rate = info.sample_rate
+        total_samples = int(info.num_frames * SAMPLE_RATE / source_rate)
+        resampler = torchaudio.transforms.Resample(source_rate, SAMPLE_RATE) if source_rate != SAMPLE_RATE else None
+
+        def read_chunk(start: int, end: int) -> np.ndarray:
+            # Đổi vị trí mẫu 16 kHz sang frame của file gốc rồi chỉ đọc đúng đoạn đó
+            frame_offset = int(start * source_rate / SAMPLE_RATE)
+            num_frames = int(np.ceil(end * source_rate / SAMPLE_RATE)) - frame_offset
+            waveform, _ = torchaudio.load(input_path, frame_offset=frame_offset, num_frames=num_frames)
+            if waveform.shape[0] > 1:
+                waveform = waveform.mean(dim=0, keepdim=True)
+            if resampler is not None:
+                waveform = resampler(waveform)
+            return _fit_length(waveform[0].numpy(), end - start)
+
+        written = 0
+        with sf.SoundFile(output_path, "w", samplerate=SAMPLE_RATE, channels=1, subtype="PCM_16") as out_file:
+            blocks = iter_denoised_blocks(
+                read_chunk,
+                total_samples,
+                denoiser.process_chunk,
+                int(segment_sec * SAMPLE_RATE),
+                int(overlap_sec * SAMPLE_RATE)
+            )
+            for block in blocks:
+                out_file.write(np.clip(block, -1.0, 1.0))
+                written += len(block)
+
+        if written == 0:
+            raise Exception("No valid segments after denoising")
         logger.info(f"Denoised audio saved to: {output_path}")
 
     except Exception as e:
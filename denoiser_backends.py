@@ -0,0 +1,147 @@
+import os
+import sys
+import logging
+import numpy as np
+from scipy.signal import resample_poly
+from audio_denoiser import AudioDenoiser
+from model_registry import model_registry
+from config import SAMPLE_RATE, DENOISE_BACKEND
+
+logger = logging.getLogger(__name__)
+
+class BaseDenoiser:
+    """
+    Giao diện chung cho các backend khử nhiễu: process_chunk nhận một đoạn 16 kHz mono float32
+    và trả về đoạn cùng độ dài. Việc chia đoạn, cross-fade và song song hóa do driver trong
+    denoise_long_audio đảm nhận, nên mọi backend dùng chung một vòng lặp streaming.
+
+    Backend có tần số mẫu gốc khác 16 kHz (RNNoise, DeepFilterNet: 48 kHz) khai báo native_rate,
+    việc resample hai chiều được xử lý ở đây. Mô hình được nạp qua model_registry nên instance
+    vẫn pickle được để gửi sang các worker khử nhiễu song song.
+    """
+    backend_name = "base"
+    native_rate = SAMPLE_RATE
+
+    def fit(self, waveform: np.ndarray, mask: np.ndarray, snr_db: float) -> None:
+        """
+        Chuẩn bị cho một file trước khi khử nhiễu (ví dụ ước lượng mẫu nhiễu); mặc định không làm gì.
+        """
+
+    def _process(self, chunk: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def process_chunk(self, chunk: np.ndarray) -> np.ndarray:
+        chunk = np.asarray(chunk, dtype=np.float32).reshape(-1)
+        if self.native_rate != SAMPLE_RATE:
+            native = resample_poly(chunk, self.native_rate, SAMPLE_RATE).astype(np.float32)
+            denoised = resample_poly(self._process(native), SAMPLE_RATE, self.native_rate)
+        else:
+            denoised = self._process(chunk)
+        denoised = np.asarray(denoised, dtype=np.float32).reshape(-1)[:len(chunk)]
+        if len(denoised) < len(chunk):
+            denoised = np.pad(denoised, (0, len(chunk) - len(denoised)))
+        return denoised
+
+
+class NoisereduceDenoiser(BaseDenoiser):
+    """
+    Spectral gating với noisereduce (AudioDenoiser): mẫu nhiễu lấy một lần từ vùng không có tiếng nói.
+    """
+    backend_name = "noisereduce"
+
+    def __init__(self):
+        self.denoiser = AudioDenoiser(sample_rate=SAMPLE_RATE)
+
+    def fit(self, waveform: np.ndarray, mask: np.ndarray, snr_db: float) -> None:
+        self.denoiser.fit_noise_profile(waveform, mask, snr_db)
+        profile = self.denoiser.noise_profile
+        profile_seconds = 0.0 if profile is None else len(profile) / SAMPLE_RATE
+        logger.info(f"Noise profile {profile_seconds:.2f}s, prop_reduce {self.denoiser.prop_reduce}")
+
+    def _process(self, chunk: np.ndarray) -> np.ndarray:
+        return self.denoiser.process(chunk)[0]
+
+
+def _load_rnnoise():
+    from rnnoise_wrapper import RNNoise
+    return RNNoise()
+
+
+class RNNoiseDenoiser(BaseDenoiser):
+    """
+    RNNoise (mạng GRU nhỏ, 48 kHz) qua rnnoise_wrapper.
+    """
+    backend_name = "rnnoise"
+    native_rate = 48000
+
+    def _process(self, chunk: np.ndarray) -> np.ndarray:
+        with model_registry.lease("denoise:rnnoise", _load_rnnoise, exclusive=True) as model:
+            return model.denoise(chunk)
+
+
+def _load_deepfilter():
+    from df.enhance import init_df
+    model, df_state, _ = init_df()
+    return model, df_state
+
+
+class DeepFilterDenoiser(BaseDenoiser):
+    """
+    DeepFilterNet (48 kHz) qua df.enhance, xử lý trực tiếp trên tensor thay vì file tạm.
+    """
+    backend_name = "deepfilter"
+    native_rate = 48000
+
+    def _process(self, chunk: np.ndarray) -> np.ndarray:
+        import torch
+        from df.enhance import enhance
+        with model_registry.lease("denoise:deepfilter", _load_deepfilter, exclusive=True) as (model, df_state):
+            with torch.no_grad():
+                enhanced = enhance(model, df_state, torch.from_numpy(chunk).unsqueeze(0))
+        return enhanced[0].cpu().numpy()
+
+
+def _load_speech_denoiser():
+    import torch
+    # Gói pip "audio_denoiser" trùng tên với audio_denoiser.py của repo: tạm bỏ module cục bộ
+    # và thư mục repo khỏi đường dẫn tìm kiếm khi import, sau đó khôi phục lại
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    local_module = sys.modules.pop("audio_denoiser", None)
+    saved_path = sys.path[:]
+    sys.path[:] = [p for p in sys.path if os.path.abspath(p or os.curdir) != repo_dir]
+    try:
+        from audio_denoiser.AudioDenoiser import AudioDenoiser as SpeechDenoiser
+    finally:
+        sys.path[:] = saved_path
+        if local_module is not None:
+            sys.modules["audio_denoiser"] = local_module
+    device = "cuda:0" if torch.cuda.is_available() else "cpu"
+    return SpeechDenoiser(device=device)
+
+
+class SpeechDenoiser(BaseDenoiser):
+    """
+    Mô hình khử nhiễu PyTorch của gói audio-denoiser (denoise/audio_denoiser_speech.py), đầu ra 16 kHz.
+    """
+    backend_name = "speech_denoiser"
+
+    def _process(self, chunk: np.ndarray) -> np.ndarray:
+        import torch
+        with model_registry.lease("denoise:speech_denoiser", _load_speech_denoiser, exclusive=True) as model:
+            clean = model.process_waveform(torch.from_numpy(chunk).unsqueeze(0), SAMPLE_RATE, return_cpu_tensor=True, auto_scale=True)
+        return clean[0].numpy()
+
+
+DENOISE_BACKENDS = {
+    backend.backend_name: backend
+    for backend in (NoisereduceDenoiser, RNNoiseDenoiser, DeepFilterDenoiser, SpeechDenoiser)
+}
+
+
+def create_denoiser(backend: str = DENOISE_BACKEND) -> BaseDenoiser:
+    """
+    Tạo backend khử nhiễu theo tên ("noisereduce", "rnnoise", "deepfilter", "speech_denoiser").
+    """
+    if backend not in DENOISE_BACKENDS:
+        raise ValueError(f"Unsupported denoise backend: {backend}")
+    return DENOISE_BACKENDS[backend]()
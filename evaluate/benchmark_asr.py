@@ -0,0 +1,89 @@
+"""So sánh tốc độ (real-time factor) và WER giữa các engine ASR trên các clip trong data/input."""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_common import select_clips, real_time_factor, comparison_table, save_report
+from asr_backend import create_transcriber
+from audio_decoder import decode_audio
+from subtitle_converter import SubtitleConverter
+from evaluate_metrics import calculate_wer
+from config import AUDIO_FOLDER, SAMPLE_RATE, LANGUAGE_MAP
+
+REFERENCE_FOLDER = os.path.join("data", "original_subtitle")
+
+# Phụ đề tham chiếu và ngôn ngữ của từng clip trong benchmark_common.CLIPS
+REFERENCES = {
+    "Amnhac.mp4": ("AmNhac_vi_vi.vtt", "vi"),
+    "Kinhte.mp4": ("kinhte.vtt", "vi"),
+    "Mylove.mp4": ("Mylove_en_en.vtt", "en"),
+    "Mylove_ch_ch.mp4": ("Mylove_ch_ch.vtt", "zh"),
+    "PhimTiengAnh.wav": ("PhimTiengAnh_en_en.vtt", "en"),
+    "PhimTiengViet.wav": ("PhimTiengViet_vi_vi.vtt", "vi"),
+    "Phimle.mp4": ("Phimle_vi_vi.vtt", "vi"),
+    "TheThao.wav": ("Thethao_vi_vi.vtt", "vi"),
+    "giongbamien.mp4": ("giongbamien_vi_vi.vtt", "vi"),
+}
+
+
+def benchmark_engine(engine: str, clips: list, temp_dir: str) -> list:
+    """Chạy một engine trên danh sách clip, trả về [(clip, thời lượng, thời gian, RTF, WER)]."""
+    transcriber = create_transcriber(engine)
+    transcriber.cache = None  # Không dùng cache để đo thời gian thật
+
+    start = time.time()
+    transcriber.transcribe_audio(decode_audio(os.path.join(AUDIO_FOLDER, clips[0][0]))[:SAMPLE_RATE], language=clips[0][2])
+    print(f"[{engine}] Model load + warm-up: {time.time() - start:.2f}s")
+
+    rows = []
+    for clip, reference, language in clips:
+        audio = decode_audio(os.path.join(AUDIO_FOLDER, clip), sample_rate=SAMPLE_RATE)
+        duration = len(audio) / SAMPLE_RATE
+
+        start = time.time()
+        segments = transcriber.transcribe_audio(audio, language=language)
+        elapsed = time.time() - start
+
+        hypothesis = os.path.join(temp_dir, f"{engine}_{os.path.splitext(clip)[0]}.vtt")
+        with open(hypothesis, "w", encoding="utf-8") as f:
+            f.write(SubtitleConverter.generate_vtt_content(segments))
+        wer = calculate_wer(os.path.join(REFERENCE_FOLDER, reference), hypothesis, language=LANGUAGE_MAP.get(language, "english"))
+
+        rows.append((clip, duration, elapsed, real_time_factor(elapsed, duration), wer))
+        print(f"[{engine}] {clip}: {duration:.1f}s audio, {elapsed:.1f}s, RTF {rows[-1][3]:.3f}, WER {wer:.4f}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ASR engines (speed + WER)")
+    parser.add_argument("--engines", nargs="+", default=["openai", "ctranslate2"])
+    parser.add_argument("--clips", nargs="*", help="Chỉ chạy các clip này (tên file trong data/input)")
+    parser.add_argument("--output", default=os.path.join("data", "output_evaluate", "asr_benchmark.txt"))
+    args = parser.parse_args()
+
+    clips = [(clip, *REFERENCES[clip]) for clip in select_clips(args.clips)]
+    clips = [c for c in clips if os.path.exists(os.path.join(REFERENCE_FOLDER, c[1]))]
+    if not clips:
+        print("Không tìm thấy clip nào có phụ đề tham chiếu.")
+        return
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for engine in args.engines:
+            results[engine] = benchmark_engine(engine, clips, temp_dir)
+
+    durations = [row[1] for row in results[args.engines[0]]]
+    columns = []
+    for engine in args.engines:
+        rows = results[engine]
+        columns.append((f"{engine} RTF", [row[3] for row in rows], sum(row[2] for row in rows) / sum(durations), ".3f"))
+        columns.append((f"{engine} WER", [row[4] for row in rows], sum(row[4] for row in rows) / len(rows), ".4f"))
+    save_report(comparison_table([c[0] for c in clips], durations, columns), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Phần dùng chung của các script benchmark: danh sách clip trong data/input và bảng so sánh song song."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import AUDIO_FOLDER
+
+CLIPS = [
+    "Amnhac.mp4",
+    "Kinhte.mp4",
+    "Mylove.mp4",
+    "Mylove_ch_ch.mp4",
+    "PhimTiengAnh.wav",
+    "PhimTiengViet.wav",
+    "Phimle.mp4",
+    "TheThao.wav",
+    "giongbamien.mp4",
+]
+
+
+def select_clips(requested: list = None) -> list:
+    """Các clip trong CLIPS có mặt trong data/input, lọc theo --clips nếu có."""
+    clips = [c for c in CLIPS if not requested or c in requested]
+    return [c for c in clips if os.path.exists(os.path.join(AUDIO_FOLDER, c))]
+
+
+def real_time_factor(elapsed: float, duration: float) -> float:
+    return elapsed / duration if duration else 0.0
+
+
+def comparison_table(clips: list, durations: list, columns: list, footers: list = ()) -> str:
+    """
+    Bảng so sánh song song các backend/engine.
+    columns: [(tiêu đề, [giá trị theo clip], giá trị dòng TOTAL, định dạng)], ví dụ ("ctranslate2 RTF", [...], 0.21, ".3f").
+    footers: các dòng thêm sau TOTAL, [(nhãn, [chuỗi đã định dạng theo cột])].
+    """
+    widths = [max(18, len(title) + 2) for title, _, _, _ in columns]
+    header = f"{'Clip':<24}{'Audio (s)':>10}" + "".join(f"{title:>{width}}" for (title, _, _, _), width in zip(columns, widths))
+    lines = [header, "-" * len(header)]
+    for i, clip in enumerate(clips):
+        line = f"{clip:<24}{durations[i]:>10.1f}"
+        for (_, values, _, fmt), width in zip(columns, widths):
+            line += f"{values[i]:>{width}{fmt}}"
+        lines.append(line)
+    summary = f"{'TOTAL':<24}{sum(durations):>10.1f}"
+    for (_, _, total, fmt), width in zip(columns, widths):
+        summary += f"{total:>{width}{fmt}}"
+    lines.append(summary)
+    for label, values in footers:
+        lines.append(f"{label:<34}" + "".join(f"{value:>{width}}" for value, width in zip(values, widths)))
+    return "\n".join(lines)
+
+
+def save_report(report: str, output_path: str) -> None:
+    print(report)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        f.write(report + "\n")
+    print(f"Đã lưu kết quả tại: {output_path}")
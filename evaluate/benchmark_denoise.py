@@ -0,0 +1,88 @@
+"""So sánh tốc độ (real-time factor) và RAM đỉnh giữa các backend khử nhiễu trên các clip trong data/input."""
+import os
+import sys
+import time
+import argparse
+import resource
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_common import select_clips, real_time_factor, comparison_table, save_report
+from denoiser_backends import DENOISE_BACKENDS, create_denoiser
+from denoise_long_audio import denoise_waveform
+from audio_denoiser import speech_mask, noise_stats
+from vad_backend import create_vad_processor
+from audio_decoder import decode_audio
+from config import AUDIO_FOLDER, SAMPLE_RATE
+
+
+def benchmark_backend(backend: str, clips: list) -> tuple:
+    """
+    Chạy một backend trên danh sách clip (trong tiến trình riêng để RAM đỉnh không lẫn giữa các backend).
+    Mỗi clip đi đúng đường của pipeline: VAD, ước lượng SNR trên mặt nạ tiếng nói, fit() (mẫu nhiễu tĩnh
+    của noisereduce) rồi khử nhiễu theo đoạn; thời gian đo gồm fit() và khử nhiễu, không gồm VAD.
+    Trả về ([(clip, thời lượng, thời gian, RTF)], RAM đỉnh MB).
+    """
+    denoiser = create_denoiser(backend)
+    vad = create_vad_processor()
+
+    start = time.time()
+    denoiser.process_chunk(decode_audio(os.path.join(AUDIO_FOLDER, clips[0]))[:SAMPLE_RATE])
+    print(f"[{backend}] Model load + warm-up: {time.time() - start:.2f}s")
+
+    rows = []
+    for clip in clips:
+        audio = decode_audio(os.path.join(AUDIO_FOLDER, clip), sample_rate=SAMPLE_RATE)
+        duration = len(audio) / SAMPLE_RATE
+        mask = speech_mask(len(audio), vad.detect_boundaries(audio))
+        snr_db, _ = (float(v[0]) for v in noise_stats(audio, mask, [(0, len(audio))]))
+
+        start = time.time()
+        denoiser.fit(audio, mask, snr_db)
+        fitted = time.time()
+        denoise_waveform(audio, denoiser.process_chunk, n_jobs=1)
+        elapsed = time.time() - start
+
+        rows.append((clip, duration, elapsed, real_time_factor(elapsed, duration)))
+        print(f"[{backend}] {clip}: {duration:.1f}s audio, SNR {snr_db:.1f} dB, fit {fitted - start:.2f}s, {elapsed:.1f}s, RTF {rows[-1][3]:.3f}")
+    # ru_maxrss tính bằng KB trên Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return rows, peak_rss
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark denoise backends (speed + peak RSS)")
+    parser.add_argument("--backends", nargs="+", default=list(DENOISE_BACKENDS), choices=list(DENOISE_BACKENDS))
+    parser.add_argument("--clips", nargs="*", help="Chỉ chạy các clip này (tên file trong data/input)")
+    parser.add_argument("--output", default=os.path.join("data", "output_evaluate", "denoise_benchmark.txt"))
+    args = parser.parse_args()
+
+    clips = select_clips(args.clips)
+    if not clips:
+        print("Không tìm thấy clip nào trong data/input.")
+        return
+
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for backend in args.backends:
+        with context.Pool(1) as pool:
+            try:
+                results[backend] = pool.apply(benchmark_backend, (backend, clips))
+            except Exception as e:
+                print(f"[{backend}] Bỏ qua: {type(e).__name__}: {e}")
+    backends = [b for b in args.backends if b in results]
+    if not backends:
+        return
+
+    durations = [row[1] for row in results[backends[0]][0]]
+    columns = [
+        (f"{backend} RTF", [row[3] for row in results[backend][0]], sum(row[2] for row in results[backend][0]) / sum(durations), ".3f")
+        for backend in backends
+    ]
+    peak = ("Peak RSS (MB)", [f"{results[backend][1]:.1f}" for backend in backends])
+    save_report(comparison_table(clips, durations, columns, footers=[peak]), args.output)
+
+
+if __name__ == "__main__":
+    main()
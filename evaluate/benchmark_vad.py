@@ -0,0 +1,63 @@
+"""So sánh tốc độ (real-time factor) và kết quả giữa các backend VAD trên các clip trong data/input."""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_common import select_clips, real_time_factor, comparison_table, save_report
+from vad_backend import VAD_BACKENDS, create_vad_processor
+from audio_decoder import decode_audio
+from speech_timeline import speech_seconds
+from config import AUDIO_FOLDER, SAMPLE_RATE
+
+
+def benchmark_backend(backend: str, clips: list) -> list:
+    """Chạy một backend VAD trên danh sách clip, trả về [(clip, thời lượng, thời gian, RTF, số đoạn, giây tiếng nói)]."""
+    vad = create_vad_processor(backend)
+
+    start = time.time()
+    vad.detect_boundaries(decode_audio(os.path.join(AUDIO_FOLDER, clips[0]))[:SAMPLE_RATE])
+    print(f"[{backend}] Model load + warm-up: {time.time() - start:.2f}s")
+
+    rows = []
+    for clip in clips:
+        audio = decode_audio(os.path.join(AUDIO_FOLDER, clip), sample_rate=SAMPLE_RATE)
+        duration = len(audio) / SAMPLE_RATE
+
+        start = time.time()
+        boundaries = vad.detect_boundaries(audio)
+        elapsed = time.time() - start
+
+        rows.append((clip, duration, elapsed, real_time_factor(elapsed, duration), len(boundaries), speech_seconds(boundaries)))
+        print(f"[{backend}] {clip}: {duration:.1f}s audio, {elapsed:.2f}s, RTF {rows[-1][3]:.4f}, {len(boundaries)} segments, {rows[-1][5]:.1f}s speech")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VAD backends (speed + detected speech)")
+    parser.add_argument("--backends", nargs="+", default=list(VAD_BACKENDS), choices=list(VAD_BACKENDS))
+    parser.add_argument("--clips", nargs="*", help="Chỉ chạy các clip này (tên file trong data/input)")
+    parser.add_argument("--output", default=os.path.join("data", "output_evaluate", "vad_benchmark.txt"))
+    args = parser.parse_args()
+
+    clips = select_clips(args.clips)
+    if not clips:
+        print("Không tìm thấy clip nào trong data/input.")
+        return
+
+    results = {backend: benchmark_backend(backend, clips) for backend in args.backends}
+
+    # Bảng so sánh song song: RTF và số giây tiếng nói phát hiện được
+    durations = [row[1] for row in results[args.backends[0]]]
+    columns = []
+    for backend in args.backends:
+        rows = results[backend]
+        columns.append((f"{backend} RTF", [row[3] for row in rows], sum(row[2] for row in rows) / sum(durations), ".4f"))
+        columns.append((f"{backend} speech", [row[5] for row in rows], sum(row[5] for row in rows), ".1f"))
+    save_report(comparison_table(clips, durations, columns), args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,88 +1,171 @@
 import os
-import torchaudio
-import torchaudio.transforms as T
-import torch
 import logging
+import numpy as np
 from funasr import AutoModel
+from typing import Iterable, Iterator
+from audio_decoder import decode_audio, iter_decode_audio
+from model_registry import model_registry
+from speech_timeline import to_boundaries
+from vad_speeched import save_speech_segments
 
 logger = logging.getLogger(__name__)
 
+STREAM_CHUNK_MS = 200
+
+
+def load_funasr_vad_model(sampling_rate=16000):
+    try:
+        model = AutoModel(model="fsmn-vad", model_revision="v2.0.4", sampling_rate=sampling_rate, disable_update=True)
+        logger.info("Loaded FunASR VAD model successfully")
+        return model
+    except Exception as e:
+        logger.error(f"Error loading FunASR VAD model: {str(e)}")
+        raise
+
+
 class FunasrVADProcessor:
-    def __init__(self, sampling_rate=16000):
+    """
+    FunASR fsmn-vad với cùng giao diện như SileroVADProcessor (detect / detect_boundaries / stream /
+    stream_file / process). fsmn-vad trả về mili giây; mọi kết quả ở đây được đổi sang mẫu int32 (n, 2)
+    như các backend khác. Mô hình không giữ trạng thái giữa các lần gọi (trạng thái streaming nằm trong cache
+    riêng của mỗi luồng) nên được dùng chung không độc quyền.
+    """
+    def __init__(self, sampling_rate=16000, chunk_ms: int = STREAM_CHUNK_MS):
+        self.sampling_rate = sampling_rate
+        self.samples_per_ms = sampling_rate // 1000
+        self.chunk_ms = chunk_ms
+        self.model_key = f"funasr_vad:{sampling_rate}"
+
+    def _load_model(self):
+        return load_funasr_vad_model(self.sampling_rate)
+
+    @property
+    def model(self):
+        return model_registry.get(self.model_key, self._load_model)
+
+    def _to_samples(self, value, total_samples: int) -> np.ndarray:
         """
-        Khởi tạo FunASR VAD với cấu hình.
+        Đổi [[beg_ms, end_ms], ...] của fsmn-vad sang mẫu, cắt theo độ dài audio.
         """
-        self.sampling_rate = sampling_rate
-        try:
-            self.model = AutoModel(model="fsmn-vad", model_revision="v2.0.4", sampling_rate=sampling_rate)
-            logger.info("Loaded FunASR VAD model successfully")
-        except Exception as e:
-            logger.error(f"Error loading FunASR VAD model: {str(e)}")
-            raise
+        boundaries = np.asarray(value, dtype=np.int64).reshape(-1, 2) * self.samples_per_ms
+        boundaries = np.clip(boundaries, 0, total_samples)
+        return boundaries[boundaries[:, 1] > boundaries[:, 0]].astype(np.int32)
 
-    def convert_to_clip_timestamp_str(self, speech_timestamps: list) -> str:
+    def detect_boundaries_batch(self, waveforms: list) -> list:
         """
-        Chuyển đổi danh sách timestamp thành chuỗi "start1,end1,start2,end2,...".
+        Chạy VAD cho nhiều waveform mono float32 (nhiều file hoặc nhiều đoạn) trong một lần generate;
+        trả về danh sách mảng int32 (n, 2) theo mẫu, cùng thứ tự với đầu vào.
         """
-        converted = [
-            [round(start, 2), round(end, 2)]
-            for start, end in speech_timestamps
-        ]
-        flat_list = [str(x) for pair in converted for x in pair]
-        return ",".join(flat_list)
-
-    def save_output(self, input_path: str, output_path: str, speech_timestamps: list):
+        results = [np.empty((0, 2), dtype=np.int32) for _ in waveforms]
+        # fsmn-vad không nhận đầu vào rỗng; các phần tử rỗng giữ kết quả rỗng
+        indices = [i for i, w in enumerate(waveforms) if len(w)]
+        if not indices:
+            return results
+        inputs = [np.ascontiguousarray(waveforms[i], dtype=np.float32) for i in indices]
+        logger.info(f"Running FunASR VAD on {len(inputs)} inputs in one generate call")
+        with model_registry.lease(self.model_key, self._load_model) as model:
+            outputs = model.generate(input=inputs, fs=self.sampling_rate)
+        for i, output in zip(indices, outputs):
+            results[i] = self._to_samples(output["value"], len(waveforms[i]))
+        return results
+
+    def detect_boundaries(self, waveform: np.ndarray) -> np.ndarray:
+        boundaries = self.detect_boundaries_batch([waveform])[0]
+        if len(boundaries):
+            logger.info(f"Found {len(boundaries)} speech segments")
+        else:
+            logger.warning("No speech detected by VAD.")
+        return boundaries
+
+    def detect(self, waveform: np.ndarray) -> list:
+        return [{"start": int(start), "end": int(end)} for start, end in self.detect_boundaries(waveform)]
+
+    def detect_files(self, input_paths: list) -> list:
         """
-        Lưu những đoạn âm thanh được phát hiện từ VAD vào một file âm thanh hoàn chỉnh.
+        Giải mã các file rồi chạy VAD cho tất cả trong một lần generate.
         """
-        waveform, sr = torchaudio.load(input_path)
-        if sr != self.sampling_rate:
-            resampler = T.Resample(orig_freq=sr, new_freq=sampling_rate)
-            waveform = resampler(waveform)
+        waveforms = [decode_audio(path, sample_rate=self.sampling_rate) for path in input_paths]
+        return self.detect_boundaries_batch(waveforms)
 
-        chunks = []
-        for start, end in speech_timestamps:
-            chunk = waveform[:, int(start):int(end)]
-            if chunk.shape[1] == 0:
-                continue
-            chunks.append(chunk)
+    def _iter_stream_chunks(self, chunks: Iterable[np.ndarray]) -> Iterator[tuple]:
+        """
+        Cắt lại các khối có độ dài bất kỳ thành khối chunk_ms cố định; trả về (khối, is_final).
+        Giữ lại một khối để biết khối nào là cuối cùng.
+        """
+        stride = self.chunk_ms * self.samples_per_ms
+        remainder = np.empty(0, dtype=np.float32)
+        pending = None
+        for chunk in chunks:
+            data = np.concatenate((remainder, np.asarray(chunk, dtype=np.float32)))
+            n_full = len(data) // stride
+            for i in range(n_full):
+                if pending is not None:
+                    yield pending, False
+                pending = data[i * stride:(i + 1) * stride]
+            remainder = data[n_full * stride:]
+        if len(remainder):
+            if pending is not None:
+                yield pending, False
+            pending = remainder
+        if pending is not None:
+            yield pending, True
+
+    def stream(self, chunks: Iterable[np.ndarray]) -> Iterator[tuple]:
+        """
+        VAD dạng streaming bằng chế độ streaming của fsmn-vad: mỗi khối chunk_ms được đưa vào generate với
+        cache riêng của luồng; kết quả từng phần ([beg, -1] khi đoạn bắt đầu, [-1, end] khi đoạn kết thúc)
+        được ghép lại và trả về (start, end) theo mẫu ngay khi một đoạn kết thúc.
+        """
+        cache = {}
+        position = 0
+        open_start = None
+        with model_registry.lease(self.model_key, self._load_model) as model:
+            for chunk, is_final in self._iter_stream_chunks(chunks):
+                position += len(chunk)
+                output = model.generate(input=chunk, cache=cache, is_final=is_final, chunk_size=self.chunk_ms)
+                for beg, end in (output[0]["value"] if output else []):
+                    if beg >= 0:
+                        open_start = min(int(beg) * self.samples_per_ms, position)
+                    if end >= 0 and open_start is not None:
+                        end_sample = min(int(end) * self.samples_per_ms, position)
+                        if end_sample > open_start:
+                            yield open_start, end_sample
+                        open_start = None
+        # Đoạn còn mở khi luồng kết thúc kéo tới mẫu cuối cùng
+        if open_start is not None and position > open_start:
+            yield open_start, position
 
-        if not chunks:
-            raise Exception("No valid audio chunks after VAD processing")
+    def stream_file(self, input_path: str) -> Iterator[tuple]:
+        return self.stream(iter_decode_audio(input_path, sample_rate=self.sampling_rate))
 
-        merged_waveform = torch.cat(chunks, dim=1)
-        torchaudio.save(output_path, merged_waveform, sample_rate=sr)
-        logger.info(f"Saved merged audio to: {output_path}")
+    def convert_to_clip_timestamp_str(self, speech_timestamps: list) -> str:
+        """
+        Chuyển đổi danh sách timestamp (giây) thành chuỗi "start1,end1,start2,end2,...".
+        """
+        return ",".join(f"{round(ts['start'], 2)},{round(ts['end'], 2)}" for ts in speech_timestamps)
 
     def process(self, input_path: str, output_path: str, show_timestamps: bool = True) -> tuple:
         """
-        Thực hiện VAD, ghép các đoạn tiếng nói vào một file hoàn chỉnh, 
-        đồng thời trả về timestamp của những đoạn tiếng nói.
+        Thực hiện VAD, ghép các đoạn tiếng nói vào một file hoàn chỉnh,
+        đồng thời trả về chuỗi clip timestamp và timestamp (giây) của những đoạn tiếng nói.
         """
         if not os.path.exists(input_path):
             raise FileNotFoundError(f"Input file not found: {input_path}")
 
         try:
-            # Dùng mô hình VAD để phát hiện thời gian tiếng nói
-            speech_timestamps = self.model.generate(input=input_path, sampling_rate=self.sampling_rate)
-            if not speech_timestamps:
-                logger.warning("No speech detected.")
-                return "", []
-
+            boundaries = to_boundaries(np.array(list(self.stream_file(input_path))))
             if show_timestamps:
-                logger.info(f"Speech timestamps: {speech_timestamps}")
+                logger.info(f"Speech boundaries (samples): {boundaries.tolist()}")
+
+            save_speech_segments(input_path, output_path, boundaries, self.sampling_rate)
+            if not len(boundaries):
+                return "", []
 
-            # Chuyển sang thời gian thực (giây)
             timestamps_absolute = [
                 {"start": start / self.sampling_rate, "end": end / self.sampling_rate}
-                for start, end in speech_timestamps[0]['value']
+                for start, end in boundaries.tolist()
             ]
-
-            self.save_output(input_path, output_path, speech_timestamps[0]['value'])
-
-            clip_timestamp_str = self.convert_to_clip_timestamp_str(speech_timestamps[0]['value'])
-
-            return clip_timestamp_str, timestamps_absolute
+            return self.convert_to_clip_timestamp_str(timestamps_absolute), timestamps_absolute
 
         except Exception as e:
             logger.error(f"Error in FunASR VAD processing: {str(e)}")
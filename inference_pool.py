@@ -0,0 +1,100 @@
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, Future
+from config import INFERENCE_WORKERS, INFERENCE_THREADS_PER_WORKER, CT2_CPU_THREADS
+
+logger = logging.getLogger(__name__)
+
+# Bản sao mô hình riêng của mỗi tiến trình worker, được tạo trong _init_worker
+_worker_services = {}
+
+
+def _init_worker(num_threads: int, ct2_threads: int) -> None:
+    import torch
+    from asr_backend import create_transcriber
+    from llm_text_service import LLMTextService
+    from performance_monitor import PerformanceMonitor
+
+    # Chia lõi CPU cho từng worker để các replica không tranh chấp luồng intra-op
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+    _worker_services["transcriber"] = create_transcriber(cpu_threads=ct2_threads)
+    # Bộ đếm của worker (bộ nhớ dịch...) được gửi về tiến trình chính sau mỗi lời gọi, xem _call
+    _worker_services["perf_monitor"] = PerformanceMonitor()
+    _worker_services["text_service"] = LLMTextService(perf_monitor=_worker_services["perf_monitor"])
+    logger.info(f"Inference worker {os.getpid()} ready with {num_threads} torch threads, {ct2_threads} CTranslate2 threads")
+
+
+def _call(target: str, method: str, args: tuple, kwargs: dict) -> tuple:
+    result = getattr(_worker_services[target], method)(*args, **kwargs)
+    return result, _worker_services["perf_monitor"].pop_counters()
+
+
+class InferencePool:
+    """
+    Pool N tiến trình suy luận, mỗi tiến trình giữ một replica Whisper/NLLB/T5 riêng.
+    Các lời gọi được đưa vào hàng đợi của ProcessPoolExecutor và chạy trên worker rảnh đầu tiên,
+    nên lời gọi không được dựa vào trạng thái còn lại trong worker từ lời gọi trước (memo hiệu chỉnh nằm
+    ở tiến trình chính). Bộ đếm mà worker ghi trong lời gọi được cộng vào perf_monitor của tiến trình chính.
+    """
+    def __init__(self, num_workers: int = INFERENCE_WORKERS, threads_per_worker: int = INFERENCE_THREADS_PER_WORKER, perf_monitor=None):
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+        # CT2_CPU_THREADS là tổng số luồng cho mọi replica; 0 (CTranslate2 tự chọn) dùng đúng phần lõi của worker
+        self.ct2_threads = max(1, CT2_CPU_THREADS // num_workers) if CT2_CPU_THREADS > 0 else self.threads_per_worker
+        self.perf_monitor = perf_monitor
+        logger.info(f"Starting inference pool with {num_workers} workers x {self.threads_per_worker} threads")
+        self._executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(self.threads_per_worker, self.ct2_threads)
+        )
+
+    def submit(self, target: str, method: str, *args, **kwargs) -> Future:
+        return self.submit_call(target, method, args, kwargs)
+
+    def submit_call(self, target: str, method: str, args: tuple, kwargs: dict, perf_monitor=None) -> Future:
+        """
+        Gửi lời gọi tới worker; bộ đếm worker ghi trong lời gọi được cộng vào perf_monitor
+        (mặc định perf_monitor của pool), để mỗi job nhận đúng bộ đếm của mình.
+        """
+        perf_monitor = perf_monitor if perf_monitor is not None else self.perf_monitor
+        future = Future()
+
+        def on_done(worker_future: Future) -> None:
+            try:
+                result, counters = worker_future.result()
+            except BaseException as e:
+                future.set_exception(e)
+                return
+            if perf_monitor is not None:
+                perf_monitor.merge_counters(counters)
+            future.set_result(result)
+
+        self._executor.submit(_call, target, method, args, kwargs).add_done_callback(on_done)
+        return future
+
+    def call(self, target: str, method: str, *args, **kwargs):
+        return self.submit(target, method, *args, **kwargs).result()
+
+    def shutdown(self, cancel_futures: bool = True) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=cancel_futures)
+
+
+class RemoteService:
+    """
+    Proxy chuyển mọi lời gọi phương thức tới service cùng tên trong pool (ví dụ "transcriber", "text_service"),
+    nên mã xử lý gọi self.transcriber.transcribe_audio(...) như bình thường mà không chia sẻ mô hình giữa các luồng.
+    perf_monitor: nơi nhận bộ đếm của các lời gọi qua proxy này (None = perf_monitor của pool).
+    """
+    def __init__(self, pool: InferencePool, target: str, perf_monitor=None):
+        self._pool = pool
+        self._target = target
+        self._perf_monitor = perf_monitor
+
+    def __getattr__(self, method: str):
+        def remote_call(*args, **kwargs):
+            return self._pool.submit_call(self._target, method, args, kwargs, self._perf_monitor).result()
+        return remote_call
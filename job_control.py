@@ -0,0 +1,104 @@
+import time
+import logging
+import threading
+from typing import Dict, Iterable, Optional
+from admission import PIPELINE_STAGES
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """
+    Job bị hủy trong lúc xử lý; được ném ra tại điểm kiểm tra kế tiếp để dừng pipeline.
+    """
+
+
+class JobControl:
+    """
+    Liên kết giữa pipeline và bản ghi job trong database: ghi lại bước hiện tại và kiểm tra yêu cầu hủy
+    tại mỗi ranh giới bước (và giữa các segment). Không có db/file_id thì mọi thao tác đều bỏ qua,
+    dùng cho các lần gọi process_single_file trực tiếp.
+    Thời gian của từng bước được cộng dồn vào stage_seconds để đo hệ số thời gian thực (xem admission).
+    progress: ProgressTracker (xem job_progress) nhận các bước, cue Whisper và trạng thái cuối để đẩy qua SSE.
+
+    Các segment của một file lớn chạy song song (xem main.process_single_file) báo bước riêng qua segment_stage;
+    bước của cả file là bước chậm nhất trong các segment, nên database, tiến độ và stage_seconds chỉ thấy
+    một chuỗi bước tuần tự theo thời gian thực của file.
+    """
+    def __init__(self, db=None, file_id: Optional[int] = None, progress=None):
+        self.db = db
+        self.file_id = file_id
+        self.progress = progress
+        self.stage_name = None
+        self.error = None
+        self.duration = 0.0
+        self.stage_seconds: Dict[str, float] = {}
+        self._stage_started = None
+        self._segment_stages: Dict[str, Optional[str]] = {}
+        self._segment_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.db is not None and self.file_id is not None
+
+    def check(self) -> None:
+        if self.enabled and self.db.get_status(self.file_id) in ("CANCELLING", "CANCELLED"):
+            logger.info(f"Job {self.file_id} cancelled during stage {self.stage_name}")
+            raise JobCancelled(f"Job {self.file_id} cancelled")
+
+    def stage(self, name: str) -> None:
+        """
+        Kiểm tra hủy rồi chuyển sang bước name.
+        """
+        self.check()
+        self.finish_stage()
+        self.stage_name = name
+        self._stage_started = time.time()
+        if self.enabled:
+            self.db.update_stage(self.file_id, name)
+        if self.progress is not None:
+            self.progress.stage(name)
+
+    def begin_segments(self, keys: Iterable[str], name: str) -> None:
+        """
+        Đăng ký trước mọi segment sẽ chạy (kể cả segment còn chờ trong hàng đợi) ở bước name,
+        để bước của file không chạy trước rồi lùi lại khi segment chậm bắt đầu.
+        """
+        with self._segment_lock:
+            self._segment_stages = {key: name for key in keys}
+        self.stage(name)
+
+    def segment_stage(self, key: str, name: Optional[str]) -> None:
+        """
+        Segment key chuyển sang bước name (None: segment đã xong). Bước của file chỉ đổi khi segment
+        chậm nhất chuyển bước.
+        """
+        self.check()
+        with self._segment_lock:
+            self._segment_stages[key] = name
+            active = [stage for stage in self._segment_stages.values() if stage is not None]
+            file_stage = min(active, key=PIPELINE_STAGES.index) if active else None
+            if file_stage is not None and file_stage != self.stage_name:
+                self.stage(file_stage)
+
+    def set_duration(self, duration: float) -> None:
+        self.duration = duration
+        if self.progress is not None:
+            self.progress.set_duration(duration)
+
+    def cue(self, segment: Dict, segment_offset: float = 0.0) -> None:
+        """
+        Một cue Whisper vừa tạo ra (timestamp trên trục thời gian của cả file).
+        """
+        if self.progress is not None:
+            self.progress.cue(segment, segment_offset)
+
+    def finish(self, status: str, error: Optional[str] = None) -> None:
+        if self.progress is not None:
+            self.progress.finish(status, error)
+
+    def finish_stage(self) -> None:
+        if self.stage_name is not None and self._stage_started is not None:
+            elapsed = time.time() - self._stage_started
+            self.stage_seconds[self.stage_name] = self.stage_seconds.get(self.stage_name, 0.0) + elapsed
+        self._stage_started = None
@@ -0,0 +1,128 @@
+import json
+import asyncio
+import threading
+import logging
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressHub:
+    """
+    Kênh tiến độ theo job trong tiến trình: worker (luồng bất kỳ) publish sự kiện, các kết nối SSE của API
+    (event loop asyncio) subscribe. Mỗi job giữ trạng thái mới nhất và các cue đã có để người theo dõi
+    kết nối muộn nhận lại đầy đủ; trạng thái được xóa khi job kết thúc.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def _job(self, job_id: int) -> Dict:
+        return self._jobs.setdefault(job_id, {"stage": None, "progress": None, "cues": [], "subscribers": set()})
+
+    def publish(self, job_id: int, event: str, data: Dict) -> None:
+        message = {"event": event, "data": data}
+        with self._lock:
+            job = self._job(job_id)
+            if event == "stage":
+                job["stage"] = message
+            elif event == "progress":
+                job["progress"] = message
+            elif event == "cue":
+                job["cues"].append(message)
+            subscribers = list(job["subscribers"])
+            if event == "status":
+                # Sự kiện kết thúc: người đang theo dõi vẫn nhận được, người đến sau đọc trạng thái từ database
+                self._jobs.pop(job_id, None)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+            except RuntimeError:
+                # Event loop của kết nối đã đóng
+                pass
+
+    def subscribe(self, job_id: int) -> tuple:
+        """
+        Đăng ký nhận sự kiện của job từ event loop hiện tại; trả về (hàng đợi, các sự kiện đã có để phát lại).
+        """
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            job = self._job(job_id)
+            job["subscribers"].add(subscriber)
+            replay = [message for message in (job["stage"], job["progress"]) if message] + list(job["cues"])
+        return subscriber, replay
+
+    def unsubscribe(self, job_id: int, subscriber: tuple) -> None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job["subscribers"].discard(subscriber)
+            if not job["subscribers"] and job["stage"] is None and not job["cues"]:
+                # Job chưa bắt đầu và không còn ai theo dõi
+                self._jobs.pop(job_id, None)
+
+    @staticmethod
+    def format_sse(message: Dict) -> str:
+        return f"event: {message['event']}\ndata: {json.dumps(message['data'], ensure_ascii=False)}\n\n"
+
+
+progress_hub = ProgressHub()
+
+
+class ProgressTracker:
+    """
+    Tính phần trăm hoàn thành của một job và publish lên ProgressHub. Mỗi bước có trọng số bằng hệ số thời
+    gian thực ước lượng của nó (StageRTFEstimator); trong bước phiên âm, phần đã xong tính theo số giây audio
+    Whisper đã xử lý, cộng dồn trên các segment (có thể chạy song song). Phần trăm không bao giờ giảm.
+    """
+    def __init__(self, job: Dict, estimator, hub: ProgressHub = progress_hub):
+        self.job_id = job["id"]
+        self.hub = hub
+        rtf = estimator.snapshot()
+        self.stages = estimator.job_stages(job)
+        self.weights = {stage: rtf.get(stage, 0.0) for stage in self.stages}
+        self.total_weight = sum(self.weights.values()) or 1.0
+        self.duration = float((job.get("metadata") or {}).get("duration") or 0)
+        self.stage_name = None
+        self.percent = 0.0
+        self._processed = {}
+        self._lock = threading.Lock()
+
+    def _update_percent(self) -> float:
+        if self.stage_name not in self.weights:
+            return self.percent
+        done = sum(self.weights[stage] for stage in self.stages[:self.stages.index(self.stage_name)])
+        if self.stage_name == "transcription" and self.duration > 0:
+            fraction = min(1.0, sum(self._processed.values()) / self.duration)
+            done += self.weights["transcription"] * fraction
+        self.percent = max(self.percent, round(100.0 * done / self.total_weight, 1))
+        return self.percent
+
+    def set_duration(self, duration: float) -> None:
+        if duration > 0:
+            self.duration = duration
+
+    def stage(self, name: str) -> None:
+        with self._lock:
+            if name == self.stage_name:
+                return
+            self.stage_name = name
+            percent = self._update_percent()
+        self.hub.publish(self.job_id, "stage", {"stage": name, "percent": percent})
+
+    def cue(self, segment: Dict, segment_offset: float = 0.0) -> None:
+        """
+        Cue mới từ Whisper (timestamp đã cộng offset của segment).
+        """
+        with self._lock:
+            self._processed[segment_offset] = max(self._processed.get(segment_offset, 0.0), segment["end"] - segment_offset)
+            # Bước do JobControl báo (bước chậm nhất của các segment), cue không tự đổi bước của file
+            stage_name = self.stage_name
+            percent = self._update_percent()
+            processed = sum(self._processed.values())
+        self.hub.publish(self.job_id, "cue", {"start": round(segment["start"], 3), "end": round(segment["end"], 3), "text": segment["text"].strip()})
+        self.hub.publish(self.job_id, "progress", {"stage": stage_name, "percent": percent, "processed_seconds": round(processed, 2), "duration": round(self.duration, 2)})
+
+    def finish(self, status: str, error: Optional[str] = None) -> None:
+        self.hub.publish(self.job_id, "status", {"status": status, "error": error, "percent": 100.0 if status == "COMPLETED" else self.percent})
@@ -0,0 +1,133 @@
+import select
+import socket
+import sqlite3
+import threading
+import logging
+from typing import Optional
+from config import JOB_NOTIFY_HOST, JOB_NOTIFY_PORT, JOB_POLL_INTERVAL
+from upload_store import UploadStore
+
+logger = logging.getLogger(__name__)
+
+class JobWorker:
+    """
+    Worker chạy lâu dài: giữ một AudioTranscriptionService (và các mô hình) thường trú,
+    ngủ cho tới khi có bản ghi mới rồi xử lý liên tục đến khi hàng đợi rỗng.
+
+    Có thể xử lý nhiều job song song (max_concurrent_jobs) khi service dùng InferencePool: các job chia sẻ
+    các replica mô hình trong pool thay vì chia sẻ một mô hình giữa các luồng. Số job song song không vượt quá
+    service.max_concurrent_jobs (luôn là 1 khi không có pool).
+
+    Worker được đánh thức bởi gói UDP do DatabaseHandler.add_file gửi; nếu không bind được
+    cổng (ví dụ đã có worker khác), nó tự chuyển sang polling PRAGMA data_version của SQLite.
+    Worker giữ được cổng là worker duy nhất, nên khi khởi động nó khôi phục các job bị bỏ dở
+    bởi lần chạy trước (DatabaseHandler.recover_stale_jobs).
+    """
+    def __init__(self, service=None, poll_interval: float = JOB_POLL_INTERVAL, max_concurrent_jobs: Optional[int] = None):
+        if service is None:
+            from main import AudioTranscriptionService
+            service = AudioTranscriptionService()
+        self.service = service
+        self.poll_interval = poll_interval
+        self.max_concurrent_jobs = max(1, min(max_concurrent_jobs or service.max_concurrent_jobs, service.max_concurrent_jobs))
+        self.stop_event = threading.Event()
+        # Mỗi lần có tín hiệu job mới, generation tăng và mọi luồng xử lý đang chờ được đánh thức
+        self._wake = threading.Condition()
+        self._generation = 0
+        self._socket = self._bind_notify_socket()
+        if self._socket is not None:
+            self.recover_stale_jobs()
+        self._conn = sqlite3.connect(self.service.db.db_path, check_same_thread=False)
+        self._data_version = self._get_data_version()
+
+    def _bind_notify_socket(self) -> Optional[socket.socket]:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind((JOB_NOTIFY_HOST, JOB_NOTIFY_PORT))
+            sock.setblocking(False)
+            logger.info(f"Job worker listening for notifications on {JOB_NOTIFY_HOST}:{JOB_NOTIFY_PORT}")
+            return sock
+        except OSError as e:
+            sock.close()
+            logger.warning(f"Cannot bind notification socket ({str(e)}), falling back to data_version polling")
+            return None
+
+    def recover_stale_jobs(self) -> None:
+        for job in self.service.db.recover_stale_jobs():
+            logger.warning(f"Recovered stale job {job['id']} ({job['file_name']}) as {job['status']}")
+            if job["status"] == "CANCELLED":
+                UploadStore.remove_job_file(job.get("file_path"))
+
+    def _get_data_version(self) -> int:
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _drain_notifications(self) -> None:
+        while True:
+            try:
+                self._socket.recv(64)
+            except (BlockingIOError, OSError):
+                return
+
+    def wait_for_jobs(self) -> bool:
+        """
+        Chờ tối đa poll_interval giây; trả về True nếu có dấu hiệu có bản ghi mới.
+        """
+        if self._socket is not None:
+            readable, _, _ = select.select([self._socket], [], [], self.poll_interval)
+            if readable:
+                self._drain_notifications()
+                return True
+        else:
+            self.stop_event.wait(self.poll_interval)
+
+        # data_version thay đổi khi một kết nối khác commit vào database
+        version = self._get_data_version()
+        changed = version != self._data_version
+        self._data_version = version
+        return changed
+
+    def _signal(self) -> None:
+        with self._wake:
+            self._generation += 1
+            self._wake.notify_all()
+
+    def _job_loop(self) -> None:
+        while not self.stop_event.is_set():
+            with self._wake:
+                seen = self._generation
+            try:
+                self.service.process_batch()
+            except Exception as e:
+                logger.error(f"Error while draining job queue: {str(e)}")
+            with self._wake:
+                # Tín hiệu đến trong lúc đang xử lý làm generation thay đổi nên không bị bỏ lỡ
+                self._wake.wait_for(lambda: self._generation != seen or self.stop_event.is_set(), timeout=30)
+
+    def run(self) -> None:
+        logger.info(f"Starting job worker with {self.max_concurrent_jobs} concurrent job slots")
+        threads = [
+            threading.Thread(target=self._job_loop, name=f"job-slot-{i}", daemon=True)
+            for i in range(self.max_concurrent_jobs)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while not self.stop_event.is_set():
+                if self.wait_for_jobs():
+                    self._signal()
+        finally:
+            self._signal()
+            for thread in threads:
+                thread.join()
+            self.close()
+            logger.info("Job worker stopped")
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self._signal()
+
+    def close(self) -> None:
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        self._conn.close()
@@ -1,26 +1,111 @@
 import logging
 import re
 import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, T5Tokenizer, T5ForConditionalGeneration
 import torch
-from config import NLLB_MODEL, T5_MODEL, LANGUAGE_MAP
+from config import NLLB_MODEL, T5_MODEL, LANGUAGE_MAP, TRANSLATION_BATCH_SIZE, CORRECTION_BATCH_SIZE, CORRECTION_MEMO_SIZE, TRANSLATION_MEMORY_ENABLED, TRANSLATION_MEMORY_MAX_ENTRIES
+from database import DatabaseHandler
+from performance_monitor import PerformanceMonitor
+from model_registry import model_registry
 
 logger = logging.getLogger(__name__)
 
+
+class CorrectionMemo:
+    """
+    Memo hiệu chỉnh T5 theo (text, language) của một job: mỗi câu khác nhau chỉ đi qua T5 một lần
+    (điệp khúc, câu cửa miệng lặp lại...). Câu đã hiệu chỉnh cũng được ghi là điểm cố định nên lượt
+    hiệu chỉnh thứ hai và bước sửa câu trong translate_vtt không gọi lại T5.
+    Mỗi lần process_single_file tạo memo riêng, các job chạy đồng thời không đụng memo của nhau.
+    """
+    def __init__(self, max_entries: int = CORRECTION_MEMO_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Gửi sang worker của InferencePool dưới dạng bản chụp (translate_vtt); phần worker ghi thêm không quay về
+        with self._lock:
+            return {"max_entries": self.max_entries, "entries": list(self._entries.items())}
+
+    def __setstate__(self, state):
+        self.max_entries = state["max_entries"]
+        self._entries = OrderedDict(state["entries"])
+        self._lock = threading.Lock()
+
+    def resolve(self, texts: list, language: str, correct_fn) -> list:
+        """
+        Trả về bản hiệu chỉnh của texts theo đúng thứ tự; correct_fn(list) chỉ nhận các câu chưa có trong memo.
+        """
+        resolved = {}
+        with self._lock:
+            for text in dict.fromkeys(texts):
+                key = (text, language)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    resolved[text] = self._entries[key]
+        pending = [text for text in dict.fromkeys(texts) if text not in resolved]
+        logger.info(f"Correction memo: {len(texts)} texts, {len(pending)} not memoized")
+        if pending:
+            corrected_texts = correct_fn(pending)
+            with self._lock:
+                for text, corrected_text in zip(pending, corrected_texts):
+                    resolved[text] = corrected_text
+                    self._store(text, language, corrected_text)
+                # Câu đã hiệu chỉnh được coi là cố định, không đưa lại qua T5 ở các lượt sau
+                for corrected_text in corrected_texts:
+                    if (corrected_text, language) not in self._entries:
+                        self._store(corrected_text, language, corrected_text)
+        return [resolved[text] for text in texts]
+
+    def _store(self, text: str, language: str, corrected_text: str) -> None:
+        self._entries[(text, language)] = corrected_text
+        self._entries.move_to_end((text, language))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
 class LLMTextService:
-    def __init__(self, model_name=NLLB_MODEL):
+    def __init__(self, model_name=NLLB_MODEL, db: Optional[DatabaseHandler] = None, perf_monitor: Optional[PerformanceMonitor] = None):
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Loading NLLB model from {model_name} on {self.device}...")
+        self.model_name = model_name
+        # Bộ nhớ dịch trong SQLite, khóa theo (câu nguồn chuẩn hóa, src, tgt, model_id)
+        self.model_id = os.path.basename(os.path.normpath(model_name))
+        if TRANSLATION_MEMORY_ENABLED:
+            self.db = db if db is not None else DatabaseHandler()
+        else:
+            self.db = None
+        self.perf_monitor = perf_monitor
         if not os.path.exists(model_name):
             raise FileNotFoundError(f"NLLB model directory not found at {model_name}")
+
+        # NLLB và T5 được nạp lười qua registry và dùng chung giữa các instance
+        self.nllb_key = f"nllb:{model_name}:{self.device}"
+        self.t5_key = f"t5:{T5_MODEL}:{self.device}"
+
+        self.language_to_nllb_code = {
+            "vietnamese": "vie_Latn",
+            "english": "eng_Latn",
+            "korean": "kor_Hang",
+            "chinese": "zho_Hans",
+        }
+
+    def _load_nllb(self):
+        logger.info(f"Loading NLLB model from {self.model_name} on {self.device}...")
         try:
-            self.tokenizer = AutoTokenizer.from_pretrained(model_name, local_files_only=True)
-            self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name, local_files_only=True).to(self.device)
+            tokenizer = AutoTokenizer.from_pretrained(self.model_name, local_files_only=True)
+            model = AutoModelForSeq2SeqLM.from_pretrained(self.model_name, local_files_only=True).to(self.device)
             logger.info(f"NLLB model loaded successfully")
+            return tokenizer, model
         except Exception as e:
             logger.error(f"Failed to load NLLB model: {str(e)}")
             raise RuntimeError(f"Failed to load NLLB model: {str(e)}")
 
+    def _load_t5(self):
         logger.info(f"Loading T5 model from {T5_MODEL}...")
         if not os.path.exists(T5_MODEL):
             logger.info(f"T5 model not found at {T5_MODEL}. Downloading t5-small...")
@@ -34,61 +119,132 @@ class LLMTextService:
             except Exception as e:
                 logger.error(f"Failed to download and save T5 model: {str(e)}")
                 raise RuntimeError(f"Failed to download and save T5 model: {str(e)}")
-        
+
         try:
-            self.t5_tokenizer = T5Tokenizer.from_pretrained(T5_MODEL, local_files_only=True, legacy=False)
-            self.t5_model = T5ForConditionalGeneration.from_pretrained(T5_MODEL, local_files_only=True).to(self.device)
+            t5_tokenizer = T5Tokenizer.from_pretrained(T5_MODEL, local_files_only=True, legacy=False)
+            t5_model = T5ForConditionalGeneration.from_pretrained(T5_MODEL, local_files_only=True).to(self.device)
             logger.info(f"T5 model loaded successfully")
+            return t5_tokenizer, t5_model
         except Exception as e:
             logger.error(f"Failed to load T5 model: {str(e)}")
             raise RuntimeError(f"Failed to load T5 model: {str(e)}")
 
-        self.language_to_nllb_code = {
-            "vietnamese": "vie_Latn",
-            "english": "eng_Latn",
-            "korean": "kor_Hang",
-            "chinese": "zho_Hans",
-        }
+    def _record_translation_memory(self, hits: int, misses: int) -> None:
+        if self.perf_monitor is not None:
+            self.perf_monitor.increment_counter("translation_memory_hits", hits)
+            self.perf_monitor.increment_counter("translation_memory_misses", misses)
+
+    def _nllb_codes(self, src_lang: str, tgt_lang: str) -> tuple:
+        src_lang_name = LANGUAGE_MAP.get(src_lang, src_lang)
+        tgt_lang_name = LANGUAGE_MAP.get(tgt_lang, tgt_lang)
+
+        src_code = self.language_to_nllb_code.get(src_lang_name, "eng_Latn")
+        tgt_code = self.language_to_nllb_code.get(tgt_lang_name, "vie_Latn")
+        return src_code, tgt_code
 
     def translate_text(self, text: str, src_lang: str, tgt_lang: str) -> str:
+        return self.translate_texts([text], src_lang, tgt_lang)[0]
+
+    @staticmethod
+    def normalize_source(text: str) -> str:
+        # Chuẩn hóa Unicode và khoảng trắng để các câu lặp lại khớp cùng một khóa bộ nhớ dịch
+        return " ".join(unicodedata.normalize("NFC", text).split())
+
+    def translate_texts(self, texts: list, src_lang: str, tgt_lang: str, batch_size: int = TRANSLATION_BATCH_SIZE) -> list:
+        """
+        Dịch nhiều câu theo lô. Các câu được sắp theo số token để giảm padding,
+        dịch qua một lần generate cho mỗi lô, rồi trả về đúng thứ tự ban đầu.
+        """
+        if not texts:
+            return []
         try:
-            src_lang_name = LANGUAGE_MAP.get(src_lang, src_lang)
-            tgt_lang_name = LANGUAGE_MAP.get(tgt_lang, tgt_lang)
+            src_code, tgt_code = self._nllb_codes(src_lang, tgt_lang)
+            sources = [self.normalize_source(text) for text in texts]
+
+            # Câu khớp chính xác trong bộ nhớ dịch bỏ qua generate hoàn toàn
+            translations = {}
+            if self.db is not None:
+                translations = self.db.get_translations(sources, src_code, tgt_code, self.model_id)
+            pending = [text for text in dict.fromkeys(sources) if text not in translations]
+            hits = sum(1 for text in sources if text in translations)
+            self._record_translation_memory(hits=hits, misses=len(sources) - hits)
+            logger.info(f"Translating {len(texts)} texts from {src_code} to {tgt_code} in batches of {batch_size} ({len(pending)} not in translation memory)")
 
-            src_code = self.language_to_nllb_code.get(src_lang_name, "eng_Latn")
-            tgt_code = self.language_to_nllb_code.get(tgt_lang_name, "vie_Latn")
+            if pending:
+                new_translations = {}
+                with model_registry.lease(self.nllb_key, self._load_nllb) as (tokenizer, model):
+                    lengths = [len(ids) for ids in tokenizer(pending)["input_ids"]]
+                    order = sorted(range(len(pending)), key=lambda i: lengths[i])
+                    forced_bos_token_id = tokenizer.convert_tokens_to_ids(tgt_code)
 
-            logger.info(f"Translating text from {src_code} to {tgt_code}")
+                    for start in range(0, len(order), batch_size):
+                        batch_indices = order[start:start + batch_size]
+                        inputs = tokenizer(
+                            [pending[i] for i in batch_indices],
+                            return_tensors='pt',
+                            padding=True
+                        ).to(self.device)
+                        with torch.no_grad():
+                            translated = model.generate(
+                                **inputs,
+                                forced_bos_token_id=forced_bos_token_id,
+                                max_length=200,
+                                num_beams=5
+                            )
+                        for i, translated_text in zip(batch_indices, tokenizer.batch_decode(translated, skip_special_tokens=True)):
+                            new_translations[pending[i]] = translated_text
 
-            inputs = self.tokenizer(text, return_tensors='pt', padding=True).to(self.device)
-            translated = self.model.generate(
-                **inputs,
-                forced_bos_token_id=self.tokenizer.convert_tokens_to_ids(tgt_code),
-                max_length=200,
-                num_beams=5
-            )
-            translated_text = self.tokenizer.batch_decode(translated, skip_special_tokens=True)[0]
-            logger.info(f"Translation completed: {translated_text}")
+                translations.update(new_translations)
+                if self.db is not None:
+                    self.db.put_translations(new_translations, src_code, tgt_code, self.model_id, max_entries=TRANSLATION_MEMORY_MAX_ENTRIES)
 
-            return translated_text
+            logger.info(f"Batch translation completed: {len(texts)} texts")
+            return [translations[text] for text in sources]
         except Exception as e:
-            logger.error(f"Error translating text: {str(e)}")
-            raise Exception(f"Error translating text: {str(e)}")
+            logger.error(f"Error translating texts: {str(e)}")
+            raise Exception(f"Error translating texts: {str(e)}")
 
-    def correct_text(self, text: str, language: str) -> str:
+    def correct_texts(self, texts: list, language: str, batch_size: int = CORRECTION_BATCH_SIZE, memo: Optional["CorrectionMemo"] = None) -> list:
+        """
+        Hiệu chỉnh nhiều câu bằng T5 theo lô. memo: CorrectionMemo của job; không truyền thì chỉ
+        loại các câu trùng nhau trong lần gọi này.
+        """
+        if not texts:
+            return []
+        memo = memo if memo is not None else CorrectionMemo()
         try:
-            logger.info(f"Correcting text with T5 for language: {language}")
-            input_text = f"correct: {text}"
-            inputs = self.t5_tokenizer(input_text, return_tensors="pt").to(self.device)
-            corrected = self.t5_model.generate(**inputs, max_length=200, num_beams=4)
-            corrected_text = self.t5_tokenizer.decode(corrected[0], skip_special_tokens=True)
-            logger.info(f"Text correction completed: {corrected_text}")
-            return corrected_text.strip()
+            results = memo.resolve(texts, language, lambda pending: self._correct_batches(pending, language, batch_size))
+            logger.info(f"Text correction completed: {len(results)} texts")
+            return results
         except Exception as e:
-            logger.error(f"Error correcting text with T5: {str(e)}")
+            logger.error(f"Error correcting texts with T5: {str(e)}")
             raise Exception(f"Error correcting text: {str(e)}")
 
-    def translate_vtt(self, input_path: str, output_path: str, source_language: str, target_language: str) -> str:
+    def _correct_batches(self, texts: list, language: str, batch_size: int) -> list:
+        logger.info(f"Correcting {len(texts)} texts with T5 for language: {language}")
+        corrected_texts = [None] * len(texts)
+        input_texts = [f"correct: {text}" for text in texts]
+        with model_registry.lease(self.t5_key, self._load_t5) as (t5_tokenizer, t5_model):
+            # Gom các câu có độ dài token gần nhau vào cùng lô để giảm padding
+            lengths = [len(ids) for ids in t5_tokenizer(input_texts)["input_ids"]]
+            order = sorted(range(len(texts)), key=lambda i: lengths[i])
+            for start in range(0, len(order), batch_size):
+                batch_indices = order[start:start + batch_size]
+                inputs = t5_tokenizer(
+                    [input_texts[i] for i in batch_indices],
+                    return_tensors="pt",
+                    padding=True
+                ).to(self.device)
+                with torch.no_grad():
+                    corrected = t5_model.generate(**inputs, max_length=200, num_beams=4)
+                for i, corrected_text in zip(batch_indices, t5_tokenizer.batch_decode(corrected, skip_special_tokens=True)):
+                    corrected_texts[i] = corrected_text.strip()
+        return corrected_texts
+
+    def correct_text(self, text: str, language: str) -> str:
+        return self.correct_texts([text], language)[0]
+
+    def translate_vtt(self, input_path: str, output_path: str, source_language: str, target_language: str, memo: Optional["CorrectionMemo"] = None) -> str:
         try:
             logger.info(f"Translating VTT file from {input_path} to {output_path}")
 
@@ -96,28 +252,30 @@ class LLMTextService:
                 vtt_content = f.readlines()
 
             translated_lines = ['WEBVTT\n']
+            # Gom toàn bộ nội dung cue trước, giữ chỗ trong translated_lines để dịch theo lô
+            cue_texts = []
+            cue_slots = []
 
             current_segment = []
             is_timing_line = False
 
+            def flush_segment():
+                if current_segment:
+                    cue_slots.append(len(translated_lines))
+                    translated_lines.append(None)
+                    cue_texts.append(' '.join(current_segment))
+                    current_segment.clear()
+                    return True
+                return False
+
             for line in vtt_content[1:]:
                 line = line.strip()
                 if not line:
-                    if current_segment:
-                        text_to_translate = ' '.join(current_segment)
-                        corrected_text = self.correct_text(text_to_translate, source_language)
-                        translated_text = self.translate_text(corrected_text, source_language, target_language)
-                        translated_lines.append(translated_text)
-                        current_segment = []
+                    if flush_segment():
                         translated_lines.append('')
                     is_timing_line = False
                 elif re.match(r'\d\d:\d\d:\d\d\.\d\d\d --> \d\d:\d\d:\d\d\.\d\d\d', line):
-                    if current_segment:
-                        text_to_translate = ' '.join(current_segment)
-                        corrected_text = self.correct_text(text_to_translate, source_language)
-                        translated_text = self.translate_text(corrected_text, source_language, target_language)
-                        translated_lines.append(translated_text)
-                        current_segment = []
+                    flush_segment()
                     translated_lines.append(line)
                     is_timing_line = True
                 else:
@@ -126,11 +284,12 @@ class LLMTextService:
                     else:
                         translated_lines.append(line)
 
-            if current_segment:
-                text_to_translate = ' '.join(current_segment)
-                corrected_text = self.correct_text(text_to_translate, source_language)
-                translated_text = self.translate_text(corrected_text, source_language, target_language)
-                translated_lines.append(translated_text)
+            flush_segment()
+
+            corrected_texts = self.correct_texts(cue_texts, source_language, memo=memo)
+            translated_texts = self.translate_texts(corrected_texts, source_language, target_language)
+            for slot, translated_text in zip(cue_slots, translated_texts):
+                translated_lines[slot] = translated_text
 
             with open(output_path, 'w', encoding='utf-8') as f:
                 f.write('\n'.join(translated_lines) + '\n')
@@ -5,19 +5,26 @@ import json
 from datetime import datetime
 from typing import Dict, Optional
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from moviepy.editor import VideoFileClip
-import torchaudio
+import numpy as np
 
 from performance_monitor import PerformanceMonitor
 from database import DatabaseHandler
 from process_audio import AudioProcessor
-from whisper_model_openai import WhisperOpenAITranscriber
-from llm_text_service import LLMTextService
+from vad_backend import create_vad_processor
+import speech_timeline
+from audio_decoder import decode_audio
+from asr_backend import create_transcriber
+from inference_pool import InferencePool, RemoteService
+from job_control import JobControl, JobCancelled
+from admission import StageRTFEstimator
+from job_progress import ProgressTracker
+from llm_text_service import LLMTextService, CorrectionMemo
+from upload_store import UploadStore
 from subtitle_converter import SubtitleConverter
 from subtitle_embedder import SubtitleEmbedder
 from video_splitter import VideoSplitter
 from evaluate_metrics import calculate_wer, calculate_bleu
-from config import AUDIO_FOLDER, OUTPUT_FOLDER, WHISPER_MODEL, NLLB_MODEL, LANGUAGE_MAP, WHISPER_MODEL_DIR
+from config import AUDIO_FOLDER, OUTPUT_FOLDER, WHISPER_MODEL, NLLB_MODEL, LANGUAGE_MAP, WHISPER_MODEL_DIR, SAMPLE_RATE, ASR_ENGINE, INFERENCE_WORKERS, MAX_CONCURRENT_JOBS, DENOISE_BACKEND
 from video_concatenator import concatenate_videos_ffmpeg
 
 logging.basicConfig(
@@ -31,54 +38,108 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class AudioTranscriptionService:
-    def __init__(self):
+    def __init__(self, inference_workers: int = INFERENCE_WORKERS, max_concurrent_jobs: int = MAX_CONCURRENT_JOBS):
+        # Số đo của từng job nằm trong PerformanceMonitor riêng (process_single_file); perf_monitor này chỉ nhận
+        # bộ đếm của các lời gọi không thuộc job nào
         self.perf_monitor = PerformanceMonitor()
         self.db = DatabaseHandler()
-        self.transcriber = WhisperOpenAITranscriber(model_name='large-v3.pt', directory=WHISPER_MODEL_DIR)
-        self.text_service = LLMTextService(model_name=NLLB_MODEL)
+        self.inference_pool = None
+        if inference_workers > 0:
+            # Mỗi worker giữ replica mô hình riêng; các luồng ở đây chỉ điều phối và chờ kết quả
+            self.inference_pool = InferencePool(num_workers=inference_workers, perf_monitor=self.perf_monitor)
+            self.transcriber = RemoteService(self.inference_pool, "transcriber")
+            self.text_service = RemoteService(self.inference_pool, "text_service")
+            self.max_concurrent_jobs = max(1, max_concurrent_jobs)
+        else:
+            # Các mô hình được nạp lười và dùng chung qua model_registry, khởi tạo service không tốn chi phí nạp
+            self.transcriber = create_transcriber(ASR_ENGINE)
+            self.text_service = LLMTextService(model_name=NLLB_MODEL, db=self.db, perf_monitor=self.perf_monitor)
+            # Mô hình trong tiến trình không dùng chung được giữa các job song song
+            if max_concurrent_jobs > 1:
+                logger.warning(f"MAX_CONCURRENT_JOBS={max_concurrent_jobs} requires INFERENCE_WORKERS > 0, processing one job at a time")
+            self.max_concurrent_jobs = 1
         self.embedder = SubtitleEmbedder()
+        # Hệ số thời gian thực đo được của từng bước, dùng để ước lượng hàng đợi (admission control của API)
+        self.rtf_estimator = StageRTFEstimator()
+
+    def shutdown(self) -> None:
+        if self.inference_pool is not None:
+            self.inference_pool.shutdown()
+
+    def job_text_service(self, perf_monitor: PerformanceMonitor):
+        """
+        Text service ghi bộ đếm (bộ nhớ dịch...) vào perf_monitor của job thay vì perf_monitor chung của service.
+        Mô hình vẫn dùng chung: qua pool, hoặc qua model_registry khi chạy trong tiến trình.
+        """
+        if self.inference_pool is not None:
+            return RemoteService(self.inference_pool, "text_service", perf_monitor=perf_monitor)
+        return LLMTextService(model_name=NLLB_MODEL, db=self.db, perf_monitor=perf_monitor)
+
+    def correct_texts(self, text_service, texts: list, language: str, correction_memo: CorrectionMemo) -> list:
+        """
+        Hiệu chỉnh T5 qua memo của job. Memo nằm ở tiến trình này nên vẫn có hiệu lực khi các lời gọi
+        của job rơi vào các worker khác nhau của pool; worker chỉ nhận các câu chưa có trong memo.
+        """
+        return correction_memo.resolve(texts, language, lambda pending: text_service.correct_texts(pending, language=language))
 
-    def process_segment(self, audio_path: str, origin_language: str, translate_language: str, use_correction: bool, reference_vtt_orig: Optional[str] = None, reference_vtt_trans: Optional[str] = None, timestamp_offset: float = 0.0) -> Dict:
-        file_name = os.path.splitext(os.path.basename(audio_path))[0]
+    def process_segment(self, audio: np.ndarray, file_name: str, origin_language: str, translate_language: str, use_correction: bool, reference_vtt_orig: Optional[str] = None, reference_vtt_trans: Optional[str] = None, timestamp_offset: float = 0.0, clip_timestamps: Optional[list] = None, job_control: Optional[JobControl] = None, correction_memo: Optional[CorrectionMemo] = None, output_dir: str = OUTPUT_FOLDER, perf_monitor: Optional[PerformanceMonitor] = None) -> Dict:
         result = {}
+        perf_monitor = perf_monitor or PerformanceMonitor()
+        text_service = self.job_text_service(perf_monitor)
+        job_control = job_control or JobControl()
+        correction_memo = correction_memo if correction_memo is not None else CorrectionMemo()
+
+        # Segment có thể chạy song song với các segment khác của cùng file; bước được báo theo segment (xem JobControl)
+        job_control.segment_stage(file_name, "transcription")
+
+        perf_monitor.start_measurement(f"transcription_{file_name}")
+
+        def on_segment(segment):
+            job_control.cue({**segment, "start": segment["start"] + timestamp_offset, "end": segment["end"] + timestamp_offset}, timestamp_offset)
 
-        self.perf_monitor.start_measurement(f"transcription_{file_name}")
-        transcription_result = self.transcriber.transcribe_audio(audio_path, language=origin_language)
+        if self.inference_pool is None:
+            transcription_result = self.transcriber.transcribe_audio(audio, language=origin_language, clip_timestamps=clip_timestamps, on_segment=on_segment)
+        else:
+            # Callback không truyền được sang tiến trình của pool; cue được phát khi segment phiên âm xong
+            transcription_result = self.transcriber.transcribe_audio(audio, language=origin_language, clip_timestamps=clip_timestamps)
+            for segment in transcription_result:
+                on_segment(segment)
         # Ánh xạ timestamp với offset
         for segment in transcription_result:
             segment['start'] += timestamp_offset
             segment['end'] += timestamp_offset
-        self.perf_monitor.end_measurement(f"transcription_{file_name}")
+        perf_monitor.end_measurement(f"transcription_{file_name}")
 
         if use_correction:
-            self.perf_monitor.start_measurement(f"text_correction_{file_name}")
+            job_control.segment_stage(file_name, "correction")
+            perf_monitor.start_measurement(f"text_correction_{file_name}")
             lang_code = LANGUAGE_MAP.get(origin_language, 'vietnamese')
-            corrected_segments = []
-            for segment in transcription_result:
-                corrected_text = self.text_service.correct_text(segment['text'], language=lang_code)
-                corrected_segments.append({
+            corrected_texts = self.correct_texts(text_service, [segment['text'] for segment in transcription_result], lang_code, correction_memo)
+            transcription_result = [
+                {
                     'text': corrected_text,
                     'start': segment['start'],
                     'end': segment['end']
-                })
-            transcription_result = corrected_segments
-            self.perf_monitor.end_measurement(f"text_correction_{file_name}")
+                }
+                for segment, corrected_text in zip(transcription_result, corrected_texts)
+            ]
+            perf_monitor.end_measurement(f"text_correction_{file_name}")
 
-        output_vtt = os.path.join(OUTPUT_FOLDER, f"{file_name}_{origin_language}_{origin_language}.vtt")
+        output_vtt = os.path.join(output_dir, f"{file_name}_{origin_language}_{origin_language}.vtt")
         vtt_content = SubtitleConverter.generate_vtt_content(transcription_result, timestamp_offset=timestamp_offset)
         SubtitleConverter.save_vtt_file(vtt_content, output_vtt)
         result["subtitle_path"] = output_vtt
         logger.info(f"Generated subtitle file: {output_vtt}")
 
         if reference_vtt_orig and os.path.exists(reference_vtt_orig):
-            self.perf_monitor.start_measurement(f"wer_evaluation_{file_name}")
+            perf_monitor.start_measurement(f"wer_evaluation_{file_name}")
             lang_code = LANGUAGE_MAP.get(origin_language, 'vietnamese')
             wer_score = calculate_wer(reference_vtt_orig, output_vtt, language=lang_code)
-            self.perf_monitor.end_measurement(f"wer_evaluation_{file_name}")
+            perf_monitor.end_measurement(f"wer_evaluation_{file_name}")
             result["wer_score"] = wer_score
             logger.info(f"WER Score: {wer_score:.4f} for {output_vtt} vs {reference_vtt_orig}")
 
-            wer_output = os.path.join(OUTPUT_FOLDER, f"{file_name}_wer.txt")
+            wer_output = os.path.join(output_dir, f"{file_name}_wer.txt")
             with open(wer_output, "w", encoding='utf-8') as f:
                 f.write(f"WER Evaluation ({lang_code.capitalize()})\n")
                 f.write(f"WER: {wer_score:.4f}\n")
@@ -86,50 +147,55 @@ class AudioTranscriptionService:
 
         if origin_language == translate_language:
             if use_correction:
-                self.perf_monitor.start_measurement(f"text_correction_for_same_language_{file_name}")
+                perf_monitor.start_measurement(f"text_correction_for_same_language_{file_name}")
                 lang_code = LANGUAGE_MAP.get(origin_language, 'vietnamese')
-                corrected_segments = []
-                for segment in transcription_result:
-                    corrected_text = self.text_service.correct_text(segment['text'], language=lang_code)
-                    corrected_segments.append({
+                # Các câu đã hiệu chỉnh ở trên nằm sẵn trong memo nên lượt này không gọi lại T5
+                corrected_texts = self.correct_texts(text_service, [segment['text'] for segment in transcription_result], lang_code, correction_memo)
+                corrected_segments = [
+                    {
                         'text': corrected_text,
                         'start': segment['start'],
                         'end': segment['end']
-                    })
+                    }
+                    for segment, corrected_text in zip(transcription_result, corrected_texts)
+                ]
                 corrected_vtt_content = SubtitleConverter.generate_vtt_content(corrected_segments, timestamp_offset=timestamp_offset)
-                corrected_vtt_path = os.path.join(OUTPUT_FOLDER, f"{file_name}_{origin_language}_{origin_language}_corrected.vtt")
+                corrected_vtt_path = os.path.join(output_dir, f"{file_name}_{origin_language}_{origin_language}_corrected.vtt")
                 SubtitleConverter.save_vtt_file(corrected_vtt_content, corrected_vtt_path)
                 result["translated_subtitle_path"] = corrected_vtt_path
-                self.perf_monitor.end_measurement(f"text_correction_for_same_language_{file_name}")
+                perf_monitor.end_measurement(f"text_correction_for_same_language_{file_name}")
             else:
                 result["translated_subtitle_path"] = output_vtt
                 logger.info(f"Using original subtitle as translated file: {output_vtt}")
         else:
-            self.perf_monitor.start_measurement(f"translation_{file_name}")
-            translated_vtt = self.text_service.translate_vtt(
+            job_control.segment_stage(file_name, "translation")
+            perf_monitor.start_measurement(f"translation_{file_name}")
+            translated_vtt = text_service.translate_vtt(
                 input_path=output_vtt,
-                output_path=os.path.join(OUTPUT_FOLDER, f"{file_name}_{origin_language}_{translate_language}.vtt"),
+                output_path=os.path.join(output_dir, f"{file_name}_{origin_language}_{translate_language}.vtt"),
                 source_language=LANGUAGE_MAP.get(origin_language, 'vietnamese'),
-                target_language=LANGUAGE_MAP.get(translate_language, 'english')
+                target_language=LANGUAGE_MAP.get(translate_language, 'english'),
+                memo=correction_memo
             )
             result["translated_subtitle_path"] = translated_vtt
-            self.perf_monitor.end_measurement(f"translation_{file_name}")
+            perf_monitor.end_measurement(f"translation_{file_name}")
             logger.info(f"Generated translated subtitle file: {translated_vtt}")
 
             if reference_vtt_trans and os.path.exists(reference_vtt_trans):
-                self.perf_monitor.start_measurement(f"bleu_evaluation_{file_name}")
+                perf_monitor.start_measurement(f"bleu_evaluation_{file_name}")
                 lang_code = LANGUAGE_MAP.get(translate_language, 'english')
                 bleu_score = calculate_bleu(reference_vtt_trans, translated_vtt, language=lang_code)
-                self.perf_monitor.end_measurement(f"bleu_evaluation_{file_name}")
+                perf_monitor.end_measurement(f"bleu_evaluation_{file_name}")
                 result["bleu_score"] = bleu_score
                 logger.info(f"BLEU-1 Score: {bleu_score:.4f} for {translated_vtt} vs {reference_vtt_trans}")
 
-                bleu_output = os.path.join(OUTPUT_FOLDER, f"{file_name}_bleu.txt")
+                bleu_output = os.path.join(output_dir, f"{file_name}_bleu.txt")
                 with open(bleu_output, "w", encoding='utf-8') as f:
                     f.write(f"BLEU-1 Evaluation ({lang_code.capitalize()})\n")
                     f.write(f"BLEU-1: {bleu_score:.4f}\n")
                 logger.info(f"Saved BLEU results to: {bleu_output}")
 
+        job_control.segment_stage(file_name, None)
         return result
 
     def process_single_file(
@@ -141,74 +207,101 @@ class AudioTranscriptionService:
         embed_subtitle: str = 'none',
         reference_vtt_orig: Optional[str] = None,
         reference_vtt_trans: Optional[str] = None,
-        metadata: Optional[dict] = None
+        metadata: Optional[dict] = None,
+        denoise_backend: str = DENOISE_BACKEND,
+        job_control: Optional[JobControl] = None,
+        output_dir: str = OUTPUT_FOLDER,
+        perf_monitor: Optional[PerformanceMonitor] = None
     ) -> Optional[Dict]:
+        """
+        job_control: bản ghi job để báo bước hiện tại và kiểm tra yêu cầu hủy; JobCancelled được ném ra
+        (không trả về None) khi job bị hủy, lỗi khác được ghi vào job_control.error.
+        output_dir: thư mục ghi phụ đề, video và map.json của lần xử lý này (process_job dùng thư mục riêng của job).
+        perf_monitor: số đo của riêng lần xử lý này (mặc định tạo mới), để các job chạy song song không ghi đè
+        số đo "total_processing"... của nhau.
+        """
+        job_control = job_control or JobControl()
+        perf_monitor = perf_monitor or PerformanceMonitor()
         try:
+            os.makedirs(output_dir, exist_ok=True)
             logger.info(f"Processing file: {audio_path}")
-            self.perf_monitor.start_measurement("total_processing")
+            perf_monitor.start_measurement("total_processing")
             file_name = os.path.splitext(os.path.basename(audio_path))[0]
             result = {}
+            # Memo hiệu chỉnh chỉ có hiệu lực trong phạm vi một job, dùng chung cho mọi segment của job
+            correction_memo = CorrectionMemo()
 
             # Kiểm tra metadata
             file_info = metadata or {}
-            input_audio = audio_path
-
-            if file_info.get("is_video"):
-                logger.info(f"Converting video to audio: {audio_path}")
-                temp_audio = os.path.join(OUTPUT_FOLDER, f"{file_name}_temp.wav")
-                video = VideoFileClip(audio_path)
-                video.audio.write_audiofile(temp_audio, codec='pcm_s16le')
-                video.close()
-                input_audio = temp_audio
-
-            # Xử lý âm thanh
-            processed_audio = AudioProcessor.process_audio(
-                input_audio,
-                os.path.join(OUTPUT_FOLDER, f"{file_name}_processed.wav"),
-                apply_noise_reduction=False
-            )
-            original_audio = processed_audio.replace("_processed.wav", "_original.wav")
-            if not os.path.exists(original_audio):
-                logger.warning(f"Original normalized audio not found: {original_audio}. Fallback to processed.")
-                original_audio = processed_audio
+
+            # Giải mã một lần duy nhất thành buffer 16 kHz mono float32 dùng chung cho mọi bước
+            job_control.stage("decode")
+            perf_monitor.start_measurement(f"decode_{file_name}")
+            audio = decode_audio(audio_path, sample_rate=SAMPLE_RATE)
+            perf_monitor.end_measurement(f"decode_{file_name}")
 
             # Kiểm tra độ dài và phân đoạn
-            duration = file_info.get("duration", 0) or (VideoFileClip(audio_path).duration if file_info.get("is_video") else torchaudio.info(original_audio).num_frames / 16000)
-            audio_paths = [original_audio]
+            duration = file_info.get("duration", 0) or len(audio) / SAMPLE_RATE
+            job_control.set_duration(duration)
+            # VAD chạy một lần trên toàn bộ buffer; chia đoạn, ước lượng nhiễu và chọn vùng ASR đều dùng lại kết quả này
+            job_control.stage("vad")
+            perf_monitor.start_measurement(f"vad_{file_name}")
+            speech_boundaries = create_vad_processor().detect_boundaries(audio)
+            perf_monitor.end_measurement(f"vad_{file_name}")
+            logger.info(f"VAD found {len(speech_boundaries)} speech segments ({speech_timeline.speech_seconds(speech_boundaries):.2f}s of speech)")
+
+            segments = [{"start": 0.0, "end": duration, "start_sample": 0, "end_sample": len(audio), "audio": audio}]
+            segment_names = [file_name]
             map_path = None
             if duration > 600:
                 logger.info(f"Video duration {duration}s > 10 minutes, splitting...")
-                audio_paths, map_path = VideoSplitter.split_video(audio_path if file_info.get("is_video") else original_audio, OUTPUT_FOLDER)
+                segments = VideoSplitter.split_waveform(audio, SAMPLE_RATE, speech_boundaries)
+                segment_names = [f"{file_name}_segment_{i}" for i in range(len(segments))]
+                map_path = VideoSplitter.save_timestamp_map(segment_names, segments, output_dir)
 
             # Khử nhiễu
-            denoised_paths = []
-            for audio_path in audio_paths:
-                denoised_path = os.path.join(OUTPUT_FOLDER, f"{os.path.basename(audio_path).replace('.wav', '_denoised.wav')}")
-                AudioProcessor.process_audio(audio_path, denoised_path, apply_noise_reduction=True)
-                denoised_paths.append(denoised_path)
+            job_control.stage("denoise")
+            perf_monitor.start_measurement(f"denoise_{file_name}")
+            # Giữ nguyên trục thời gian, Whisper chỉ giải mã các vùng tiếng nói VAD qua clip_timestamps
+            denoised_segments = []
+            for segment in segments:
+                job_control.check()
+                segment_boundaries = speech_timeline.slice_boundaries(speech_boundaries, segment["start_sample"], segment["end_sample"])
+                denoised_audio, segment_boundaries = AudioProcessor.process_waveform(
+                    segment["audio"],
+                    apply_noise_reduction=True,
+                    merge_speech=False,
+                    perf_monitor=perf_monitor,
+                    denoise_backend=denoise_backend,
+                    speech_boundaries=segment_boundaries
+                )
+                clip_timestamps = speech_timeline.clip_timestamps(segment_boundaries, SAMPLE_RATE) if len(segment_boundaries) else None
+                denoised_segments.append((denoised_audio, clip_timestamps))
+            perf_monitor.end_measurement(f"denoise_{file_name}")
 
+            # Chỉ chạy song song các segment khi có pool tiến trình; mô hình trong tiến trình này không an toàn đa luồng
             segment_results = {}
-            with ThreadPoolExecutor() as executor:
+            max_segment_workers = self.inference_pool.num_workers if self.inference_pool else 1
+            job_control.begin_segments(segment_names, "transcription")
+            with ThreadPoolExecutor(max_workers=max_segment_workers) as executor:
                 futures = []
-                if map_path and os.path.exists(map_path):
-                    with open(map_path, 'r', encoding='utf-8') as f:
-                        timestamp_map = json.load(f)
-                else:
-                    timestamp_map = {}
-                
-                for audio_path in denoised_paths:
-                    segment_name = os.path.basename(audio_path)
-                    timestamp_offset = timestamp_map.get(segment_name, {}).get("start", 0.0)
+                for segment_name, segment, (denoised_audio, clip_timestamps) in zip(segment_names, segments, denoised_segments):
                     futures.append(
                         executor.submit(
                             self.process_segment,
-                            audio_path,
+                            denoised_audio,
+                            segment_name,
                             origin_language,
                             translate_language,
                             use_correction,
                             reference_vtt_orig,
                             reference_vtt_trans,
-                            timestamp_offset
+                            segment["start"],
+                            clip_timestamps,
+                            job_control,
+                            correction_memo,
+                            output_dir,
+                            perf_monitor
                         )
                     )
                 
@@ -224,9 +317,10 @@ class AudioTranscriptionService:
             result["map_path"] = map_path
 
             if embed_subtitle in ['soft', 'hard'] and file_info.get("is_video"):
-                self.perf_monitor.start_measurement("subtitle_embedding")
+                job_control.stage("embed")
+                perf_monitor.start_measurement("subtitle_embedding")
                 logger.info(f"Embedding subtitle into video.")
-                output_video = os.path.join(OUTPUT_FOLDER, f"{file_name}_subtitled.mp4")
+                output_video = os.path.join(output_dir, f"{file_name}_subtitled.mp4")
                 subtitle_to_embed = result["translated_subtitle_paths"][-1]
                 map_path = result.get("map_path")
 
@@ -243,57 +337,97 @@ class AudioTranscriptionService:
                 else:
                     logger.error(f"Video file not created or empty: {embedded_video}")
                     raise RuntimeError("Video file not created or empty")
-                self.perf_monitor.end_measurement("subtitle_embedding")
+                perf_monitor.end_measurement("subtitle_embedding")
             elif embed_subtitle in ['soft', 'hard'] and not file_info.get("is_video"):
                 logger.warning("Subtitle embedding requested but input file is not a video")
 
             if duration > 600 and embed_subtitle in ['soft', 'hard']:
-                segment_video_paths = [os.path.join(OUTPUT_FOLDER, f"{file_name}_segment_{i}_subtitled.mp4") for i in range(len(denoised_paths))]
-                final_video_path = os.path.join(OUTPUT_FOLDER, f"{file_name}_subtitled.mp4")
+                segment_video_paths = [os.path.join(output_dir, f"{segment_name}_subtitled.mp4") for segment_name in segment_names]
+                final_video_path = os.path.join(output_dir, f"{file_name}_subtitled.mp4")
                 concatenate_videos_ffmpeg(segment_video_paths, final_video_path)
                 result["video_url"] = final_video_path
 
-            self.perf_monitor.end_measurement("total_processing")
-            self.perf_monitor.print_summary()
+            perf_monitor.end_measurement("total_processing")
+            perf_monitor.print_summary(f"PERFORMANCE SUMMARY: {file_name}")
             return result
+        except JobCancelled:
+            raise
         except FileNotFoundError as e:
             logger.error(f"File error: {str(e)}")
+            job_control.error = str(e)
             return None
         except RuntimeError as e:
             logger.error(f"Embedding error: {str(e)}")
+            job_control.error = str(e)
             return None
         except Exception as e:
             logger.error(f"Error processing {audio_path}: {str(e)}")
+            job_control.error = str(e)
             return None
 
-    def process_batch(self):
-        audio_files = self.db.get_pending_files()
-        logger.info(f"Processing {len(audio_files)} audio files...")
-        for audio in audio_files:
-            try:
-                self.db.update_status(audio['id'], 'PROCESSING')
-                audio_path = os.path.join(AUDIO_FOLDER, audio['file_name'])
-
-                reference_vtt_orig = os.path.join(AUDIO_FOLDER, f"{os.path.splitext(audio['file_name'])[0]}_ref_{audio['origin_language']}.vtt")
-                reference_vtt_trans = os.path.join(AUDIO_FOLDER, f"{os.path.splitext(audio['file_name'])[0]}_ref_{audio['translate_language']}.vtt")
-
-                result = self.process_single_file(
-                    audio_path=audio_path,
-                    origin_language=audio['origin_language'],
-                    translate_language=audio['translate_language'],
-                    use_correction=audio['use_correction'],
-                    embed_subtitle=audio['embed_subtitle'],
-                    reference_vtt_orig=reference_vtt_orig if os.path.exists(reference_vtt_orig) else None,
-                    reference_vtt_trans=reference_vtt_trans if os.path.exists(reference_vtt_trans) else None
-                )
-                if result:
-                    self.db.update_status(audio['id'], 'COMPLETED')
-                    self.db.update_result(audio['id'], result)
-                else:
-                    self.db.update_status(audio['id'], 'FAILED')
-            except Exception as e:
-                logger.error(f"Error processing {audio['file_name']}: {str(e)}")
-                self.db.update_status(audio['id'], 'FAILED')
+    @staticmethod
+    def job_output_dir(job_id: int) -> str:
+        return os.path.join(OUTPUT_FOLDER, f"job_{job_id}")
+
+    def process_job(self, audio: Dict) -> bool:
+        job_control = JobControl(self.db, audio['id'], progress=ProgressTracker(audio, self.rtf_estimator))
+        # File do API nhận thuộc về job và được xóa khi job kết thúc; file trong AUDIO_FOLDER được giữ lại
+        uploaded_path = audio.get('file_path')
+        try:
+            audio_path = uploaded_path or os.path.join(AUDIO_FOLDER, audio['file_name'])
+
+            reference_vtt_orig = os.path.join(AUDIO_FOLDER, f"{os.path.splitext(audio['file_name'])[0]}_ref_{audio['origin_language']}.vtt")
+            reference_vtt_trans = os.path.join(AUDIO_FOLDER, f"{os.path.splitext(audio['file_name'])[0]}_ref_{audio['translate_language']}.vtt")
+
+            result = self.process_single_file(
+                audio_path=audio_path,
+                origin_language=audio['origin_language'],
+                translate_language=audio['translate_language'],
+                use_correction=audio['use_correction'],
+                embed_subtitle=audio['embed_subtitle'],
+                reference_vtt_orig=reference_vtt_orig if os.path.exists(reference_vtt_orig) else None,
+                reference_vtt_trans=reference_vtt_trans if os.path.exists(reference_vtt_trans) else None,
+                metadata=audio.get('metadata'),
+                denoise_backend=audio.get('denoise_backend') or DENOISE_BACKEND,
+                job_control=job_control,
+                # Kết quả được đặt tên theo file gốc; thư mục riêng của job để các file trùng tên không ghi đè lẫn nhau
+                output_dir=self.job_output_dir(audio['id'])
+            )
+            if result:
+                job_control.finish_stage()
+                self.rtf_estimator.observe(job_control.stage_seconds, job_control.duration)
+                self.db.update_result(audio['id'], result)
+                self.db.update_stage(audio['id'], 'done')
+                self.db.update_status(audio['id'], 'COMPLETED')
+                job_control.finish('COMPLETED')
+                return True
+            self.db.update_status(audio['id'], 'FAILED', error=job_control.error or "Processing failed")
+            job_control.finish('FAILED', job_control.error or "Processing failed")
+        except JobCancelled:
+            self.db.update_status(audio['id'], 'CANCELLED')
+            job_control.finish('CANCELLED')
+        except Exception as e:
+            logger.error(f"Error processing {audio['file_name']}: {str(e)}")
+            self.db.update_status(audio['id'], 'FAILED', error=str(e))
+            job_control.finish('FAILED', str(e))
+        finally:
+            # Mỗi upload nằm trong thư mục riêng (xem upload_store), xóa luôn thư mục nếu đã rỗng
+            UploadStore.remove_job_file(uploaded_path)
+        return False
+
+    def process_batch(self) -> int:
+        # Xử lý liên tục cho đến khi hết hàng đợi, mỗi bản ghi được claim nguyên tử
+        processed = 0
+        while True:
+            audio = self.db.claim_next_file()
+            if audio is None:
+                break
+            logger.info(f"Processing queued file {audio['id']}: {audio['file_name']}")
+            self.process_job(audio)
+            processed += 1
+        if processed:
+            logger.info(f"Processed {processed} queued audio files")
+        return processed
 
 def main():
     service = AudioTranscriptionService()
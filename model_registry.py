@@ -0,0 +1,134 @@
+import os
+import gc
+import time
+import threading
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable
+import psutil
+from config import MODEL_MEMORY_BUDGET_MB
+
+logger = logging.getLogger(__name__)
+
+class ModelRegistry:
+    """
+    Registry dùng chung cho toàn tiến trình: nạp mô hình lười (lần dùng đầu tiên),
+    chia sẻ một instance cho mọi thành phần và giải phóng mô hình nhàn rỗi khi RSS vượt ngân sách.
+    """
+    def __init__(self, memory_budget_mb: float = MODEL_MEMORY_BUDGET_MB):
+        """
+        Args:
+            memory_budget_mb (float): Ngân sách RSS (MB); <= 0 nghĩa là không giới hạn.
+        """
+        self.memory_budget_mb = memory_budget_mb
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+        self._load_locks = {}
+        self._process = psutil.Process(os.getpid())
+
+    def _get_ram_usage(self) -> float:
+        return self._process.memory_info().rss / 1024**2
+
+    def _load(self, key: str, loader: Callable[[], Any]) -> dict:
+        with self._lock:
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+        # Khóa theo từng key để các luồng khác không phải chờ khi một mô hình lớn đang nạp
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    return entry
+            logger.info(f"Loading model '{key}' into registry")
+            start = time.time()
+            model = loader()
+            entry = {
+                "model": model,
+                "leases": 0,
+                "last_used": time.time(),
+                "lock": threading.Lock()
+            }
+            with self._lock:
+                self._entries[key] = entry
+            logger.info(f"Model '{key}' loaded in {time.time() - start:.2f}s, RSS: {self._get_ram_usage():.2f} MB")
+        self._enforce_budget(keep=key)
+        return entry
+
+    def _touch(self, key: str, loader: Callable[[], Any]) -> dict:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            entry = self._load(key, loader)
+        entry["last_used"] = time.time()
+        return entry
+
+    def _acquire(self, key: str, loader: Callable[[], Any]) -> dict:
+        """
+        Tra cứu và tăng số lease trong cùng một lần giữ khóa, để _enforce_budget ở luồng khác không thể
+        giải phóng mô hình giữa lúc tra cứu và lúc giữ. Nếu mô hình vừa nạp đã bị giải phóng trước khi kịp giữ thì nạp lại.
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    entry["leases"] += 1
+                    entry["last_used"] = time.time()
+                    return entry
+            self._load(key, loader)
+
+    def get(self, key: str, loader: Callable[[], Any]) -> Any:
+        """
+        Trả về instance dùng chung của mô hình `key`, nạp bằng `loader` nếu chưa có.
+        """
+        return self._touch(key, loader)["model"]
+
+    @contextmanager
+    def lease(self, key: str, loader: Callable[[], Any], exclusive: bool = False):
+        """
+        Giữ mô hình trong suốt khối with để nó không bị giải phóng khi đang dùng.
+        `exclusive=True` tuần tự hóa truy cập cho các mô hình có trạng thái (ví dụ Silero VAD).
+        """
+        entry = self._acquire(key, loader)
+        try:
+            if exclusive:
+                with entry["lock"]:
+                    yield entry["model"]
+            else:
+                yield entry["model"]
+        finally:
+            with self._lock:
+                entry["leases"] -= 1
+                entry["last_used"] = time.time()
+
+    def evict(self, key: str) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["leases"] > 0:
+                return False
+            del self._entries[key]
+        del entry
+        gc.collect()
+        logger.info(f"Evicted model '{key}' from registry, RSS: {self._get_ram_usage():.2f} MB")
+        return True
+
+    def _enforce_budget(self, keep: str = None) -> None:
+        if self.memory_budget_mb <= 0:
+            return
+        while self._get_ram_usage() > self.memory_budget_mb:
+            with self._lock:
+                # Ưu tiên giải phóng mô hình ít dùng gần đây nhất và không bị giữ
+                candidates = [k for k, e in self._entries.items() if k != keep and e["leases"] == 0]
+            if not candidates:
+                logger.warning(f"RSS {self._get_ram_usage():.2f} MB exceeds model budget {self.memory_budget_mb} MB but no idle model can be evicted")
+                return
+            self.evict(candidates[0])
+
+    def loaded_models(self) -> list:
+        with self._lock:
+            return list(self._entries.keys())
+
+
+model_registry = ModelRegistry()
@@ -1,14 +1,22 @@
 import os
 import time
 import psutil
+import threading
 import logging
 
 logger = logging.getLogger(__name__)
 
 class PerformanceMonitor:
+    """
+    Thời gian/RAM của các bước và bộ đếm của một lần xử lý. Mỗi job dùng một instance riêng
+    (xem main.process_single_file); các segment của job ghi vào cùng instance từ nhiều luồng nên mọi
+    thao tác trên measurements/counters giữ _lock.
+    """
     def __init__(self):
         self.measurements = {}
         self.start_times = {}
+        self.counters = {}
+        self._lock = threading.Lock()
         self._process = psutil.Process(os.getpid())
 
     def _get_ram_usage(self):
@@ -16,29 +24,53 @@ class PerformanceMonitor:
         return mem_info.rss / 1024**2
 
     def start_measurement(self, name: str):
-        self.start_times[name] = time.time()
-        self.measurements[name] = {"ram_start": self._get_ram_usage()}
+        ram_start = self._get_ram_usage()
+        with self._lock:
+            self.start_times[name] = time.time()
+            self.measurements[name] = {"ram_start": ram_start}
 
     def end_measurement(self, name: str):
-        if name not in self.start_times:
-            raise ValueError(f"No measurement started with name: {name}")
-        elapsed_time = time.time() - self.start_times[name]
         ram_end = self._get_ram_usage()
-        self.measurements[name].update({
-            "elapsed_time": elapsed_time,
-            "ram_end": ram_end,
-            "ram_diff": ram_end - self.measurements[name]["ram_start"]
-        })
+        with self._lock:
+            if name not in self.start_times:
+                raise ValueError(f"No measurement started with name: {name}")
+            elapsed_time = time.time() - self.start_times[name]
+            self.measurements[name].update({
+                "elapsed_time": elapsed_time,
+                "ram_end": ram_end,
+                "ram_diff": ram_end - self.measurements[name]["ram_start"]
+            })
+
+    def increment_counter(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def merge_counters(self, counters: dict) -> None:
+        with self._lock:
+            for name, value in counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def pop_counters(self) -> dict:
+        with self._lock:
+            counters, self.counters = self.counters, {}
+        return counters
 
     def log_measurement(self, name: str):
-        m = self.measurements[name]
+        with self._lock:
+            m = dict(self.measurements[name])
         logger.info(f"Performance: {name}")
         logger.info(f"Time: {m['elapsed_time']:.2f} seconds")
         logger.info(f"RAM: {m['ram_end']:.2f} MB (Change: {m['ram_diff']:.2f} MB)")
 
-    def print_summary(self):
-        logger.info("\n=== PERFORMANCE SUMMARY ===")
-        for name, m in self.measurements.items():
+    def print_summary(self, title: str = "PERFORMANCE SUMMARY"):
+        # Chụp lại dưới khóa để luồng khác vẫn ghi được trong lúc in
+        with self._lock:
+            measurements = {name: dict(m) for name, m in self.measurements.items()}
+            counters = dict(self.counters)
+        logger.info(f"\n=== {title} ===")
+        for name, m in measurements.items():
             if "elapsed_time" in m:
                 logger.info(f"{name}: {m['elapsed_time']:.2f}s, RAM: +{m['ram_diff']:.2f} MB")
+        for name, value in counters.items():
+            logger.info(f"{name}: {value}")
         logger.info("==========================\n")
\ No newline at end of file
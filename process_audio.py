@@ -1,79 +1,131 @@
 import os
-from pydub import AudioSegment
 import numpy as np
 import logging
-from vad_speeched import SileroVADProcessor
-from audio_denoiser import AudioDenoiser
+from vad_backend import create_vad_processor
+import speech_timeline
+from audio_denoiser import speech_mask, noise_stats, needs_denoising, plan_chunk_skips
+from denoise_long_audio import denoise_waveform
+from denoiser_backends import create_denoiser
+from audio_decoder import decode_audio, save_wav
+from config import SAMPLE_RATE, DENOISE_GATE_ENABLED, DENOISE_ESTIMATED_RTF, DENOISE_BACKEND
 
 logger = logging.getLogger(__name__)
 
 class AudioProcessor:
     @staticmethod
-    def process_audio(input_path: str, output_path: str, apply_noise_reduction: bool = False) -> str:
-        try:
-            logger.info(f"Processing audio with VAD: {input_path} -> {output_path}")
-            vad_output_path = output_path.replace(".wav", "_vad.wav")
-            vad_processor = SileroVADProcessor()
-            speech_timestamps = vad_processor.process(input_path, vad_output_path)
+    def normalize(samples: np.ndarray, headroom_db: float = 0.1, in_place: bool = False) -> np.ndarray:
+        # Chuẩn hóa biên độ đỉnh giống AudioSegment.normalize của pydub
+        peak = np.max(np.abs(samples)) if samples.size else 0.0
+        if peak == 0:
+            return samples
+        target = 10 ** (-headroom_db / 20)
+        if in_place and samples.dtype == np.float32:
+            samples *= np.float32(target / peak)
+            return samples
+        return (samples * (target / peak)).astype(np.float32)
 
-            # Lưu timestamp gốc
-            original_audio = AudioSegment.from_file(input_path)
-            original_audio = original_audio.set_frame_rate(16000).set_channels(1)
-            original_output_path = output_path.replace(".wav", "_original.wav")
-            original_audio.export(original_output_path, format="wav")
-            logger.info(f"Saved original (normalized) audio to: {original_output_path}")
+    @staticmethod
+    def clip_timestamps(speech_boundaries: np.ndarray, sample_rate: int = SAMPLE_RATE, merge_gap: float = 1.0, pad: float = 0.2) -> list:
+        """
+        Danh sách phẳng [start1, end1, ...] (giây) cho clip_timestamps của Whisper, xem speech_timeline.clip_timestamps.
+        """
+        return speech_timeline.clip_timestamps(speech_boundaries, sample_rate, merge_gap, pad)
 
-            if not speech_timestamps:
-                logger.warning("No speech segments detected. Using original audio instead.")
-                original_audio.export(output_path, format="wav")
-                return output_path
+    @staticmethod
+    def _record_skipped_denoise(perf_monitor, skipped_samples: int, skipped_chunks: int = 0, skipped_file: bool = False) -> None:
+        skipped_seconds = skipped_samples / SAMPLE_RATE
+        saved_seconds = skipped_seconds * DENOISE_ESTIMATED_RTF
+        logger.info(f"Skipping denoise for {skipped_seconds:.2f}s of clean audio (estimated saving {saved_seconds:.2f}s)")
+        if perf_monitor is None:
+            return
+        if skipped_file:
+            perf_monitor.increment_counter("denoise_files_skipped")
+        perf_monitor.increment_counter("denoise_chunks_skipped", skipped_chunks)
+        perf_monitor.increment_counter("denoise_seconds_skipped", round(skipped_seconds, 2))
+        perf_monitor.increment_counter("denoise_estimated_seconds_saved", round(saved_seconds, 2))
 
-            if not os.path.exists(vad_output_path):
-                raise Exception("VAD output not created")
+    @staticmethod
+    def process_waveform(audio: np.ndarray, apply_noise_reduction: bool = False, merge_speech: bool = True, perf_monitor=None, denoise_backend: str = DENOISE_BACKEND, speech_boundaries: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        VAD + khử nhiễu + chuẩn hóa trên buffer 16 kHz mono float32 đã giải mã.
+        merge_speech=True ghép các đoạn tiếng nói lại với nhau; False giữ nguyên trục thời gian gốc
+        để các timestamp VAD dùng trực tiếp làm clip_timestamps cho Whisper.
+        Khi DENOISE_GATE_ENABLED, audio đủ sạch (theo SNR/mức nhiễu nền) bỏ qua khử nhiễu cho cả file,
+        hoặc theo từng đoạn khi giữ nguyên trục thời gian; quyết định được ghi vào perf_monitor.
+        denoise_backend chọn backend khử nhiễu cho job này (xem denoiser_backends).
+        speech_boundaries: kết quả VAD đã có (int32 (n, 2) theo mẫu, cục bộ với audio); None thì chạy VAD tại đây.
+        Trả về (audio đã xử lý, speech boundaries theo mẫu).
+        """
+        if speech_boundaries is None:
+            logger.info(f"Processing {len(audio) / SAMPLE_RATE:.2f}s of audio with VAD")
+            speech_boundaries = create_vad_processor().detect_boundaries(audio)
+        else:
+            speech_boundaries = speech_timeline.to_boundaries(speech_boundaries)
 
-            # Log speech timestamps
-            for i, segment in enumerate(speech_timestamps):
-                start_time = segment['start'] / 16000
-                end_time = segment['end'] / 16000
-                logger.info(f"Speech segment {i+1}: {start_time:.3f}s --> {end_time:.3f}s")
+        if len(speech_boundaries) == 0:
+            logger.warning("No speech segments detected. Using original audio instead.")
+            return audio, speech_boundaries
 
-            # Verify audio file integrity
-            if os.path.getsize(vad_output_path) == 0:
-                raise Exception("VAD output file is empty")
+        summary = speech_timeline.timeline_summary(speech_boundaries, len(audio), SAMPLE_RATE)
+        logger.info(
+            f"VAD: {summary['segments']} speech segments, {summary['speech_sec']:.2f}s speech "
+            f"({summary['speech_ratio']:.1%}), longest speech {summary['longest_speech_sec']:.2f}s, "
+            f"longest silence {summary['longest_silence_sec']:.2f}s"
+        )
 
-            audio = AudioSegment.from_file(vad_output_path)
-            if apply_noise_reduction:
-                logger.info("Applying noise reduction")
-                denoiser = AudioDenoiser(sample_rate=16000, prop_reduce=0.8)
-                samples = np.array(audio.get_array_of_samples(), dtype=np.float32) / 32767.0
-                samples = np.expand_dims(samples, axis=0)
-                # Lấy mẫu nhiễu từ 0.8s đầu
-                noise_sample = samples[:, :int(0.8 * 16000)]
-                denoised_samples = denoiser.process(samples)
-                # Kiểm tra SNR
-                signal_power = np.mean(denoised_samples ** 2)
-                noise_power = np.mean(noise_sample ** 2)
-                snr = 10 * np.log10(signal_power / noise_power) if noise_power > 0 else float('inf')
-                if snr < 20:
-                    logger.warning(f"SNR {snr:.2f} dB below threshold, applying stronger noise reduction")
-                    denoised_samples = denoiser.process(samples, prop_reduce=1.0)
-                audio = AudioSegment(
-                    (denoised_samples[0] * 32767).astype(np.int16).tobytes(),
-                    frame_rate=16000,
-                    sample_width=2,
-                    channels=1
-                )
+        if apply_noise_reduction:
+            # Mẫu nhiễu lấy trên trục thời gian gốc, trước khi ghép các đoạn tiếng nói
+            mask = speech_mask(len(audio), speech_boundaries)
+            snr_db, noise_dbfs = (float(v[0]) for v in noise_stats(audio, mask, [(0, len(audio))]))
+            logger.info(f"Estimated SNR {snr_db:.2f} dB, noise floor {noise_dbfs:.2f} dBFS")
+            if DENOISE_GATE_ENABLED and not needs_denoising(snr_db, noise_dbfs):
+                AudioProcessor._record_skipped_denoise(perf_monitor, len(audio), skipped_file=True)
+                apply_noise_reduction = False
             else:
-                logger.info("Skipping noise reduction")
+                denoiser = create_denoiser(denoise_backend)
+                denoiser.fit(audio, mask, snr_db)
+
+        if merge_speech:
+            samples = np.concatenate([audio[start:end] for start, end in speech_boundaries])
+        else:
+            samples = audio
+        if samples.size == 0:
+            raise Exception("VAD output is empty")
 
-            audio_normalized = audio.normalize()
-            audio_normalized.export(output_path, format="wav")
+        if apply_noise_reduction:
+            logger.info(f"Applying noise reduction with {denoiser.backend_name}")
+            plan_skips = None
+            if DENOISE_GATE_ENABLED and not merge_speech:
+                # Chỉ quyết định theo đoạn khi mặt nạ VAD còn khớp trục thời gian của samples
+                def plan_skips(layout):
+                    skip = plan_chunk_skips(samples, mask, layout)
+                    if skip.any():
+                        skipped_samples = sum(end - start for (start, end), skipped in zip(layout, skip) if skipped)
+                        AudioProcessor._record_skipped_denoise(perf_monitor, skipped_samples, int(skip.sum()))
+                    return skip
+            # Khử nhiễu theo từng đoạn chồng lấn để bộ nhớ STFT không tăng theo độ dài file
+            samples = denoise_waveform(samples, denoiser.process_chunk, plan_skips=plan_skips)
+        else:
+            logger.info("Skipping noise reduction")
+
+        if samples is audio:
+            # Không đoạn nào được khử nhiễu và không ghép đoạn: trả lại nguyên buffer của người gọi, không sao chép
+            # chỉ để chuẩn hóa (log-mel của Whisper tự chuẩn hóa theo mức đỉnh)
+            logger.info("Audio unchanged, skipping normalization")
+            return samples, speech_boundaries
+        # samples là buffer mới (ghép đoạn hoặc đầu ra khử nhiễu) nên được chuẩn hóa tại chỗ
+        return AudioProcessor.normalize(samples, in_place=True), speech_boundaries
+
+    @staticmethod
+    def process_audio(input_path: str, output_path: str, apply_noise_reduction: bool = False) -> str:
+        try:
+            logger.info(f"Processing audio with VAD: {input_path} -> {output_path}")
+            audio = decode_audio(input_path, sample_rate=SAMPLE_RATE)
+            processed, _ = AudioProcessor.process_waveform(audio, apply_noise_reduction=apply_noise_reduction)
+            save_wav(output_path, processed, SAMPLE_RATE)
             logger.info(f"Audio processed and saved to: {output_path}")
-            os.remove(vad_output_path)
             return output_path
 
         except Exception as e:
             logger.error(f"Error processing audio: {str(e)}")
-            if os.path.exists(vad_output_path):
-                os.remove(vad_output_path)
-            raise Exception(f"Error processing audio: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Error processing audio: {str(e)}")
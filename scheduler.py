@@ -1,45 +1,36 @@
-import schedule
 import time
 import threading
 import logging
-import os
 from main import AudioTranscriptionService
+from job_worker import JobWorker
 
 logger = logging.getLogger(__name__)
 
-running_lock = threading.Lock()
 stop_event = threading.Event()
 
-def prevent_overlap(func):
-    def wrapper(*args, **kwargs):
-        if running_lock.acquire(blocking=False):
-            try:
-                func(*args, **kwargs)
-            finally:
-                running_lock.release()
-        else:
-            logger.warning(f"Skipping {func.__name__} as previous process is running")
-    return wrapper
+_service = None
 
-@prevent_overlap
-def auto_subtitle_process():
-    logger.info("Running batch processing...")
-    service = AudioTranscriptionService()
-    service.process_batch()
+def get_service() -> AudioTranscriptionService:
+    # Dùng lại một service cho mọi job để mô hình không bị nạp lại
+    global _service
+    if _service is None:
+        _service = AudioTranscriptionService()
+    return _service
 
-def run_scheduler():
-    logger.info("Starting scheduler")
-    schedule.every(60).seconds.do(auto_subtitle_process)
-    while not stop_event.is_set():
-        schedule.run_pending()
-        time.sleep(1)
-
-if __name__ == "__main__":
-    scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
-    scheduler_thread.start()
+def run_worker():
+    # JobWorker là đường xử lý hàng đợi duy nhất: claim job, chạy song song theo slot, được đánh thức khi có job mới
+    worker = JobWorker(service=get_service())
+    worker_thread = threading.Thread(target=worker.run, daemon=True)
+    worker_thread.start()
     try:
         while not stop_event.is_set():
             time.sleep(10)
     except KeyboardInterrupt:
-        logger.info("Stopping scheduler")
-        stop_event.set()
\ No newline at end of file
+        logger.info("Stopping job worker")
+        stop_event.set()
+    worker.stop()
+    worker_thread.join()
+    get_service().shutdown()
+
+if __name__ == "__main__":
+    run_worker()
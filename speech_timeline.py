@@ -0,0 +1,121 @@
+import numpy as np
+from config import SAMPLE_RATE
+
+def to_boundaries(speech_timestamps) -> np.ndarray:
+    """
+    Chuyển kết quả VAD ([{"start", "end"}] theo mẫu, hoặc mảng sẵn có) thành mảng int32 shape (n, 2)
+    gồm [mẫu bắt đầu, mẫu kết thúc] của từng đoạn tiếng nói, sắp theo thời gian.
+    """
+    if isinstance(speech_timestamps, np.ndarray):
+        return speech_timestamps.astype(np.int32, copy=False).reshape(-1, 2)
+    if not speech_timestamps:
+        return np.empty((0, 2), dtype=np.int32)
+    return np.array([[ts['start'], ts['end']] for ts in speech_timestamps], dtype=np.int32)
+
+
+def slice_boundaries(boundaries: np.ndarray, start: int, end: int) -> np.ndarray:
+    """
+    Các đoạn tiếng nói nằm trong [start, end) (theo mẫu của buffer đầy đủ), cắt theo biên
+    và đổi sang offset cục bộ tính từ start, dùng cho một segment là view audio[start:end].
+    """
+    boundaries = to_boundaries(boundaries)
+    inside = (boundaries[:, 1] > start) & (boundaries[:, 0] < end)
+    return (np.clip(boundaries[inside], start, end) - start).astype(np.int32)
+
+
+def speech_seconds(boundaries: np.ndarray, sample_rate: int = SAMPLE_RATE) -> float:
+    boundaries = to_boundaries(boundaries)
+    return float(np.sum(boundaries[:, 1] - boundaries[:, 0], dtype=np.int64)) / sample_rate
+
+
+def clip_timestamps(boundaries: np.ndarray, sample_rate: int = SAMPLE_RATE, merge_gap: float = 1.0, pad: float = 0.2) -> list:
+    """
+    Chuyển các đoạn tiếng nói (theo mẫu) thành danh sách phẳng [start1, end1, start2, end2, ...] (giây)
+    cho clip_timestamps của Whisper. Các đoạn cách nhau dưới merge_gap giây được gộp để tránh quá nhiều cửa sổ nhỏ.
+    """
+    boundaries = to_boundaries(boundaries)
+    if len(boundaries) == 0:
+        return []
+    starts = np.maximum(0.0, boundaries[:, 0] / sample_rate - pad)
+    ends = boundaries[:, 1] / sample_rate + pad
+    # Một cửa sổ mới bắt đầu khi khoảng cách tới điểm kết thúc xa nhất trước đó >= merge_gap
+    new_clip = np.ones(len(boundaries), dtype=bool)
+    new_clip[1:] = starts[1:] - np.maximum.accumulate(ends)[:-1] >= merge_gap
+    first = np.flatnonzero(new_clip)
+    clips = np.column_stack((starts[first], np.maximum.reduceat(ends, first)))
+    return [round(float(t), 3) for t in clips.ravel()]
+
+
+def merge_regions(boundaries: np.ndarray, max_gap: int = 0) -> np.ndarray:
+    """
+    Gộp các đoạn tiếng nói chồng lấn hoặc cách nhau dưới max_gap mẫu thành các vùng liên tục, int32 (m, 2).
+    """
+    boundaries = to_boundaries(boundaries)
+    if len(boundaries) == 0:
+        return boundaries
+    boundaries = boundaries[np.argsort(boundaries[:, 0], kind="stable")]
+    running_end = np.maximum.accumulate(boundaries[:, 1])
+    new_region = np.ones(len(boundaries), dtype=bool)
+    new_region[1:] = boundaries[1:, 0] - running_end[:-1] >= max(max_gap, 1)
+    first = np.flatnonzero(new_region)
+    return np.column_stack((boundaries[first, 0], np.maximum.reduceat(boundaries[:, 1], first))).astype(np.int32)
+
+
+def silence_gaps(boundaries: np.ndarray, total_samples: int, min_gap: int = 1) -> np.ndarray:
+    """
+    Các khoảng không có tiếng nói trong [0, total_samples), kể cả đầu và cuối file, dài ít nhất min_gap mẫu; int32 (m, 2).
+    """
+    regions = np.clip(merge_regions(boundaries), 0, total_samples)
+    starts = np.concatenate(([0], regions[:, 1]))
+    ends = np.concatenate((regions[:, 0], [total_samples]))
+    keep = ends - starts >= max(min_gap, 1)
+    return np.column_stack((starts[keep], ends[keep])).astype(np.int32)
+
+
+def plan_cuts(boundaries: np.ndarray, total_samples: int, sample_rate: int = SAMPLE_RATE, target_sec: float = 480.0, min_sec: float = 300.0, max_sec: float = 600.0, min_silence_sec: float = 0.5, silence_per_minute: float = 2.0) -> np.ndarray:
+    """
+    Điểm cắt (theo mẫu, gồm 0 và total_samples) để chia audio thành các đoạn dài min_sec..max_sec.
+    Mỗi điểm cắt nằm giữa một khoảng lặng trong cửa sổ cho phép, chọn theo điểm = độ dài khoảng lặng (giây)
+    trừ khoảng cách tới target_sec (phút) nhân silence_per_minute: khoảng lặng xa target một phút phải dài hơn
+    silence_per_minute giây mới được chọn, nên điểm cắt bám quanh target_sec thay vì dồn về min_sec.
+    Không có khoảng lặng nào trong cửa sổ thì cắt đúng tại target_sec. Khoảng lặng, điểm giữa và độ dài được
+    tính vector hóa một lần; mỗi điểm cắt chỉ là một lần tìm kiếm nhị phân trên các mảng đó.
+    """
+    min_len, target_len, max_len = (int(s * sample_rate) for s in (min_sec, target_sec, max_sec))
+    gaps = silence_gaps(boundaries, total_samples, int(min_silence_sec * sample_rate)).astype(np.int64)
+    mids = (gaps[:, 0] + gaps[:, 1]) // 2
+    lengths = gaps[:, 1] - gaps[:, 0]
+
+    cuts = [0]
+    while total_samples - cuts[-1] > max_len:
+        current = cuts[-1]
+        # Không để phần còn lại ngắn hơn min_len
+        low = current + min_len
+        high = max(low, min(current + max_len, total_samples - min_len))
+        lo, hi = np.searchsorted(mids, [low, high + 1])
+        if hi > lo:
+            distance = np.abs(mids[lo:hi] - (current + target_len))
+            score = lengths[lo:hi] - distance * (silence_per_minute / 60.0)
+            # Điểm bằng nhau thì chọn khoảng lặng gần target hơn
+            best = lo + np.lexsort((distance, -score))[0]
+            cuts.append(int(mids[best]))
+        else:
+            cuts.append(min(current + target_len, high))
+    cuts.append(total_samples)
+    return np.array(cuts, dtype=np.int64)
+
+
+def timeline_summary(boundaries: np.ndarray, total_samples: int, sample_rate: int = SAMPLE_RATE) -> dict:
+    """
+    Tóm tắt kết quả VAD để ghi log một dòng thay vì từng đoạn.
+    """
+    boundaries = to_boundaries(boundaries)
+    gaps = silence_gaps(boundaries, total_samples)
+    speech = speech_seconds(boundaries, sample_rate)
+    return {
+        "segments": len(boundaries),
+        "speech_sec": round(speech, 2),
+        "speech_ratio": round(speech * sample_rate / total_samples, 3) if total_samples else 0.0,
+        "longest_speech_sec": round(float((boundaries[:, 1] - boundaries[:, 0]).max()) / sample_rate, 2) if len(boundaries) else 0.0,
+        "longest_silence_sec": round(float((gaps[:, 1] - gaps[:, 0]).max()) / sample_rate, 2) if len(gaps) else 0.0
+    }
@@ -84,8 +84,7 @@ function toggleGridSubtitle(index) {
 // Xử lý form
 document.getElementById('subtitle-form').addEventListener('submit', async (e) => {
     e.preventDefault();
-    const formData = new FormData();
-    formData.append('file', document.getElementById('video-file').files[0]);
+    const file = document.getElementById('video-file').files[0];
     const originLanguage = document.getElementById('origin-language').value;
     const translateLanguage = document.getElementById('translate-language').value;
     const useCorrection = document.getElementById('use-correction').checked;
@@ -112,55 +111,26 @@ document.getElementById('subtitle-form').addEventListener('submit', async (e) =>
     if (seekInterval) clearInterval(seekInterval);
     
     try {
-        const response = await fetch(`/process?origin_language=${originLanguage}&translate_language=${translateLanguage}&use_correction=${useCorrection}${embedSubtitle ? `&embed_subtitle=${embedSubtitle}` : ''}`, {
-            method: 'POST',
-            body: formData
+        // Tải file lên theo từng khối rồi đưa vào hàng đợi
+        const uploadId = await uploadFile(file, resultDiv);
+        const response = await fetch(`/uploads/${uploadId}/finalize?origin_language=${originLanguage}&translate_language=${translateLanguage}&use_correction=${useCorrection}${embedSubtitle ? `&embed_subtitle=${embedSubtitle}` : ''}`, {
+            method: 'POST'
         });
-        const data = await response.json();
+        const job = await response.json();
+        if (!response.ok) {
+            processLoading.style.display = 'none';
+            resultDiv.innerHTML = `Lỗi: ${job.detail}`;
+            return;
+        }
+        // Job chạy nền, theo dõi trạng thái cho tới khi kết thúc
+        const data = await waitForJob(job.job_id, resultDiv);
         processLoading.style.display = 'none';
-        if (response.ok) {
-            let resultHtml = `${data.message}<br><a href="/download/${data.subtitle_path}">Tải file phụ đề gốc</a>`;
-            if (data.translated_subtitle_path) {
-                resultHtml += `<br><a href="/download/${data.translated_subtitle_path}">Tải file phụ đề ${data.translated_subtitle_path.includes('_corrected') ? 'đã hiệu chỉnh' : 'đã dịch'}</a>`;
-            }
-            if (data.video_with_subtitle) {
-                resultHtml += `<br><a href="${data.video_url}">Tải video có phụ đề</a>`;
-                videoPlayer.innerHTML = '';
-                if (embedSubtitle === 'soft' && (data.translated_subtitle_path || data.subtitle_path)) {
-                    const subtitlePath = data.translated_subtitle_path || data.subtitle_path;
-                    const subtitleLang = data.translated_subtitle_path ? translateLanguage : originLanguage;
-                    videoPlayer.innerHTML = `
-                        <source src="${data.video_url}" type="video/mp4">
-                        <track id="subtitle-track" src="/download/${subtitlePath}" kind="subtitles" srclang="${subtitleLang}" label="${subtitleLang === 'zh' ? '中文' : subtitleLang === 'ko' ? '한국어' : subtitleLang === 'vi' ? 'Tiếng Việt' : 'English'}" default>
-                        Trình duyệt của bạn không hỗ trợ thẻ video.
-                    `;
-                    subtitleEnabled = true;
-                    toggleSubtitleButton.textContent = 'Tắt phụ đề';
-                    toggleSubtitleButton.classList.remove('hidden');
-                    // Bật phụ đề mặc định
-                    const track = videoPlayer.querySelector('track');
-                    if (track && track.track) {
-                        track.track.mode = 'showing';
-                    }
-                } else {
-                    videoPlayer.innerHTML = `
-                        <source src="${data.video_url}" type="video/mp4">
-                        Trình duyệt của bạn không hỗ trợ thẻ video.
-                    `;
-                    toggleSubtitleButton.classList.add('hidden');
-                }
-                videoPlayer.load();
-                videoSection.classList.remove('hidden');
-                resetButton.classList.remove('hidden');
-                rewindButton.classList.remove('hidden');
-                fastForwardButton.classList.remove('hidden');
-                subtitleInfo.innerHTML = `Phụ đề đã được nhúng ${embedSubtitle === 'hard' ? 'cứng' : embedSubtitle === 'soft' ? 'mềm' : 'không nhúng'}.`;
-            } else {
-                subtitleInfo.innerHTML = '<br><span style="color: red;">Không tạo được video có phụ đề.</span>';
-            }
-            resultDiv.innerHTML = resultHtml;
+        if (data.status === 'COMPLETED') {
+            showProcessResult(data, embedSubtitle, originLanguage, translateLanguage);
+        } else if (data.status === 'CANCELLED') {
+            resultDiv.innerHTML = 'Đã hủy xử lý.';
         } else {
-            resultDiv.innerHTML = `Lỗi: ${data.detail}`;
+            resultDiv.innerHTML = `Lỗi: ${data.error || 'Xử lý thất bại'}`;
         }
     } catch (error) {
         processLoading.style.display = 'none';
@@ -168,6 +138,194 @@ document.getElementById('subtitle-form').addEventListener('submit', async (e) =>
     }
 });
 
+const UPLOAD_MAX_RETRIES = 5;
+const UPLOAD_RETRY_DELAY_MS = 2000;
+
+// Tải file lên theo khối; khi mất kết nối thì hỏi lại offset của server và tải tiếp từ đó
+async function uploadFile(file, resultDiv) {
+    const createResponse = await fetch(`/uploads?file_name=${encodeURIComponent(file.name)}&size=${file.size}`, { method: 'POST' });
+    const upload = await createResponse.json();
+    if (createResponse.status === 429) {
+        throw new Error(`${upload.detail}. Vui lòng thử lại sau ${createResponse.headers.get('Retry-After')} giây.`);
+    }
+    if (!createResponse.ok) {
+        throw new Error(upload.detail);
+    }
+    let offset = upload.offset;
+    let retries = 0;
+    while (offset < file.size) {
+        const chunk = file.slice(offset, Math.min(offset + upload.chunk_size, file.size));
+        try {
+            const response = await fetch(`/uploads/${upload.upload_id}?offset=${offset}`, { method: 'PUT', body: chunk });
+            const data = await response.json();
+            if (response.status === 429) {
+                // Server đang quá tải: chờ theo Retry-After rồi gửi lại khối này
+                const retryAfter = parseInt(response.headers.get('Retry-After') || '1', 10);
+                resultDiv.innerHTML = `Server đang bận, tiếp tục tải lên sau ${retryAfter} giây...`;
+                await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+                continue;
+            }
+            if (response.ok || response.status === 409) {
+                // 409: server đang ở offset khác (khối trước đã được ghi), tiếp tục từ offset của server
+                offset = data.offset;
+                retries = 0;
+            } else {
+                throw new Error(data.detail);
+            }
+        } catch (error) {
+            if (++retries > UPLOAD_MAX_RETRIES) {
+                throw error;
+            }
+            await new Promise(resolve => setTimeout(resolve, UPLOAD_RETRY_DELAY_MS));
+            const statusResponse = await fetch(`/uploads/${upload.upload_id}`).catch(() => null);
+            if (statusResponse && statusResponse.ok) {
+                offset = (await statusResponse.json()).offset;
+            }
+        }
+        resultDiv.innerHTML = `Đang tải lên: ${Math.floor(offset * 100 / file.size)}%`;
+    }
+    return upload.upload_id;
+}
+
+const JOB_POLL_INTERVAL_MS = 2000;
+const TERMINAL_JOB_STATUSES = ['COMPLETED', 'FAILED', 'CANCELLED'];
+
+const LIVE_CUES_SHOWN = 5;
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+}
+
+function formatCueTime(seconds) {
+    const minutes = Math.floor(seconds / 60);
+    return `${minutes}:${(seconds - minutes * 60).toFixed(1).padStart(4, '0')}`;
+}
+
+// Theo dõi job qua Server-Sent Events: bước hiện tại, phần trăm và các câu phụ đề Whisper vừa tạo.
+// Trình duyệt không hỗ trợ hoặc mất kết nối thì chuyển sang hỏi trạng thái định kỳ.
+function waitForJob(jobId, resultDiv) {
+    if (!window.EventSource) {
+        return pollJob(jobId, resultDiv);
+    }
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(`/jobs/${jobId}/events`);
+        const cues = [];
+        let stage = 'queued';
+        let percent = 0;
+        const render = () => {
+            const recentCues = cues.slice(-LIVE_CUES_SHOWN)
+                .map(cue => `<div class="live-cue">[${formatCueTime(cue.start)}] ${escapeHtml(cue.text)}</div>`)
+                .join('');
+            resultDiv.innerHTML = `Đang xử lý (job ${jobId}): ${stage} - ${percent.toFixed(0)}% <button class="btn btn-secondary" onclick="cancelJob(${jobId})">Hủy</button>`
+                + (cues.length ? `<div class="live-cues">Đã có ${cues.length} câu phụ đề:${recentCues}</div>` : '');
+        };
+        source.addEventListener('stage', (e) => {
+            const data = JSON.parse(e.data);
+            stage = data.stage;
+            percent = data.percent;
+            render();
+        });
+        source.addEventListener('progress', (e) => {
+            percent = JSON.parse(e.data).percent;
+            render();
+        });
+        source.addEventListener('cue', (e) => {
+            cues.push(JSON.parse(e.data));
+            render();
+        });
+        source.addEventListener('status', (e) => {
+            const data = JSON.parse(e.data);
+            if (TERMINAL_JOB_STATUSES.includes(data.status)) {
+                source.close();
+                resolve(data);
+                return;
+            }
+            stage = data.stage || data.status;
+            render();
+        });
+        source.onerror = () => {
+            source.close();
+            pollJob(jobId, resultDiv).then(resolve, reject);
+        };
+    });
+}
+
+// Hỏi trạng thái job định kỳ cho tới khi job kết thúc
+async function pollJob(jobId, resultDiv) {
+    while (true) {
+        const response = await fetch(`/jobs/${jobId}`);
+        const data = await response.json();
+        if (!response.ok) {
+            throw new Error(data.detail);
+        }
+        if (TERMINAL_JOB_STATUSES.includes(data.status)) {
+            return data;
+        }
+        const eta = data.eta_seconds != null ? `, còn khoảng ${Math.ceil(data.eta_seconds)} giây` : '';
+        resultDiv.innerHTML = `Đang xử lý (job ${jobId}): ${data.stage || data.status}${eta} <button class="btn btn-secondary" onclick="cancelJob(${jobId})">Hủy</button>`;
+        await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+    }
+}
+
+async function cancelJob(jobId) {
+    await fetch(`/jobs/${jobId}/cancel`, { method: 'POST' });
+}
+
+// Hiển thị kết quả của job đã hoàn thành
+function showProcessResult(data, embedSubtitle, originLanguage, translateLanguage) {
+    const resultDiv = document.getElementById('process-result');
+    const videoPlayer = document.getElementById('video-player');
+    const videoSection = document.getElementById('video-section');
+    const resetButton = document.getElementById('reset-button');
+    const toggleSubtitleButton = document.getElementById('toggle-subtitle');
+    const rewindButton = document.getElementById('rewind-button');
+    const fastForwardButton = document.getElementById('fast-forward-button');
+    const subtitleInfo = document.getElementById('subtitle-info');
+
+    let resultHtml = `${data.message}<br><a href="/download/${data.subtitle_path}">Tải file phụ đề gốc</a>`;
+    if (data.translated_subtitle_path) {
+        resultHtml += `<br><a href="/download/${data.translated_subtitle_path}">Tải file phụ đề ${data.translated_subtitle_path.includes('_corrected') ? 'đã hiệu chỉnh' : 'đã dịch'}</a>`;
+    }
+    if (data.video_with_subtitle) {
+        resultHtml += `<br><a href="${data.video_url}">Tải video có phụ đề</a>`;
+        videoPlayer.innerHTML = '';
+        if (embedSubtitle === 'soft' && (data.translated_subtitle_path || data.subtitle_path)) {
+            const subtitlePath = data.translated_subtitle_path || data.subtitle_path;
+            const subtitleLang = data.translated_subtitle_path ? translateLanguage : originLanguage;
+            videoPlayer.innerHTML = `
+                <source src="${data.video_url}" type="video/mp4">
+                <track id="subtitle-track" src="/download/${subtitlePath}" kind="subtitles" srclang="${subtitleLang}" label="${subtitleLang === 'zh' ? '中文' : subtitleLang === 'ko' ? '한국어' : subtitleLang === 'vi' ? 'Tiếng Việt' : 'English'}" default>
+                Trình duyệt của bạn không hỗ trợ thẻ video.
+            `;
+            subtitleEnabled = true;
+            toggleSubtitleButton.textContent = 'Tắt phụ đề';
+            toggleSubtitleButton.classList.remove('hidden');
+            // Bật phụ đề mặc định
+            const track = videoPlayer.querySelector('track');
+            if (track && track.track) {
+                track.track.mode = 'showing';
+            }
+        } else {
+            videoPlayer.innerHTML = `
+                <source src="${data.video_url}" type="video/mp4">
+                Trình duyệt của bạn không hỗ trợ thẻ video.
+            `;
+            toggleSubtitleButton.classList.add('hidden');
+        }
+        videoPlayer.load();
+        videoSection.classList.remove('hidden');
+        resetButton.classList.remove('hidden');
+        rewindButton.classList.remove('hidden');
+        fastForwardButton.classList.remove('hidden');
+        subtitleInfo.innerHTML = `Phụ đề đã được nhúng ${embedSubtitle === 'hard' ? 'cứng' : embedSubtitle === 'soft' ? 'mềm' : 'không nhúng'}.`;
+    } else {
+        subtitleInfo.innerHTML = '<br><span style="color: red;">Không tạo được video có phụ đề.</span>';
+    }
+    resultDiv.innerHTML = resultHtml;
+}
+
 // Bật/tắt phụ đề cho video player ở Trang 2
 function toggleSubtitle() {
     const videoPlayer = document.getElementById('video-player');
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from denoise_long_audio import chunk_layout, denoise_waveform, iter_denoised_blocks
+
+SAMPLE_RATE = 1000
+
+
+def _streaming(waveform: np.ndarray, segment_samples: int, overlap_samples: int) -> np.ndarray:
+    blocks = iter_denoised_blocks(lambda start, end: waveform[start:end], len(waveform), np.tanh, segment_samples, overlap_samples)
+    return np.concatenate(list(blocks))
+
+
+@pytest.mark.parametrize("overlap_sec", [0.0, 0.25])
+def test_streaming_matches_parallel(overlap_sec):
+    waveform = np.random.default_rng(0).uniform(-1.0, 1.0, 5300).astype(np.float32)
+    # np.tanh là ufunc nên pickle được sang các tiến trình của _denoise_parallel
+    parallel = denoise_waveform(waveform, np.tanh, segment_sec=1.0, overlap_sec=overlap_sec, sample_rate=SAMPLE_RATE, n_jobs=2)
+    streaming = _streaming(waveform, SAMPLE_RATE, int(overlap_sec * SAMPLE_RATE))
+
+    assert len(streaming) == len(waveform)
+    np.testing.assert_allclose(streaming, parallel, atol=1e-6)
+    np.testing.assert_allclose(streaming, np.tanh(waveform), atol=1e-6)
+
+
+def test_zero_overlap_layout_tiles_the_input():
+    layout = chunk_layout(2500, 1000, 0)
+    assert layout == [(0, 1000), (1000, 2000), (2000, 2500)]
+
+
+def test_negative_overlap_is_rejected():
+    with pytest.raises(ValueError):
+        chunk_layout(2500, 1000, -1)
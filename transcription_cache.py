@@ -0,0 +1,86 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Optional
+import numpy as np
+from config import TRANSCRIPTION_CACHE_DIR, TRANSCRIPTION_CACHE_MAX_MB
+
+logger = logging.getLogger(__name__)
+
+class TranscriptionCache:
+    """
+    Cache kết quả phiên âm trên đĩa, khóa theo hash của PCM 16 kHz đã giải mã
+    cùng tên mô hình, ngôn ngữ và tùy chọn giải mã. Giới hạn dung lượng, loại bỏ theo LRU (mtime).
+    """
+    def __init__(self, cache_dir: str = TRANSCRIPTION_CACHE_DIR, max_size_mb: float = TRANSCRIPTION_CACHE_MAX_MB):
+        self.cache_dir = cache_dir
+        self.max_size_bytes = int(max_size_mb * 1024**2)
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(audio: np.ndarray, model_name: str, language: str, options: dict) -> str:
+        digest = hashlib.sha256()
+        digest.update(memoryview(np.ascontiguousarray(audio, dtype=np.float32)).cast("B"))
+        digest.update(json.dumps(
+            {"model": model_name, "language": language, "options": options},
+            sort_keys=True
+        ).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> Optional[list]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                segments = json.load(f)
+            # Cập nhật mtime để đánh dấu vừa được dùng (LRU)
+            os.utime(path, None)
+            logger.info(f"Transcription cache hit: {key}")
+            return segments
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable transcription cache entry {path}: {str(e)}")
+            return None
+
+    def put(self, key: str, segments: list) -> None:
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(segments, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+            logger.info(f"Stored transcription cache entry: {key}")
+        except Exception as e:
+            logger.warning(f"Failed to write transcription cache entry {path}: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self._evict()
+
+    def _evict(self) -> None:
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total_size <= self.max_size_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                    total_size -= size
+                    logger.info(f"Evicted transcription cache entry: {name}")
+                except FileNotFoundError:
+                    continue
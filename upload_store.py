@@ -0,0 +1,230 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import hashlib
+import logging
+from typing import AsyncIterator, Dict, Optional
+from config import UPLOAD_FOLDER, UPLOAD_CHUNK_BYTES, UPLOAD_SESSION_TTL_SEC
+
+logger = logging.getLogger(__name__)
+
+PART_SUFFIX = ".part"
+SESSION_FILE = "upload.json"
+
+
+class UploadOffsetMismatch(Exception):
+    """
+    Khối tải lên không bắt đầu tại offset hiện tại của phiên; client cần hỏi lại offset rồi tiếp tục.
+    """
+    def __init__(self, offset: int):
+        super().__init__(f"Upload offset mismatch, current offset is {offset}")
+        self.offset = offset
+
+
+class UploadStore:
+    """
+    Ghi file tải lên thẳng xuống đĩa theo từng khối cố định, tính sha256 tăng dần trong lúc ghi,
+    nên bộ nhớ của API không phụ thuộc kích thước file.
+
+    Mỗi phiên tải lên nằm trong thư mục riêng UPLOAD_FOLDER/<upload_id>/ gồm upload.json (tên file, kích thước)
+    và <tên file>.part; offset của phiên chính là kích thước file .part nên tải tiếp sau khi mất kết nối
+    (hoặc sau khi API khởi động lại) chỉ cần hỏi lại offset. Trạng thái sha256 giữ trong bộ nhớ; nếu mất
+    (API khởi động lại) thì được tính lại từ phần đã ghi ở lần tải tiếp theo.
+    Phiên không có dữ liệu mới quá session_ttl giây bị xóa ở lần mở phiên kế tiếp.
+    """
+    def __init__(self, root: str = UPLOAD_FOLDER, chunk_bytes: int = UPLOAD_CHUNK_BYTES, session_ttl: float = UPLOAD_SESSION_TTL_SEC):
+        self.root = root
+        self.chunk_bytes = chunk_bytes
+        self.session_ttl = session_ttl
+        self._hashers = {}
+        self._locks = {}
+
+    def _session_dir(self, upload_id: str) -> str:
+        # upload_id do store tạo (uuid hex); kiểm tra để id từ URL không trỏ ra ngoài thư mục upload
+        if not upload_id or not all(c in "0123456789abcdef" for c in upload_id):
+            raise KeyError(upload_id)
+        return os.path.join(self.root, upload_id)
+
+    def _lock(self, upload_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(upload_id, asyncio.Lock())
+
+    def new_upload_dir(self) -> tuple:
+        upload_id = uuid.uuid4().hex
+        upload_dir = os.path.join(self.root, upload_id)
+        os.makedirs(upload_dir, exist_ok=True)
+        return upload_id, upload_dir
+
+    def _hash_file(self, path: str):
+        hasher = hashlib.sha256()
+        with open(path, "rb") as f:
+            while True:
+                block = f.read(self.chunk_bytes)
+                if not block:
+                    return hasher
+                hasher.update(block)
+
+    @staticmethod
+    def _append(f, hasher, block: bytes) -> None:
+        f.write(block)
+        hasher.update(block)
+
+    async def _write_stream(self, stream: AsyncIterator[bytes], path: str, hasher, mode: str, max_bytes: Optional[int] = None) -> int:
+        """
+        Ghi luồng byte vào path theo khối chunk_bytes; việc ghi và băm chạy ngoài event loop.
+        Luồng dài hơn max_bytes ném ValueError trước khi phần vượt quá được ghi xuống đĩa.
+        """
+        written = 0
+        pending = bytearray()
+        with open(path, mode) as f:
+            async for data in stream:
+                if max_bytes is not None and written + len(pending) + len(data) > max_bytes:
+                    raise ValueError("Upload exceeds declared size")
+                pending.extend(data)
+                if len(pending) >= self.chunk_bytes:
+                    block, pending = bytes(pending), bytearray()
+                    await asyncio.to_thread(self._append, f, hasher, block)
+                    written += len(block)
+            if pending:
+                await asyncio.to_thread(self._append, f, hasher, bytes(pending))
+                written += len(pending)
+        return written
+
+    async def save_upload_file(self, upload_file, path: str) -> tuple:
+        """
+        Ghi một UploadFile (multipart) xuống path theo từng khối; trả về (số byte, sha256 hex).
+        """
+        async def chunks():
+            while True:
+                data = await upload_file.read(self.chunk_bytes)
+                if not data:
+                    return
+                yield data
+
+        hasher = hashlib.sha256()
+        size = await self._write_stream(chunks(), path, hasher, "wb")
+        return size, hasher.hexdigest()
+
+    def sweep_expired(self) -> int:
+        """
+        Xóa các phiên chưa finalize không nhận dữ liệu trong session_ttl giây (tính từ created_at hoặc lần ghi
+        cuối vào file .part); thư mục đã finalize thuộc về job và không bị đụng tới. Trả về số phiên đã xóa.
+        """
+        if not os.path.isdir(self.root):
+            return 0
+        removed = 0
+        now = time.time()
+        for upload_id in os.listdir(self.root):
+            try:
+                session = self._session(upload_id)
+                last_activity = max(session.get("created_at", 0), os.path.getmtime(self._part_path(upload_id, session)))
+            except (KeyError, OSError, ValueError):
+                continue
+            if now - last_activity > self.session_ttl:
+                logger.info(f"Removing upload {upload_id} idle for {now - last_activity:.0f}s")
+                self.discard(upload_id)
+                removed += 1
+        return removed
+
+    def create(self, file_name: str, size: int) -> Dict:
+        """
+        Mở phiên mới; ValueError nếu tên file rỗng hoặc là "." / "..".
+        """
+        file_name = os.path.basename(file_name)
+        if file_name in ("", ".", ".."):
+            raise ValueError("Invalid file name")
+        self.sweep_expired()
+        upload_id, upload_dir = self.new_upload_dir()
+        session = {"upload_id": upload_id, "file_name": file_name, "size": size, "created_at": time.time()}
+        with open(os.path.join(upload_dir, SESSION_FILE), "w", encoding="utf-8") as f:
+            json.dump(session, f)
+        open(os.path.join(upload_dir, session["file_name"] + PART_SUFFIX), "wb").close()
+        self._hashers[upload_id] = hashlib.sha256()
+        logger.info(f"Created upload {upload_id} for {session['file_name']} ({size} bytes)")
+        return self.status(upload_id)
+
+    def _session(self, upload_id: str) -> Dict:
+        session_path = os.path.join(self._session_dir(upload_id), SESSION_FILE)
+        if not os.path.exists(session_path):
+            raise KeyError(upload_id)
+        with open(session_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _part_path(self, upload_id: str, session: Dict) -> str:
+        return os.path.join(self._session_dir(upload_id), session["file_name"] + PART_SUFFIX)
+
+    def status(self, upload_id: str) -> Dict:
+        """
+        Trạng thái phiên: {"upload_id", "file_name", "size", "offset", "chunk_size"}; KeyError nếu không tồn tại.
+        """
+        session = self._session(upload_id)
+        offset = os.path.getsize(self._part_path(upload_id, session))
+        return {**session, "offset": offset, "chunk_size": self.chunk_bytes}
+
+    async def append(self, upload_id: str, offset: int, stream: AsyncIterator[bytes]) -> Dict:
+        """
+        Ghi tiếp một khối bắt đầu tại offset. Offset khác kích thước hiện tại ném UploadOffsetMismatch;
+        ghi vượt quá kích thước khai báo ném ValueError.
+        """
+        async with self._lock(upload_id):
+            session = self._session(upload_id)
+            part_path = self._part_path(upload_id, session)
+            current = os.path.getsize(part_path)
+            if offset != current:
+                raise UploadOffsetMismatch(current)
+            hasher = self._hashers.get(upload_id)
+            if hasher is None:
+                hasher = await asyncio.to_thread(self._hash_file, part_path)
+                self._hashers[upload_id] = hasher
+            try:
+                await self._write_stream(stream, part_path, hasher, "ab", max_bytes=session["size"] - current)
+            except Exception:
+                # Khối dở dang hoặc vượt kích thước khai báo: cắt file về offset cũ để trạng thái băm và kích thước luôn khớp nhau
+                with open(part_path, "r+b") as f:
+                    f.truncate(current)
+                self._hashers.pop(upload_id, None)
+                raise
+            return self.status(upload_id)
+
+    async def finalize(self, upload_id: str) -> tuple:
+        """
+        Kết thúc phiên đã đủ dữ liệu: đổi tên file .part thành tên gốc trong cùng thư mục và xóa thông tin phiên.
+        Trả về (đường dẫn file, sha256 hex).
+        """
+        async with self._lock(upload_id):
+            session = self._session(upload_id)
+            part_path = self._part_path(upload_id, session)
+            offset = os.path.getsize(part_path)
+            if offset != session["size"]:
+                raise UploadOffsetMismatch(offset)
+            hasher = self._hashers.pop(upload_id, None)
+            if hasher is None:
+                hasher = await asyncio.to_thread(self._hash_file, part_path)
+            file_path = os.path.join(self._session_dir(upload_id), session["file_name"])
+            os.replace(part_path, file_path)
+            os.remove(os.path.join(self._session_dir(upload_id), SESSION_FILE))
+        self._locks.pop(upload_id, None)
+        logger.info(f"Finalized upload {upload_id}: {file_path}")
+        return file_path, hasher.hexdigest()
+
+    @staticmethod
+    def remove_job_file(file_path: str) -> None:
+        """
+        Xóa file tải lên của một job đã kết thúc (hoặc bị hủy khi còn chờ) cùng thư mục riêng của nó nếu đã rỗng.
+        """
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
+            try:
+                os.rmdir(os.path.dirname(file_path))
+            except OSError:
+                pass
+
+    def discard(self, upload_id: str) -> None:
+        upload_dir = self._session_dir(upload_id)
+        if not os.path.isdir(upload_dir):
+            raise KeyError(upload_id)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        self._hashers.pop(upload_id, None)
+        self._locks.pop(upload_id, None)
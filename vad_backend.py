@@ -0,0 +1,20 @@
+from config import SAMPLE_RATE, VAD_BACKEND
+
+VAD_BACKENDS = ("silero", "silero_onnx", "funasr")
+
+
+def create_vad_processor(backend: str = VAD_BACKEND, sampling_rate: int = SAMPLE_RATE):
+    """
+    Tạo VAD processor theo config.VAD_BACKEND ("silero" TorchScript hoặc "silero_onnx" ONNX Runtime, "funasr" fsmn-vad).
+    Mọi backend có cùng giao diện detect_boundaries / stream / stream_file / process.
+    """
+    if backend == "silero":
+        from vad_speeched import SileroVADProcessor
+        return SileroVADProcessor(sampling_rate=sampling_rate)
+    if backend == "silero_onnx":
+        from vad_silero_onnx import SileroOnnxVADProcessor
+        return SileroOnnxVADProcessor(sampling_rate=sampling_rate)
+    if backend == "funasr":
+        from funasr_vad_processor import FunasrVADProcessor
+        return FunasrVADProcessor(sampling_rate=sampling_rate)
+    raise ValueError(f"Unsupported VAD backend: {backend}")
@@ -0,0 +1,127 @@
+import os
+import shutil
+import logging
+import numpy as np
+from typing import Iterable, Iterator
+from config import SILERO_VAD_DIR, VAD_ONNX_THREADS, VAD_ONNX_BATCH_LANES, VAD_ONNX_WARMUP_WINDOWS
+from model_registry import model_registry
+from vad_speeched import SileroVADProcessor
+
+logger = logging.getLogger(__name__)
+
+STATE_SHAPE = (2, 128)
+
+
+def load_silero_vad_onnx(num_threads: int = VAD_ONNX_THREADS):
+    import onnxruntime as ort
+
+    os.makedirs(SILERO_VAD_DIR, exist_ok=True)
+    model_path = os.path.join(SILERO_VAD_DIR, "silero_vad.onnx")
+    if not os.path.exists(model_path):
+        # Gói silero-vad đi kèm sẵn file ONNX, chép vào thư mục mô hình để các lần sau không phụ thuộc gói
+        from importlib import resources
+        with resources.as_file(resources.files("silero_vad.data") / "silero_vad.onnx") as packaged:
+            shutil.copyfile(packaged, model_path)
+        logger.info(f"Copied SileroVAD ONNX model to {model_path}")
+
+    # Số luồng đặt ở mức session, không ảnh hưởng torch.set_num_threads của các mô hình khác
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = num_threads
+    options.inter_op_num_threads = 1
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+    logger.info(f"Loaded SileroVAD ONNX model from {model_path} with {num_threads} intra-op threads")
+    return session
+
+
+class SileroOnnxVADProcessor(SileroVADProcessor):
+    """
+    Silero VAD chạy bằng ONNX Runtime. Trạng thái mô hình (state + context 64 mẫu) được truyền tường minh
+    mỗi lần gọi nên một session dùng chung được cho nhiều luồng, và nhiều cửa sổ có thể chấm điểm trong một lần gọi:
+    detect_boundaries chia buffer thành batch_lanes làn liên tiếp, mỗi làn có trạng thái riêng, rồi chạy các làn
+    song song theo từng bước trong một batch.
+    """
+    def __init__(self, sampling_rate=16000, num_threads: int = VAD_ONNX_THREADS, batch_lanes: int = VAD_ONNX_BATCH_LANES, warmup_windows: int = VAD_ONNX_WARMUP_WINDOWS, **segmenter_options):
+        super().__init__(sampling_rate=sampling_rate, **segmenter_options)
+        self.num_threads = num_threads
+        self.batch_lanes = max(1, batch_lanes)
+        self.warmup_windows = warmup_windows
+        self.context_size = 64 if sampling_rate == 16000 else 32
+        self.model_key = f"silero_vad_onnx:{num_threads}"
+
+    @property
+    def session(self):
+        return model_registry.get(self.model_key, lambda: load_silero_vad_onnx(self.num_threads))
+
+    def _run(self, session, windows: np.ndarray, context: np.ndarray, state: np.ndarray) -> tuple:
+        """
+        Chấm điểm một batch cửa sổ [batch, window] với context [batch, context_size]; trả về (xác suất, state mới).
+        """
+        inputs = {
+            "input": np.concatenate((context, windows), axis=1),
+            "state": state,
+            "sr": np.array(self.sampling_rate, dtype=np.int64)
+        }
+        probs, state = session.run(None, inputs)
+        return probs[:, 0], state
+
+    def _stream_probs(self, chunks: Iterable[np.ndarray]) -> Iterator[float]:
+        session = self.session
+        state = np.zeros((STATE_SHAPE[0], 1, STATE_SHAPE[1]), dtype=np.float32)
+        context = np.zeros((1, self.context_size), dtype=np.float32)
+        for window in self._iter_windows(chunks):
+            window = window[np.newaxis, :]
+            probs, state = self._run(session, window, context, state)
+            context = window[:, -self.context_size:]
+            yield float(probs[0])
+
+    def _batched_probs(self, waveform: np.ndarray) -> np.ndarray:
+        """
+        Xác suất của mọi cửa sổ trong buffer. Làn k phụ trách các cửa sổ [k*L, (k+1)*L) và bắt đầu sớm
+        warmup_windows cửa sổ để trạng thái mô hình ổn định; xác suất trong phần khởi động bị bỏ.
+        """
+        window = self.window_size_samples
+        n_full = len(waveform) // window
+        n_windows = n_full + (1 if len(waveform) % window else 0)
+        frames = waveform[:n_full * window].reshape(n_full, window)
+        tail = np.pad(waveform[n_full * window:], (0, window - len(waveform) % window)) if n_windows > n_full else None
+
+        def gather(indices):
+            # Lấy các cửa sổ theo chỉ số mà không chép toàn bộ buffer; chỉ số ngoài phạm vi cho cửa sổ 0
+            batch = np.zeros((len(indices), window), dtype=np.float32)
+            full = (indices >= 0) & (indices < n_full)
+            batch[full] = frames[indices[full]]
+            if tail is not None:
+                batch[indices == n_full] = tail
+            return batch
+
+        lanes = min(self.batch_lanes, max(1, n_windows))
+        lane_length = -(-n_windows // lanes)
+        owned_start = np.arange(lanes) * lane_length
+        run_start = np.maximum(owned_start - self.warmup_windows, 0)
+        steps = int((owned_start + lane_length - run_start).max())
+
+        session = self.session
+        probs = np.zeros(n_windows, dtype=np.float32)
+        state = np.zeros((STATE_SHAPE[0], lanes, STATE_SHAPE[1]), dtype=np.float32)
+        context = np.zeros((lanes, self.context_size), dtype=np.float32)
+        for step in range(steps):
+            indices = run_start + step
+            windows = gather(indices)
+            step_probs, state = self._run(session, windows, context, state)
+            context = windows[:, -self.context_size:]
+            owned = (indices >= owned_start) & (indices < np.minimum(owned_start + lane_length, n_windows))
+            probs[indices[owned]] = step_probs[owned]
+        return probs
+
+    def detect_boundaries(self, waveform: np.ndarray) -> np.ndarray:
+        logger.info(f"Running ONNX VAD on audio with {self.batch_lanes} batched lanes")
+        waveform = np.ascontiguousarray(waveform, dtype=np.float32)
+        probs = self._batched_probs(waveform)
+        segments = list(self._segments_from_probs(probs, len(waveform)))
+        boundaries = np.array(segments, dtype=np.int32).reshape(-1, 2)
+        if len(boundaries):
+            logger.info(f"Found {len(boundaries)} speech segments")
+        else:
+            logger.warning("No speech detected by VAD.")
+        return boundaries
@@ -1,108 +1,315 @@
 import os
 import torch
 import torchaudio
-import torchaudio.transforms as T
 import logging
 import numpy as np
-from scipy.io import wavfile
+import soundfile as sf
+from typing import Iterable, Iterator
+from audio_decoder import iter_decode_audio, READ_CHUNK_BYTES
 from config import SILERO_VAD_DIR
+from model_registry import model_registry
+from speech_timeline import to_boundaries, slice_boundaries
 
 logger = logging.getLogger(__name__)
 
+SILERO_VAD_KEY = "silero_vad"
+# Số cửa sổ 512 mẫu (khoảng 8 giây) chấm điểm trong một lần giữ mô hình khi chạy streaming
+STREAM_BATCH_WINDOWS = 256
+# Thuộc tính trạng thái của mô hình Silero TorchScript (v5: _state/_context, v4: _h/_c), lưu lại giữa các lô
+MODEL_STATE_ATTRIBUTES = ("_state", "_context", "_h", "_c", "_last_sr", "_last_batch_size")
+
+def load_silero_vad_model():
+    try:
+        # Kiểm tra thư mục lưu mô hình SileroVAD
+        os.makedirs(SILERO_VAD_DIR, exist_ok=True)
+        model_path = os.path.join(SILERO_VAD_DIR, "silero_vad.jit")
+
+        if not os.path.exists(model_path):
+            logger.info(f"SileroVAD model not found at {model_path}. Downloading...")
+            # Tải mô hình từ torch.hub và lưu vào SILERO_VAD_DIR
+            model, utils = torch.hub.load(
+                repo_or_dir='snakers4/silero-vad',
+                model='silero_vad',
+                force_reload=True,  # Tải mới nếu chưa có
+                trust_repo=True
+            )
+            # Lưu mô hình vào thư mục cục bộ
+            torch.jit.save(model, model_path)
+            logger.info(f"SileroVAD model saved to {model_path}")
+        else:
+            logger.info(f"Loading SileroVAD model from {model_path}")
+            model = torch.jit.load(model_path)
+
+        get_speech_timestamps = torch.hub.load(
+            repo_or_dir='snakers4/silero-vad',
+            model='silero_vad',
+            force_reload=False,
+            trust_repo=True,
+            skip_validation=True
+        )[1][0]  # Lấy hàm get_speech_timestamps từ utils
+        logger.info(f"Using torchaudio version: {torchaudio.__version__}")
+        logger.info(f"Loaded silero-vad model successfully from {SILERO_VAD_DIR}")
+        return model, get_speech_timestamps
+    except Exception as e:
+        logger.error(f"Error loading silero-vad model: {str(e)}")
+        raise
+
+class SpeechSegmenter:
+    """
+    Máy trạng thái tách đoạn tiếng nói từ xác suất theo từng cửa sổ, cùng quy tắc với
+    get_speech_timestamps của Silero (threshold / neg_threshold = threshold - 0.15, độ dài tối thiểu
+    của tiếng nói và khoảng lặng, đệm hai đầu) nhưng trả về từng đoạn ngay khi đoạn đó chắc chắn kết thúc.
+
+    Đệm giống get_speech_timestamps: khoảng lặng giữa hai đoạn ngắn hơn 2 * speech_pad được chia đôi cho
+    hai đoạn, còn lại mỗi đầu được đệm speech_pad. Đệm cuối của một đoạn phụ thuộc đoạn kế tiếp nên đoạn
+    chỉ được trả về khi mọi đoạn sau chắc chắn bắt đầu cách nó ít nhất 2 * speech_pad (ngay lúc kết thúc
+    khi min_silence_duration_ms >= 2 * speech_pad_ms, như cấu hình mặc định).
+    """
+    def __init__(self, sampling_rate=16000, window_size_samples=512, threshold=0.2, min_speech_duration_ms=200, min_silence_duration_ms=500, speech_pad_ms=30):
+        self.window_size_samples = window_size_samples
+        self.threshold = threshold
+        self.neg_threshold = max(threshold - 0.15, 0.01)
+        self.min_speech_samples = sampling_rate * min_speech_duration_ms // 1000
+        self.min_silence_samples = sampling_rate * min_silence_duration_ms // 1000
+        self.speech_pad_samples = sampling_rate * speech_pad_ms // 1000
+        self.position = 0
+        self._triggered = False
+        self._start = 0
+        self._temp_end = 0
+        # Đoạn đã kết thúc đang chờ đệm cuối: (start đã đệm, end chưa đệm)
+        self._pending = None
+
+    def _close(self, start, end) -> list:
+        """
+        Đoạn [start, end) chưa đệm vừa kết thúc; trả về đoạn trước đó nếu giờ đã biết đệm cuối của nó.
+        """
+        if end - start <= self.min_speech_samples:
+            return []
+        pad = self.speech_pad_samples
+        released = []
+        if self._pending is None:
+            padded_start = max(0, start - pad)
+        else:
+            pending_start, pending_end = self._pending
+            silence = start - pending_end
+            shift = silence // 2 if silence < 2 * pad else pad
+            released.append((pending_start, pending_end + shift))
+            padded_start = start - shift
+        self._pending = (padded_start, end)
+        return released
+
+    def _release(self, total_samples=None) -> list:
+        """
+        Trả về đoạn đang chờ với đệm cuối speech_pad khi không đoạn nào sau nó có thể bắt đầu trong vòng
+        2 * speech_pad (hoặc khi luồng đã kết thúc ở total_samples).
+        """
+        if self._pending is None:
+            return []
+        pending_start, pending_end = self._pending
+        if total_samples is None:
+            next_start = self._start if self._triggered else self.position
+            if next_start - pending_end < 2 * self.speech_pad_samples:
+                return []
+            end = pending_end + self.speech_pad_samples
+        else:
+            end = min(total_samples, pending_end + self.speech_pad_samples)
+        self._pending = None
+        return [(pending_start, end)]
+
+    def push(self, speech_prob) -> list:
+        """
+        Nhận xác suất tiếng nói của cửa sổ kế tiếp; trả về danh sách (start, end) theo mẫu của các đoạn vừa chốt.
+        """
+        window_start = self.position
+        self.position += self.window_size_samples
+        segments = []
+        if speech_prob >= self.threshold and self._temp_end:
+            self._temp_end = 0
+        if speech_prob >= self.threshold and not self._triggered:
+            self._triggered = True
+            self._start = window_start
+        elif speech_prob < self.neg_threshold and self._triggered:
+            if not self._temp_end:
+                self._temp_end = window_start
+            if window_start - self._temp_end >= self.min_silence_samples:
+                self._triggered = False
+                end, self._temp_end = self._temp_end, 0
+                segments = self._close(self._start, end)
+        return segments + self._release()
+
+    def finish(self, total_samples) -> list:
+        """
+        Kết thúc luồng; trả về các đoạn còn lại, đoạn đang mở (nếu có) kéo tới total_samples.
+        """
+        self.position = total_samples
+        segments = []
+        if self._triggered:
+            self._triggered = False
+            segments = self._close(self._start, total_samples)
+        return segments + self._release(total_samples)
+
+
 class SileroVADProcessor:
-    def __init__(self, sampling_rate=16000):
+    def __init__(self, sampling_rate=16000, threshold=0.2, min_speech_duration_ms=200, min_silence_duration_ms=500, speech_pad_ms=30):
+        # Mô hình được nạp một lần qua registry; tạo processor mới không tốn chi phí nạp lại
         self.sampling_rate = sampling_rate
-        try:
-            # Kiểm tra thư mục lưu mô hình SileroVAD
-            os.makedirs(SILERO_VAD_DIR, exist_ok=True)
-            model_path = os.path.join(SILERO_VAD_DIR, "silero_vad.jit")
-
-            if not os.path.exists(model_path):
-                logger.info(f"SileroVAD model not found at {model_path}. Downloading...")
-                # Tải mô hình từ torch.hub và lưu vào SILERO_VAD_DIR
-                model, utils = torch.hub.load(
-                    repo_or_dir='snakers4/silero-vad',
-                    model='silero_vad',
-                    force_reload=True,  # Tải mới nếu chưa có
-                    trust_repo=True
-                )
-                # Lưu mô hình vào thư mục cục bộ
-                torch.jit.save(model, model_path)
-                logger.info(f"SileroVAD model saved to {model_path}")
+        self.window_size_samples = 512 if sampling_rate == 16000 else 256
+        self.segmenter_options = {
+            "threshold": threshold,
+            "min_speech_duration_ms": min_speech_duration_ms,
+            "min_silence_duration_ms": min_silence_duration_ms,
+            "speech_pad_ms": speech_pad_ms
+        }
+
+    def _iter_windows(self, chunks: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        """
+        Cắt các khối có độ dài bất kỳ thành cửa sổ window_size_samples; cửa sổ cuối được đệm 0 như get_speech_timestamps.
+        """
+        window = self.window_size_samples
+        remainder = np.empty(0, dtype=np.float32)
+        for chunk in chunks:
+            data = np.concatenate((remainder, np.asarray(chunk, dtype=np.float32)))
+            n_windows = len(data) // window
+            for i in range(n_windows):
+                yield data[i * window:(i + 1) * window]
+            remainder = data[n_windows * window:]
+        if len(remainder):
+            yield np.pad(remainder, (0, window - len(remainder)))
+
+    @staticmethod
+    def _save_state(model) -> dict:
+        return {name: getattr(model, name) for name in MODEL_STATE_ATTRIBUTES if hasattr(model, name)}
+
+    @staticmethod
+    def _restore_state(model, state: dict) -> None:
+        for name, value in state.items():
+            setattr(model, name, value)
+
+    def _score_windows(self, windows: list, state) -> tuple:
+        """
+        Chấm điểm một lô cửa sổ liên tiếp của một luồng; state là trạng thái mô hình sau lô trước (None ở lô đầu).
+        Trả về (xác suất, trạng thái sau lô này).
+        """
+        # Silero TorchScript giữ trạng thái nội bộ nên truy cập được tuần tự hóa; lease chỉ giữ trong một lô,
+        # trạng thái của luồng được lưu ra ngoài để các luồng khác dùng mô hình giữa hai lô
+        with model_registry.lease(SILERO_VAD_KEY, load_silero_vad_model, exclusive=True) as (model, _):
+            if state is None:
+                model.reset_states()
             else:
-                logger.info(f"Loading SileroVAD model from {model_path}")
-                model = torch.jit.load(model_path)
+                self._restore_state(model, state)
+            with torch.no_grad():
+                probs = [model(torch.from_numpy(window), self.sampling_rate).item() for window in windows]
+            return probs, self._save_state(model)
 
-            self.model = model
-            self.get_speech_timestamps = torch.hub.load(
-                repo_or_dir='snakers4/silero-vad',
-                model='silero_vad',
-                force_reload=False,
-                trust_repo=True,
-                skip_validation=True
-            )[1][0]  # Lấy hàm get_speech_timestamps từ utils
-            logger.info(f"Using torchaudio version: {torchaudio.__version__}")
-            logger.info(f"Loaded silero-vad model successfully from {SILERO_VAD_DIR}")
-        except Exception as e:
-            logger.error(f"Error loading silero-vad model: {str(e)}")
-            raise
+    def _stream_probs(self, chunks: Iterable[np.ndarray]) -> Iterator[float]:
+        """
+        Xác suất tiếng nói của từng cửa sổ, trạng thái mô hình được giữ qua các cửa sổ.
+        """
+        state = None
+        batch = []
+        for window in self._iter_windows(chunks):
+            batch.append(window)
+            if len(batch) == STREAM_BATCH_WINDOWS:
+                probs, state = self._score_windows(batch, state)
+                batch = []
+                yield from probs
+        if batch:
+            probs, state = self._score_windows(batch, state)
+            yield from probs
+
+    def _segments_from_probs(self, probs: Iterable[float], total_samples) -> Iterator[tuple]:
+        """
+        total_samples: số mẫu của luồng, hoặc hàm trả về số đó (chỉ biết được khi luồng đã hết).
+        """
+        segmenter = SpeechSegmenter(self.sampling_rate, self.window_size_samples, **self.segmenter_options)
+        for prob in probs:
+            yield from segmenter.push(prob)
+        yield from segmenter.finish(total_samples() if callable(total_samples) else total_samples)
+
+    def stream(self, chunks: Iterable[np.ndarray]) -> Iterator[tuple]:
+        """
+        VAD dạng streaming: nhận các khối audio mono float32 có độ dài bất kỳ, chạy Silero trên từng cửa sổ
+        512 mẫu với trạng thái mô hình được giữ qua các cửa sổ, và trả về (start, end) theo mẫu của từng đoạn
+        tiếng nói ngay khi đoạn đó kết thúc. Bộ nhớ chỉ gồm một khối và phần dư chưa đủ cửa sổ.
+
+        Với backend TorchScript, mô hình Silero chỉ được giữ độc quyền trong lúc chấm điểm một lô
+        STREAM_BATCH_WINDOWS cửa sổ, không giữ trong lúc generator chờ người dùng đọc tiếp.
+        """
+        total_samples = 0
+
+        def counted():
+            nonlocal total_samples
+            for chunk in chunks:
+                total_samples += len(chunk)
+                yield chunk
+
+        return self._segments_from_probs(self._stream_probs(counted()), lambda: total_samples)
+
+    def stream_file(self, input_path: str) -> Iterator[tuple]:
+        """
+        Chạy VAD streaming trực tiếp trên đầu ra của ffmpeg, không giữ toàn bộ file trong bộ nhớ.
+        """
+        return self.stream(iter_decode_audio(input_path, sample_rate=self.sampling_rate))
+
+    def detect(self, waveform: np.ndarray) -> list:
+        """
+        Phát hiện các đoạn tiếng nói trên waveform mono float32 đã ở đúng tần số lấy mẫu.
+        """
+        return [{"start": int(start), "end": int(end)} for start, end in self.detect_boundaries(waveform)]
+
+    def detect_boundaries(self, waveform: np.ndarray) -> np.ndarray:
+        """
+        Như detect nhưng trả về mảng int32 (n, 2) [start, end] theo mẫu, dạng dùng chung cho
+        chia đoạn, ước lượng nhiễu và chọn vùng ASR (xem speech_timeline).
+        """
+        logger.info("Running VAD on audio")
+        # Duyệt buffer theo các view để không tạo bản sao tensor của toàn bộ audio
+        step = READ_CHUNK_BYTES // 4
+        boundaries = to_boundaries(np.array(list(self.stream(waveform[i:i + step] for i in range(0, len(waveform), step)))))
+        if len(boundaries):
+            logger.info(f"Found {len(boundaries)} speech segments")
+        else:
+            logger.warning("No speech detected by VAD.")
+        return boundaries
 
     def process(self, input_path, output_path):
+        """
+        Ghi các đoạn tiếng nói của input_path nối liền vào output_path. Cả hai lượt (VAD, rồi ghi)
+        đều đọc file theo luồng nên bộ nhớ không phụ thuộc độ dài file.
+        """
         if not os.path.exists(input_path):
             raise FileNotFoundError(f"Input file not found: {input_path}")
         try:
-            logger.info(f"Loading input audio: {input_path}")
-            waveform, sample_rate = torchaudio.load(input_path)
-            logger.info(f"Input waveform shape: {waveform.shape}, sample rate: {sample_rate}")
-            if sample_rate != self.sampling_rate:
-                logger.info(f"Resampling audio from {sample_rate} Hz to {self.sampling_rate} Hz")
-                resampler = T.Resample(orig_freq=sample_rate, new_freq=self.sampling_rate)
-                waveform = resampler(waveform)
-            logger.info(f"Resampled waveform shape: {waveform.shape}")
-
-            logger.info("Running VAD on audio")
-            if waveform.shape[0] > 1:
-                logger.info("Converting stereo to mono for VAD")
-                waveform_vad = waveform.mean(dim=0, keepdim=True)
-            else:
-                waveform_vad = waveform
-
-            speech_timestamps = self.get_speech_timestamps(
-                waveform_vad,
-                self.model,
-                sampling_rate=self.sampling_rate,
-                threshold=0.2,
-                min_speech_duration_ms=200,
-                min_silence_duration_ms=500
-            )
-            if not speech_timestamps:
-                logger.warning("No speech detected by VAD. Using original audio.")
-                audio = waveform.mean(dim=0, keepdim=True).numpy().T
-                if audio.dtype != np.int16:
-                    audio = (audio * 32767).astype(np.int16)
-                wavfile.write(output_path, self.sampling_rate, audio)
-                logger.info(f"Saved original audio to: {output_path}")
-                return speech_timestamps
-
-            logger.info(f"Found {len(speech_timestamps)} speech segments")
-
-            chunks = [waveform[:, int(ts["start"]):int(ts["end"])] for ts in speech_timestamps]
-            if not chunks:
-                raise Exception("No valid audio chunks after VAD processing.")
-            merged = torch.cat(chunks, dim=1)
-            if merged.ndim == 1:
-                logger.info("Converting mono waveform to 2D")
-                merged = merged.unsqueeze(0)
-            logger.info(f"Merged waveform shape: {merged.shape}")
-
-            logger.info(f"Saving processed audio to: {output_path}")
-            waveform_np = merged.numpy().T
-            if waveform_np.dtype != np.int16:
-                waveform_np = (waveform_np * 32767).astype(np.int16)
-            wavfile.write(output_path, self.sampling_rate, waveform_np)
-            logger.info(f"Audio saved successfully to: {output_path}")
-            return speech_timestamps
+            boundaries = to_boundaries(np.array(list(self.stream_file(input_path))))
+            save_speech_segments(input_path, output_path, boundaries, self.sampling_rate)
+            return [{"start": int(start), "end": int(end)} for start, end in boundaries]
         except Exception as e:
             logger.error(f"Error in VAD processing: {str(e)}")
             raise
-        
\ No newline at end of file
+
+
+def save_speech_segments(input_path: str, output_path: str, boundaries: np.ndarray, sampling_rate: int = 16000) -> int:
+    """
+    Giải mã lại input_path theo luồng và chỉ ghi các mẫu nằm trong boundaries (int32 (n, 2) theo mẫu)
+    vào output_path; không có đoạn tiếng nói nào thì ghi nguyên audio. Trả về số mẫu đã ghi.
+    """
+    boundaries = to_boundaries(boundaries)
+    written = 0
+    offset = 0
+    with sf.SoundFile(output_path, "w", samplerate=sampling_rate, channels=1, subtype="PCM_16") as out_file:
+        for chunk in iter_decode_audio(input_path, sample_rate=sampling_rate):
+            if len(boundaries) == 0:
+                out_file.write(np.clip(chunk, -1.0, 1.0))
+                written += len(chunk)
+                continue
+            # Chỉ ghi phần giao giữa khối hiện tại và các đoạn tiếng nói
+            for start, end in slice_boundaries(boundaries, offset, offset + len(chunk)):
+                out_file.write(np.clip(chunk[start:end], -1.0, 1.0))
+                written += end - start
+            offset += len(chunk)
+    if len(boundaries) == 0:
+        logger.warning("No speech detected by VAD.")
+        logger.info(f"Saved original audio to: {output_path}")
+    else:
+        logger.info(f"Merged {len(boundaries)} speech segments ({written / sampling_rate:.2f}s) into: {output_path}")
+    return written
@@ -1,82 +1,94 @@
 import os
 import json
 import logging
-from moviepy.editor import VideoFileClip
-from vad_speeched import SileroVADProcessor
+import numpy as np
+from vad_backend import create_vad_processor
+import speech_timeline
+from audio_decoder import decode_audio, save_wav
+from config import SAMPLE_RATE
 
 logger = logging.getLogger(__name__)
 
 class VideoSplitter:
     MIN_SEGMENT_DURATION = 300  # 5 phút
     MAX_SEGMENT_DURATION = 600  # 10 phút
+    TARGET_SEGMENT_DURATION = 480  # 8 phút
     MIN_SILENCE_DURATION_MS = 500  # 500ms
 
+    @staticmethod
+    def split_waveform(audio: np.ndarray, sample_rate: int = SAMPLE_RATE, speech_boundaries: np.ndarray = None) -> list:
+        """
+        Chia buffer audio đã giải mã tại các khoảng im lặng.
+        speech_boundaries: kết quả VAD đã có trên toàn buffer (int32 (n, 2) theo mẫu); None thì chạy VAD tại đây.
+        Trả về danh sách {"start", "end", "start_sample", "end_sample", "audio"} với audio là view của buffer gốc (không copy).
+        """
+        duration = len(audio) / sample_rate
+        if duration <= VideoSplitter.MAX_SEGMENT_DURATION:
+            logger.info(f"Audio duration {duration}s is less than 10 minutes, no splitting needed")
+            return [{"start": 0.0, "end": duration, "start_sample": 0, "end_sample": len(audio), "audio": audio}]
+
+        # Phát hiện khoảng im lặng
+        if speech_boundaries is None:
+            speech_boundaries = create_vad_processor(sampling_rate=sample_rate).detect_boundaries(audio)
+        speech_boundaries = speech_timeline.to_boundaries(speech_boundaries)
+
+        # Điểm cắt tính theo mẫu trên các khoảng lặng (xem speech_timeline.plan_cuts)
+        cut_samples = speech_timeline.plan_cuts(
+            speech_boundaries, len(audio), sample_rate,
+            target_sec=VideoSplitter.TARGET_SEGMENT_DURATION,
+            min_sec=VideoSplitter.MIN_SEGMENT_DURATION,
+            max_sec=VideoSplitter.MAX_SEGMENT_DURATION,
+            min_silence_sec=VideoSplitter.MIN_SILENCE_DURATION_MS / 1000
+        )
+
+        segments = []
+        for start_sample, end_sample in zip(cut_samples[:-1].tolist(), cut_samples[1:].tolist()):
+            segments.append({
+                "start": start_sample / sample_rate,
+                "end": end_sample / sample_rate,
+                "start_sample": start_sample,
+                "end_sample": end_sample,
+                "audio": audio[start_sample:end_sample]
+            })
+        lengths = np.diff(cut_samples) / sample_rate
+        logger.info(f"Planned {len(segments)} audio segments of {lengths.min():.2f}s..{lengths.max():.2f}s at cuts {[round(c / sample_rate, 2) for c in cut_samples[1:-1].tolist()]}")
+        return segments
+
+    @staticmethod
+    def save_timestamp_map(segment_names: list, segments: list, output_dir: str) -> str:
+        timestamp_map = {
+            name: {"start": segment["start"], "end": segment["end"]}
+            for name, segment in zip(segment_names, segments)
+        }
+        map_path = os.path.join(output_dir, "map.json")
+        with open(map_path, "w", encoding="utf-8") as f:
+            json.dump(timestamp_map, f, indent=2)
+        logger.info(f"Saved timestamp map to: {map_path}")
+        return map_path
+
     @staticmethod
     def split_video(video_path: str, output_dir: str) -> tuple[list, str]:
         try:
             logger.info(f"Analyzing video: {video_path}")
             os.makedirs(output_dir, exist_ok=True)
-            video = VideoFileClip(video_path)
-            duration = video.duration
+            audio = decode_audio(video_path, sample_rate=SAMPLE_RATE)
+            segments = VideoSplitter.split_waveform(audio, SAMPLE_RATE)
 
-            if duration <= VideoSplitter.MAX_SEGMENT_DURATION:
-                logger.info(f"Video duration {duration}s is less than 5 minutes, no splitting needed")
+            if len(segments) == 1:
                 output_path = os.path.join(output_dir, f"full_{os.path.basename(video_path)}.wav")
-                video.audio.write_audiofile(output_path, codec='pcm_s16le')
-                video.close()
+                save_wav(output_path, audio, SAMPLE_RATE)
                 return [output_path], None
 
-            # Phát hiện khoảng im lặng
-            temp_audio = os.path.join(output_dir, "temp_audio.wav")
-            video.audio.write_audiofile(temp_audio, codec='pcm_s16le')
-            vad_processor = SileroVADProcessor()
-            speech_timestamps = vad_processor.process(temp_audio, temp_audio.replace(".wav", "_vad.wav"))
-            os.remove(temp_audio)
-
-            silence_intervals = []
-            last_end = 0
-            for ts in speech_timestamps:
-                if ts['start'] - last_end >= VideoSplitter.MIN_SILENCE_DURATION_MS:
-                    silence_intervals.append((last_end / 1000, ts['start'] / 1000))
-                last_end = ts['end']
-            if last_end / 1000 < duration:
-                silence_intervals.append((last_end / 1000, duration))
-
-            # Tìm điểm cắt
-            cut_points = [0]
-            current_time = 0
-            for silence_start, silence_end in silence_intervals:
-                if silence_end - current_time >= VideoSplitter.MIN_SEGMENT_DURATION and silence_end <= VideoSplitter.MAX_SEGMENT_DURATION:
-                    cut_points.append(silence_end)
-                    current_time = silence_end
-                elif silence_end - current_time > VideoSplitter.MAX_SEGMENT_DURATION:
-                    cut_points.append(current_time + VideoSplitter.MAX_SEGMENT_DURATION)
-                    current_time += VideoSplitter.MAX_SEGMENT_DURATION
-            if current_time < duration:
-                cut_points.append(duration)
-
-            # Cắt video và lưu timestamp
+            # Lưu từng đoạn và timestamp
             audio_paths = []
-            timestamp_map = {}
-            for i in range(len(cut_points) - 1):
-                start_time = cut_points[i]
-                end_time = min(cut_points[i + 1], duration)
-                output_path = os.path.join(output_dir, f"segment_{i}_{start_time}_{end_time}.wav")
-                video_segment = video.subclip(start_time, end_time)
-                video_segment.audio.write_audiofile(output_path, codec='pcm_s16le')
+            for segment in segments:
+                output_path = os.path.join(output_dir, f"segment_{len(audio_paths)}_{segment['start']}_{segment['end']}.wav")
+                save_wav(output_path, segment["audio"], SAMPLE_RATE)
                 audio_paths.append(output_path)
-                timestamp_map[os.path.basename(output_path)] = {"start": start_time, "end": end_time}
                 logger.info(f"Extracted audio segment: {output_path}")
 
-            video.close()
-
-            # Lưu timestamp map
-            map_path = os.path.join(output_dir, "map.json")
-            with open(map_path, "w", encoding="utf-8") as f:
-                json.dump(timestamp_map, f, indent=2)
-            logger.info(f"Saved timestamp map to: {map_path}")
-
+            map_path = VideoSplitter.save_timestamp_map([os.path.basename(p) for p in audio_paths], segments, output_dir)
             return audio_paths, map_path
         except Exception as e:
             logger.error(f"Error splitting video: {str(e)}")
-            raise Exception(f"Error splitting video: {str(e)}")
\ No newline at end of file
+            raise Exception(f"Error splitting video: {str(e)}")
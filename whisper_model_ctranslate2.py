@@ -0,0 +1,69 @@
+import os
+import logging
+import numpy as np
+from typing import Callable, Optional
+from faster_whisper import WhisperModel
+from asr_backend import BaseTranscriber
+from model_registry import model_registry
+from config import CT2_WHISPER_MODEL, CT2_COMPUTE_TYPE, CT2_CPU_THREADS
+
+logger = logging.getLogger(__name__)
+
+class WhisperCTranslate2Transcriber(BaseTranscriber):
+    """
+    Engine Whisper chạy trên CTranslate2 (faster-whisper) với trọng số int8 cho CPU.
+    faster-whisper trả về segment dạng generator nên on_segment được gọi ngay khi từng segment được giải mã.
+    """
+    engine_name = "ctranslate2"
+    streams_segments = True
+
+    def __init__(self, model_path: str = CT2_WHISPER_MODEL, compute_type: str = CT2_COMPUTE_TYPE, cpu_threads: int = CT2_CPU_THREADS):
+        super().__init__()
+        self.model_path = model_path
+        self.compute_type = compute_type
+        self.cpu_threads = cpu_threads
+
+        if not os.path.exists(model_path):
+            logger.error(f"CTranslate2 Whisper model not found at {model_path}")
+            raise FileNotFoundError(f"CTranslate2 Whisper model not found at {model_path}")
+
+        self.model_key = f"whisper_ct2:{model_path}:{compute_type}"
+
+    def _load_model(self):
+        logger.info(f"Loading CTranslate2 Whisper model from {self.model_path} ({self.compute_type}, cpu_threads={self.cpu_threads})")
+        model = WhisperModel(
+            self.model_path,
+            device="cpu",
+            compute_type=self.compute_type,
+            cpu_threads=self.cpu_threads
+        )
+        logger.info(f"CTranslate2 Whisper model successfully loaded from {self.model_path}")
+        return model
+
+    @property
+    def model_name(self) -> str:
+        return f"{os.path.basename(os.path.normpath(self.model_path))}:{self.compute_type}"
+
+    def _transcribe(self, audio: np.ndarray, language: str, decode_options: dict, on_segment: Optional[Callable[[dict], None]] = None) -> list:
+        with model_registry.lease(self.model_key, self._load_model) as model:
+            # beam_size=1 để giải mã tham lam giống transcribe của openai-whisper với temperature=0
+            segments, _ = model.transcribe(
+                audio,
+                language=language,
+                beam_size=1,
+                **decode_options
+            )
+            results = []
+            for segment in segments:
+                results.append({
+                    "text": segment.text,
+                    "start": segment.start,
+                    "end": segment.end,
+                    "words": [
+                        {"word": word.word, "start": word.start, "end": word.end, "probability": word.probability}
+                        for word in (segment.words or [])
+                    ]
+                })
+                if on_segment is not None:
+                    on_segment(results[-1])
+            return results
@@ -3,44 +3,92 @@ import logging
 import torch
 import warnings
 import os
+import numpy as np
+from typing import Callable, List, Optional
+from asr_backend import BaseTranscriber
+from config import OPENAI_STREAM_WINDOW_SEC
+from model_registry import model_registry
 
 warnings.filterwarnings("ignore", category=FutureWarning, module='whisper')
 
 logger = logging.getLogger(__name__)
 
-class WhisperOpenAITranscriber:
-    def __init__(self, model_name='large-v3.pt', directory='/data/datn/models'):
+class WhisperOpenAITranscriber(BaseTranscriber):
+    """
+    openai-whisper chỉ trả kết quả khi transcribe xong, nên các vùng tiếng nói (clip_timestamps) được giải mã
+    theo từng cửa sổ stream_window giây: on_segment được gọi sau mỗi cửa sổ, lease mô hình giữ theo cửa sổ,
+    và văn bản cuối của cửa sổ trước làm initial_prompt cho cửa sổ sau để giữ ngữ cảnh.
+    """
+    engine_name = "openai"
+    streams_segments = True
+
+    def __init__(self, model_name='large-v3.pt', directory='/data/datn/models', stream_window: float = OPENAI_STREAM_WINDOW_SEC):
+        super().__init__()
+        self.stream_window = stream_window
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Loading Whisper model {model_name} from directory {directory} on {self.device}")
-        model_file = os.path.join(directory, model_name)
-
-        if not os.path.exists(model_file):
-            logger.error(f"Model file not found at {model_file}")
-            raise FileNotFoundError(f"Model weights not found at {model_file}")
-
-        self.model = whisper.load_model(model_file, device=self.device)
-        logger.info(f"Whisper model successfully loaded from {model_file}")
-
-    def transcribe_audio(self, audio_path: str, language: str = "vi") -> list:
-        try:
-            logger.info(f"Transcribing audio: {audio_path} with language {language}")
-            result = self.model.transcribe(
-                audio_path,
-                language=language,
-                word_timestamps=True,
-                temperature=0.0
-            )
-            segments = result["segments"]
-            transcribed_text = [
-                {
+        self.model_file = os.path.join(directory, model_name)
+
+        if not os.path.exists(self.model_file):
+            logger.error(f"Model file not found at {self.model_file}")
+            raise FileNotFoundError(f"Model weights not found at {self.model_file}")
+
+        # Mô hình được nạp lười qua registry ở lần phiên âm đầu tiên và dùng chung cho mọi instance
+        self.model_key = f"whisper:{self.model_file}:{self.device}"
+
+    def _load_model(self):
+        logger.info(f"Loading Whisper model from {self.model_file} on {self.device}")
+        model = whisper.load_model(self.model_file, device=self.device)
+        logger.info(f"Whisper model successfully loaded from {self.model_file}")
+        return model
+
+    @property
+    def model(self):
+        return model_registry.get(self.model_key, self._load_model)
+
+    @property
+    def model_name(self) -> str:
+        return os.path.basename(self.model_file)
+
+    def _clip_windows(self, clip_timestamps: List[float]) -> List[List[float]]:
+        """
+        Gom các cặp [start, end] liên tiếp thành cửa sổ dài ít nhất stream_window giây (trừ cửa sổ cuối).
+        """
+        windows, current = [], []
+        for start, end in zip(clip_timestamps[0::2], clip_timestamps[1::2]):
+            current += [start, end]
+            if current[-1] - current[0] >= self.stream_window:
+                windows.append(current)
+                current = []
+        if current:
+            windows.append(current)
+        return windows
+
+    def _transcribe(self, audio: np.ndarray, language: str, decode_options: dict, on_segment: Optional[Callable[[dict], None]] = None) -> list:
+        clip_timestamps = decode_options.get("clip_timestamps")
+        windows = self._clip_windows(clip_timestamps) if clip_timestamps and self.stream_window > 0 else [clip_timestamps]
+        results = []
+        for window in windows:
+            options = dict(decode_options)
+            if window is not None:
+                options["clip_timestamps"] = window
+            if results:
+                options["initial_prompt"] = " ".join(segment["text"].strip() for segment in results[-3:])
+            with model_registry.lease(self.model_key, self._load_model) as model:
+                result = model.transcribe(
+                    audio,
+                    language=language,
+                    **options
+                )
+            for segment in result["segments"]:
+                results.append({
                     "text": segment["text"],
                     "start": segment["start"],
-                    "end": segment["end"]
-                }
-                for segment in segments
-            ]
-            logger.info(f"Transcription completed with {len(transcribed_text)} segments")
-            return transcribed_text
-        except Exception as e:
-            logger.error(f"Error transcribing audio: {str(e)}")
-            raise Exception(f"Error transcribing audio: {str(e)}")
\ No newline at end of file
+                    "end": segment["end"],
+                    "words": [
+                        {"word": word["word"], "start": word["start"], "end": word["end"], "probability": word.get("probability")}
+                        for word in segment.get("words", [])
+                    ]
+                })
+                if on_segment is not None:
+                    on_segment(results[-1])
+        return results